@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+cdrip-cues.py
+Finds the cue points the playout automation needs for each archived track:
+  audio_start  where the leading silence ends
+  fade_start   where the ending drops FADE_DB below the body of the track and stays
+               there, the segue point
+  audio_end    where the trailing silence starts
+Times are in seconds from the start of the file.
+
+The 16-bit stereo PCM is memory-mapped and reduced to one RMS value per 10 ms window
+with NumPy, a minute of audio per call; everything after that works on those few
+thousand values. Tracks are analysed side by side in a process pool, and the batch
+throughput is reported.
+
+Results go to ripped.db (table track_cues, next to written_tracks) with --db,
+otherwise they are only printed. cdrip-sqlite.py has the kept tracks analysed
+through the outbox, so the rip handler never waits for it.
+
+Requirements: Python 3, numpy (pip install numpy).
+Run: python cdrip-cues.py [--db PATH --title ALBUM] [--track ID FILE]... [FILE...]
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from cdrip_tools import load_tool
+
+DB_PATH = r"c:\temp\cdrip\ripped.db"
+
+RATE = 44100
+WINDOW = RATE // 100            # 10 ms RMS windows
+WINDOWS_PER_CHUNK = 6000        # 60 s of audio per NumPy pass
+SILENCE_DBFS = -48.0            # quieter than this is silence
+SMOOTHING = 100                 # windows, the fade search looks at 1 s averages
+FADE_DB = 12.0                  # this far below the body of the track counts as faded out
+
+wav_data = load_tool("cdrip-loudness.py").wav_data
+
+def window_power(path):
+    """Mean square of both channels per 10 ms window, full scale = 1.0. Returns (power, seconds)."""
+    offset, nbytes, fmt = wav_data(path)
+    if fmt[0] != 1 or fmt[1] != 2 or fmt[2] != RATE or fmt[5] != 16:
+        raise ValueError(f"not 16-bit 44.1 kHz stereo PCM: {fmt}")
+    frames = nbytes // 4
+    windows = frames // WINDOW
+    if windows == 0:
+        return np.zeros(0), frames / RATE
+    pcm = np.memmap(path, dtype="<i2", mode="r", offset=offset, shape=(frames, 2))
+    power = []
+    chunk = WINDOW * WINDOWS_PER_CHUNK
+    for start in range(0, windows * WINDOW, chunk):
+        end = min(windows * WINDOW, start + chunk)
+        x = pcm[start:end].astype(np.float32).reshape(-1, WINDOW, 2)
+        power.append(np.einsum("wfc,wfc->w", x, x) / (2 * WINDOW * 32768.0 ** 2))
+    del pcm
+    return np.concatenate(power), frames / RATE
+
+def find_cues(power, seconds):
+    """The cue points of a track from its 10 ms window powers, as a dict."""
+    cues = {"seconds": seconds, "audio_start": None, "fade_start": None, "audio_end": None}
+    with np.errstate(divide="ignore"):
+        level = 10 * np.log10(power)
+    audible = np.flatnonzero(level > SILENCE_DBFS)
+    if len(audible) == 0:
+        return cues
+    first, last = audible[0], audible[-1]
+    cues["audio_start"] = round(first * WINDOW / RATE, 2)
+    cues["audio_end"] = round((last + 1) * WINDOW / RATE, 2)
+
+    # the body of the track is the median of its 1 s averages, the fade starts after the
+    # last 1 s average that comes within FADE_DB of it
+    body = power[first:last + 1]
+    if len(body) >= SMOOTHING:
+        csum = np.concatenate(([0.0], np.cumsum(body, dtype=np.float64)))
+        with np.errstate(divide="ignore"):
+            smooth = 10 * np.log10((csum[SMOOTHING:] - csum[:-SMOOTHING]) / SMOOTHING)
+        loud = np.flatnonzero(smooth >= np.median(smooth) - FADE_DB)
+        # the average at index i covers windows i .. i + SMOOTHING - 1, take its middle
+        fade = first + loud[-1] + SMOOTHING // 2
+        cues["fade_start"] = round(min(fade, last + 1) * WINDOW / RATE, 2)
+    else:
+        cues["fade_start"] = cues["audio_end"]
+    return cues
+
+def analyse(path):
+    return find_cues(*window_power(path))
+
+def _analyse_one(path):
+    try:
+        return path, analyse(path), None
+    except (OSError, ValueError) as e:
+        return path, None, str(e)
+
+def analyse_files(paths, workers=None):
+    """({path: cues}, {path: error}) for a list of WAV files, analysed side by side."""
+    results, errors = {}, {}
+    paths = list(dict.fromkeys(paths))
+    if len(paths) == 1:
+        outcomes = [_analyse_one(paths[0])]
+    else:
+        # as in cdrip-loudness.py: worker processes only when this file is the script being run
+        executor = ProcessPoolExecutor if __name__ == "__main__" else ThreadPoolExecutor
+        with executor(max_workers=workers) as pool:
+            outcomes = list(pool.map(_analyse_one, paths))
+    for path, result, error in outcomes:
+        if error is None:
+            results[path] = result
+        else:
+            errors[path] = error
+    return results, errors
+
+def store_db(db_path, title, tracks, results):
+    """tracks: [(track id, path)]. One track_cues row per analysed track."""
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS track_cues (
+            title TEXT,
+            track_id TEXT,
+            filepath TEXT,
+            seconds REAL,
+            audio_start REAL,
+            fade_start REAL,
+            audio_end REAL,
+            analysed REAL,
+            PRIMARY KEY (title, track_id)
+        )
+        """)
+        now = time.time()
+        rows = []
+        for track_id, path in tracks:
+            c = results.get(path)
+            if c:
+                rows.append((title, track_id, path, c["seconds"], c["audio_start"], c["fade_start"], c["audio_end"], now))
+        with conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO track_cues
+                    (title, track_id, filepath, seconds, audio_start, fade_start, audio_end, analysed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+    finally:
+        conn.close()
+
+def run(tracks, db_path=None, title=None, workers=None):
+    """
+    Analyses [(track id, path)] and stores the results.
+    Returns ({path: cues}, {path: error}, seconds of audio per second of work).
+    """
+    t0 = time.perf_counter()
+    results, errors = analyse_files([path for _, path in tracks], workers)
+    if db_path:
+        store_db(db_path, title, tracks, results)
+    audio = sum(c["seconds"] for c in results.values())
+    return results, errors, audio / max(time.perf_counter() - t0, 1e-9)
+
+def main():
+    parser = argparse.ArgumentParser("Cue point detection for archived tracks")
+    parser.add_argument("files", nargs="*", help="WAV files, stored under their file name")
+    parser.add_argument("--track", nargs=2, action="append", default=[], metavar=("ID", "FILE"),
+                        help="WAV file stored under a track id such as 'T01 a1b2c3d4'")
+    parser.add_argument("--db", default=None, help=f"Store the results in this ripped.db (such as {DB_PATH})")
+    parser.add_argument("--title", default="", help="Album title the tracks are filed under in ripped.db")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    tracks = [tuple(t) for t in args.track] + [(os.path.basename(f), f) for f in args.files]
+    if not tracks:
+        parser.error("no files to analyse")
+    t0 = time.perf_counter()
+    results, errors, speed = run(tracks, args.db, args.title, args.workers)
+    for track_id, path in tracks:
+        c = results.get(path)
+        if c and c["audio_start"] is not None:
+            print(f'{track_id}: audio {c["audio_start"]:.2f} s, fade {c["fade_start"]:.2f} s, '
+                  f'end {c["audio_end"]:.2f} s, {c["seconds"] - c["audio_end"]:.2f} s trailing silence')
+        elif c:
+            print(f"{track_id}: silent")
+        else:
+            print(f"{track_id}: {errors.get(path)}")
+    audio = sum(c["seconds"] for c in results.values())
+    print(f"{len(results)} tracks, {audio / 60:.1f} minutes of audio in {time.perf_counter() - t0:.1f} s "
+          f"({speed:.0f}x real time)")
+    if errors and not results:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+cdrip-events.py
+Pushes newly archived material to the playout importer and anything else that wants
+to know, instead of having them poll ripped.db or the log file.
+
+cdrip-sqlite.py records one event per archived file in the archive_events table of
+ripped.db, in the same transaction as the track itself (see archiveEvents): kind
+("track" in trackMode, "disc" otherwise), CDDB id, track id, album title, track title,
+file path and time. seq numbers the events in the order they were archived, so the
+table is a durable event log that a reader can resume anywhere in.
+
+  serve   the broker. Subscribers connect to it on a local TCP port and get every
+          event as one line of JSON, first the ones they haven't seen yet, then new
+          ones as they are archived. After each commit the handler sends a datagram to
+          the same port number (UDP, eventPort in cdrip-sqlite.py), and the broker
+          reads the new events and sends them on, typically within milliseconds. It
+          also looks in the table every RESCAN seconds, to pick up events recorded
+          while nobody told it (cdrip-sqlite-batch.py --effects, a lost datagram).
+
+  follow  a subscriber that prints the events as JSON lines, for piping into other
+          tools or for trying the broker out.
+
+  status  the last event and how far behind every named subscriber is.
+
+  prune   deletes events that every named subscriber has acknowledged and that are
+          older than --days.
+
+Subscriber protocol: connect, send one line of JSON, {"name": "playout"} to resume
+after the last event acknowledged under that name, and/or {"from": 123} to start at
+that seq. Then read event lines; send {"ack": seq} lines for what has been handled,
+and the broker stores the offset in the event_offsets table. A subscriber that
+reconnects, or a broker that restarts, carries on where it left off, and events are
+delivered at least once. Programs in Python can use Subscription from this file.
+
+Requirements: Python 3 (no external packages).
+Run: python cdrip-events.py serve [--db PATH] [--port 8766]
+     python cdrip-events.py follow [--name NAME] [--from SEQ]
+     python cdrip-events.py status | prune --days 90 [--db PATH]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import pathlib
+import argparse
+import threading
+import socketserver
+
+from cdrip_tools import load_tool
+
+DB_PATH = r"c:\temp\cdrip\ripped.db"
+HOST = "127.0.0.1"      # local only
+PORT = 8766             # TCP for subscribers, UDP for the handler's wake-up call
+RESCAN = 30.0           # seconds between looks at the table without a wake-up call
+SEND_TIMEOUT = 10.0     # a subscriber that doesn't read for this long is dropped
+BACKLOG_BATCH = 1000    # events read from the table at a time
+
+COLUMNS = ["seq", "kind", "cddb_id", "track_id", "title", "track_title", "filepath", "created"]
+
+# ----------------------------------------------------------
+# The event log
+# ----------------------------------------------------------
+def open_db(path=DB_PATH):
+    """Read-write connection; the handler's open_db() adds the event tables to an older file."""
+    conn = load_tool("cdrip-sqlite.py").open_db(path)
+    conn.close()
+    return sqlite3.connect(path, isolation_level=None, timeout=10, check_same_thread=False)
+
+def open_ro(path=DB_PATH):
+    uri = pathlib.Path(os.path.abspath(path)).as_uri() + "?mode=ro"
+    return sqlite3.connect(uri, uri=True, timeout=10, check_same_thread=False)
+
+def read_events(conn, after=0, limit=BACKLOG_BATCH):
+    """Events with seq > after, oldest first, as dicts."""
+    rows = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM archive_events WHERE seq > ? ORDER BY seq LIMIT ?",
+                        (after, limit))
+    events = [dict(zip(COLUMNS, row)) for row in rows]
+    for e in events:
+        e["time"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(e["created"]))
+    return events
+
+def last_seq(conn):
+    # from the AUTOINCREMENT counter, which pruning the table doesn't reset
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name='archive_events'").fetchone()
+    return row[0] if row else 0
+
+def stored_offset(conn, name):
+    row = conn.execute("SELECT seq FROM event_offsets WHERE name=?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def store_offset(conn, name, seq):
+    # never moves back, a late ack from an old connection doesn't undo a newer one
+    conn.execute("""
+        INSERT INTO event_offsets (name, seq, updated) VALUES (?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET seq=excluded.seq, updated=excluded.updated WHERE excluded.seq > seq
+    """, (name, seq, time.time()))
+
+# ----------------------------------------------------------
+# Broker
+# ----------------------------------------------------------
+class Subscriber:
+    def __init__(self, sock, name, next_seq):
+        self.sock = sock
+        self.name = name
+        self.next_seq = next_seq    # the first event this subscriber hasn't been sent
+        self.lock = threading.Lock()
+        self.alive = True
+
+    def send(self, events, after=None):
+        """
+        Sends the events it hasn't had yet; call with self.lock held. With `after`, only
+        when it has had everything up to there, a subscriber still behind gets the events
+        with its backlog instead.
+        """
+        if after is not None and self.next_seq <= after:
+            return
+        events = [e for e in events if e["seq"] >= self.next_seq]
+        if not events or not self.alive:
+            return
+        try:
+            self.sock.sendall("".join(json.dumps(e) + "\n" for e in events).encode("utf-8"))
+            self.next_seq = events[-1]["seq"] + 1
+        except OSError:
+            self.alive = False
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+class Broker:
+    def __init__(self, db_path, verbose=False):
+        self.db_path = db_path
+        self.verbose = verbose
+        self.rw = open_db(db_path)
+        self.rw_lock = threading.Lock()
+        self.ro = open_ro(db_path)
+        self.ro_lock = threading.Lock()
+        self.subscribers = set()
+        self.subscribers_lock = threading.Lock()
+        self.seen = last_seq(self.ro)   # events up to here have been handed to the subscribers
+        self.wake = threading.Event()
+
+    def log(self, message):
+        if self.verbose:
+            print(f'{time.strftime("%H:%M:%S")} {message}', flush=True)
+
+    def fetch(self, after):
+        with self.ro_lock:
+            return read_events(self.ro, after)
+
+    def publish(self):
+        """Reads the events recorded since the last look and sends them to everybody."""
+        while True:
+            events = self.fetch(self.seen)
+            if not events:
+                return
+            with self.subscribers_lock:
+                subscribers = list(self.subscribers)
+            for sub in subscribers:
+                with sub.lock:
+                    sub.send(events, self.seen)
+            self.seen = events[-1]["seq"]
+            self.log(f"published events {events[0]['seq']}-{self.seen} to {len(subscribers)} subscribers")
+
+    def run_publisher(self):
+        while True:
+            self.wake.wait(RESCAN)
+            self.wake.clear()
+            try:
+                self.publish()
+            except sqlite3.Error as e:
+                self.log(f"reading the events failed: {e}")     # tried again on the next wake-up
+
+    def subscribe(self, sock, name, start):
+        """Registers a subscriber and sends it its backlog, then live events reach it through publish()."""
+        if start is None:
+            with self.rw_lock:
+                start = stored_offset(self.rw, name) + 1 if name else self.seen + 1
+        sub = Subscriber(sock, name, start)
+        # registered before the backlog is read, so nothing published meanwhile falls in between
+        with self.subscribers_lock:
+            self.subscribers.add(sub)
+        with sub.lock:
+            while sub.alive:
+                events = self.fetch(sub.next_seq - 1)
+                if not events:
+                    break
+                sub.send(events)
+        self.log(f"subscriber {name or '(anonymous)'} from event {start}")
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.subscribers_lock:
+            self.subscribers.discard(sub)
+        self.log(f"subscriber {sub.name or '(anonymous)'} left at event {sub.next_seq - 1}")
+
+    def ack(self, sub, seq):
+        if sub.name and isinstance(seq, int):
+            with self.rw_lock:
+                store_offset(self.rw, sub.name, min(seq, sub.next_seq - 1))
+
+def _lines(sock):
+    """The lines a subscriber sends, as parsed JSON; None for a line that isn't."""
+    buffer = b""
+    while True:
+        try:
+            data = sock.recv(4096)
+        except socket.timeout:
+            continue            # the timeout is for sending, acks can be a long time apart
+        except OSError:
+            return
+        if not data:
+            return
+        *lines, buffer = (buffer + data).split(b"\n")
+        for line in lines:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+class SubscriberHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        broker = self.server.broker
+        self.request.settimeout(SEND_TIMEOUT)
+        lines = _lines(self.request)
+        hello = next(lines, None)
+        if not isinstance(hello, dict):
+            return
+        start = hello.get("from")
+        sub = broker.subscribe(self.request, hello.get("name"), start if isinstance(start, int) else None)
+        try:
+            for line in lines:
+                if isinstance(line, dict):
+                    broker.ack(sub, line.get("ack"))
+        finally:
+            broker.unsubscribe(sub)
+
+class WakeHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.broker.wake.set()
+
+class SubscriberServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def serve(db_path=DB_PATH, host=HOST, port=PORT, verbose=False):
+    broker = Broker(db_path, verbose)
+    tcp = SubscriberServer((host, port), SubscriberHandler)
+    udp = socketserver.UDPServer((host, port), WakeHandler)
+    tcp.broker = udp.broker = broker
+    threading.Thread(target=broker.run_publisher, daemon=True).start()
+    threading.Thread(target=udp.serve_forever, daemon=True).start()
+    print(f"Events of {db_path} on {host}:{port}, last event {broker.seen}", flush=True)
+    try:
+        tcp.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tcp.server_close()
+        udp.server_close()
+
+# ----------------------------------------------------------
+# Subscribers
+# ----------------------------------------------------------
+class Subscription:
+    """
+    A connection to the broker. Iterating gives the events as dicts, blocking until
+    new ones are archived; ack(seq) tells the broker to resume after seq next time.
+        with Subscription("playout") as events:
+            for event in events:
+                import_file(event["filepath"])
+                events.ack(event["seq"])
+    """
+    def __init__(self, name=None, start=None, host=HOST, port=PORT):
+        self.sock = socket.create_connection((host, port))
+        hello = {"name": name} if name else {}
+        if start is not None:
+            hello["from"] = start
+        self.sock.sendall((json.dumps(hello) + "\n").encode("utf-8"))
+        self.lines = self.sock.makefile("rb")
+
+    def __iter__(self):
+        for line in self.lines:
+            yield json.loads(line)
+
+    def ack(self, seq):
+        self.sock.sendall((json.dumps({"ack": seq}) + "\n").encode("utf-8"))
+
+    def close(self):
+        self.lines.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def follow(name=None, start=None, host=HOST, port=PORT):
+    with Subscription(name, start, host, port) as events:
+        for event in events:
+            print(json.dumps(event), flush=True)
+            events.ack(event["seq"])
+
+def status(db_path):
+    conn = open_db(db_path)
+    try:
+        last = last_seq(conn)
+        count = conn.execute("SELECT count(*) FROM archive_events").fetchone()[0]
+        print(f"{count} events in the log, last event {last}")
+        for name, seq, updated in conn.execute("SELECT name, seq, updated FROM event_offsets ORDER BY name"):
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(updated))
+            print(f"  {name}: at event {seq}, {last - seq} behind (acknowledged {when})")
+    finally:
+        conn.close()
+
+def prune(db_path, days):
+    """Deletes the events every named subscriber has acknowledged and that are older than `days`."""
+    conn = open_db(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        oldest = conn.execute("SELECT min(seq) FROM event_offsets").fetchone()[0]
+        limit = last_seq(conn) if oldest is None else oldest
+        cur = conn.execute("DELETE FROM archive_events WHERE seq <= ? AND created < ?",
+                           (limit, time.time() - days * 86400))
+        conn.execute("COMMIT")
+        return cur.rowcount
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser("ripped.db archive events")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("serve", help="Run the broker")
+    p.add_argument("--db", default=DB_PATH, help="Path to ripped.db")
+    p.add_argument("--port", type=int, default=PORT, help="Same as eventPort in cdrip-sqlite.py")
+    p.add_argument("-v", "--verbose", action="store_true", help="Log subscribers and published events")
+    p = commands.add_parser("follow", help="Print events as JSON lines")
+    p.add_argument("--name", default=None, help="Subscriber name, to resume after the last event printed")
+    p.add_argument("--from", dest="start", type=int, default=None, help="Start at this event number")
+    p.add_argument("--port", type=int, default=PORT)
+    p = commands.add_parser("status", help="Show the log and the subscribers' offsets")
+    p.add_argument("--db", default=DB_PATH, help="Path to ripped.db")
+    p = commands.add_parser("prune", help="Delete old acknowledged events")
+    p.add_argument("--db", default=DB_PATH, help="Path to ripped.db")
+    p.add_argument("--days", type=float, required=True, help="Keep events younger than this")
+    args = parser.parse_args()
+
+    if args.command == "follow":
+        try:
+            follow(args.name, args.start, port=args.port)
+        except (ConnectionError, KeyboardInterrupt) as e:
+            if isinstance(e, ConnectionError):
+                print(f"No broker on port {args.port}: {e}", file=sys.stderr)
+                sys.exit(1)
+        return
+    if not os.path.exists(args.db):
+        print(f"No database at {args.db}")
+        sys.exit(1)
+    if args.command == "serve":
+        serve(args.db, port=args.port, verbose=args.verbose)
+    elif args.command == "status":
+        status(args.db)
+    else:
+        print(f"Deleted {prune(args.db, args.days)} events.")
+
+if __name__ == "__main__":
+    main()
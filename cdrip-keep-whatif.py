@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+cdrip-keep-whatif.py
+Shows what other keep rules would have done with the discs played so far. In trackMode
+the handlers keep a track once more than keepThreshold (0.8) of it has played, or once
+keepMinSeconds of it have played when that is set. For every combination of the
+thresholds and minimum play times asked for, this reports the tracks that would have
+been kept, the audio that would have been archived, and the tracks gained and lost
+compared with the rule the handler uses now.
+
+The history comes from the disc_payloads table of ripped.db and/or from folders of
+saved payloads (the ones cdrip-sqlite-batch.py replays). disc_payloads only holds
+discs that were written, so discs where no track made the cut are missing from it;
+saved payloads of the ejected stage fill that gap. A track seen in several payloads
+counts once, with the most it was ever played.
+
+The played and total bytes of all tracks go into two NumPy arrays and every rule is
+evaluated against them at once, a block of tracks at a time, so sweeping a hundred
+thresholds over a year of history takes seconds, most of it reading the payloads.
+
+Requirements: Python 3, numpy (pip install numpy).
+Run: python cdrip-keep-whatif.py [--db PATH] [--payloads FOLDER_OR_GLOB]... [--thresholds 0.5:1:0.01] [--min-seconds 0,120]
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import zlib
+import sqlite3
+import pathlib
+import argparse
+
+import numpy as np
+
+from cdrip_tools import load_tool
+
+DB_PATH = r"c:\temp\cdrip\ripped.db"
+BYTES_PER_SECOND = 176400
+BLOCK = 65536           # tracks per vectorized block, bounds the memory of the rule x track matrix
+
+REPORT_COLUMNS = ["threshold", "min_seconds", "current", "kept", "kept_pct", "archived_bytes", "archived_hours",
+                  "gained", "lost", "gained_bytes", "lost_bytes"]
+
+# ----------------------------------------------------------
+# History
+# ----------------------------------------------------------
+def db_payloads(db_path, since=""):
+    """The stored payloads of ripped.db, read-only."""
+    uri = pathlib.Path(os.path.abspath(db_path)).as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    try:
+        for (blob,) in conn.execute("SELECT payload FROM disc_payloads WHERE ripped_date >= ?", (since,)):
+            try:
+                yield json.loads(zlib.decompress(blob))
+            except (zlib.error, ValueError):
+                continue
+    finally:
+        conn.close()
+
+def file_payloads(pattern):
+    """Saved payload files, as cdrip-sqlite-batch.py finds them."""
+    batch = load_tool("cdrip-sqlite-batch.py")
+    payloads, broken = batch.read_payloads(batch.find_payloads(pattern))
+    for path, error in broken:
+        print(f"Skipped {path}: {error}", file=sys.stderr)
+    for _, data in payloads:
+        yield data
+
+def load_history(sources, since="", until=""):
+    """(played bytes, length bytes) NumPy arrays, one entry per track played in the period."""
+    tracks = {}
+    for data in sources:
+        if not data.get("ejected"):
+            continue        # played bytes are only final once the disc is out
+        ripped = data.get("ripped-date", "")
+        if ripped < since or (until and ripped > until):
+            continue
+        disc = (data.get("cddb-id"), ripped, data.get("ripped-time"))
+        for track in data.get("track-details", []):
+            key = disc + (track.get("number"),)
+            played = track.get("played-bytes", 0)
+            if key not in tracks or played > tracks[key][0]:
+                tracks[key] = (played, track.get("length-bytes", 0))
+    values = np.array(list(tracks.values()), dtype=np.float64).reshape(-1, 2)
+    return values[:, 0], values[:, 1]
+
+# ----------------------------------------------------------
+# Rules
+# ----------------------------------------------------------
+def parse_values(text):
+    """'0.5:1:0.01' (start:stop:step, stop included) or '0.6,0.7,0.8'."""
+    if ":" in text:
+        start, stop, step = (float(v) for v in text.split(":"))
+        return np.round(np.arange(start, stop + step / 2, step), 6)
+    return np.array([float(v) for v in text.split(",")])
+
+def keep_matrix(fraction, played, thresholds, min_bytes):
+    """Rules x tracks booleans: the handlers' mark_keep() for every rule at once."""
+    return (fraction[None, :] > thresholds[:, None]) | (played[None, :] >= min_bytes[:, None])
+
+def evaluate(played, length, rules, current):
+    """
+    rules: (n, 2) array of (threshold, min seconds), current: the same for the rule in use.
+    Returns a dict of per-rule arrays: kept, archived, gained, lost, gained_bytes, lost_bytes.
+    """
+    thresholds = rules[:, 0]
+    min_bytes = np.where(rules[:, 1] > 0, rules[:, 1] * BYTES_PER_SECOND, np.inf)
+    cur_t = np.array([current[0]])
+    cur_m = np.array([current[1] * BYTES_PER_SECOND if current[1] > 0 else np.inf])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(length > 0, played / length, 0.0)
+    played = np.where(length > 0, played, 0.0)      # mark_keep() skips empty tracks
+
+    n = len(rules)
+    out = {k: np.zeros(n) for k in ("kept", "archived", "gained", "lost", "gained_bytes", "lost_bytes")}
+    for s in range(0, len(played), BLOCK):
+        f, p, L = fraction[s:s + BLOCK], played[s:s + BLOCK], length[s:s + BLOCK]
+        kept = keep_matrix(f, p, thresholds, min_bytes)
+        base = keep_matrix(f, p, cur_t, cur_m)[0]
+        gained = kept & ~base
+        lost = ~kept & base
+        out["kept"] += np.count_nonzero(kept, axis=1)
+        out["archived"] += kept @ L
+        out["gained"] += np.count_nonzero(gained, axis=1)
+        out["lost"] += np.count_nonzero(lost, axis=1)
+        out["gained_bytes"] += gained @ L
+        out["lost_bytes"] += lost @ L
+    return out
+
+def report_rows(rules, result, current, total):
+    rows = []
+    for i, (threshold, min_seconds) in enumerate(rules):
+        rows.append({
+            "threshold": f"{threshold:g}", "min_seconds": f"{min_seconds:g}",
+            "current": "*" if (threshold, min_seconds) == tuple(current) else "",
+            "kept": int(result["kept"][i]), "kept_pct": round(100 * result["kept"][i] / max(1, total), 1),
+            "archived_bytes": int(result["archived"][i]),
+            "archived_hours": round(result["archived"][i] / BYTES_PER_SECOND / 3600, 1),
+            "gained": int(result["gained"][i]), "lost": int(result["lost"][i]),
+            "gained_bytes": int(result["gained_bytes"][i]), "lost_bytes": int(result["lost_bytes"][i]),
+        })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser("Keep rule what-if analysis")
+    parser.add_argument("--db", default=None, help=f"Read the stored payloads of this ripped.db (default {DB_PATH} "
+                                                   "when no --payloads are given)")
+    parser.add_argument("--payloads", action="append", default=[],
+                        help="Folder of saved payloads, or a glob; can be repeated")
+    parser.add_argument("--since", default="", help="Only discs ripped on or after this date, YYYY-MM-DD")
+    parser.add_argument("--until", default="", help="Only discs ripped on or before this date, YYYY-MM-DD")
+    parser.add_argument("--thresholds", default="0.01:1:0.01", help="Thresholds, start:stop:step or a list")
+    parser.add_argument("--min-seconds", default="0", help="Minimum play times in seconds, 0 = off, start:stop:step or a list")
+    parser.add_argument("--csv", default=None, help="Write the report to this CSV file")
+    args = parser.parse_args()
+
+    handler = load_tool("cdrip-sqlite.py")
+    current = (float(handler.keepThreshold), float(handler.keepMinSeconds))
+
+    t0 = time.perf_counter()
+    db_path = args.db or (None if args.payloads else DB_PATH)
+    sources = []
+    if db_path:
+        sources.append(db_payloads(db_path, args.since))
+    sources += [file_payloads(p) for p in args.payloads]
+    played, length = load_history((data for source in sources for data in source), args.since, args.until)
+    t1 = time.perf_counter()
+    if len(played) == 0:
+        print("No ejected payloads found in that period.")
+        sys.exit(1)
+
+    thresholds, min_seconds = parse_values(args.thresholds), parse_values(args.min_seconds)
+    rules = np.array([(t, m) for m in min_seconds for t in thresholds])
+    result = evaluate(played, length, rules, current)
+    t2 = time.perf_counter()
+    rows = report_rows(rules, result, current, len(played))
+
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        print(f'{"rule":<22}{"kept":>9}{"%":>7}{"hours":>9}{"gained":>9}{"lost":>9}{"+/- hours":>11}')
+        for r in rows:
+            rule = f'> {r["threshold"]}' + (f' or {r["min_seconds"]} s' if float(r["min_seconds"]) else "")
+            delta = (r["gained_bytes"] - r["lost_bytes"]) / BYTES_PER_SECOND / 3600
+            print(f'{r["current"]:1}{rule:<21}{r["kept"]:>9}{r["kept_pct"]:>7}{r["archived_hours"]:>9}'
+                  f'{r["gained"]:>9}{r["lost"]:>9}{delta:>+11.1f}')
+    print(f"{len(played)} tracks, {len(rules)} rules: {t1 - t0:.1f} s reading, {t2 - t1:.2f} s evaluating. "
+          f"* is the rule in use (keepThreshold = {current[0]:g}, keepMinSeconds = {current[1]:g} in cdrip-sqlite.py; "
+          f"keep_threshold and keep_min_seconds in cdrip.py).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+cdrip-loudness.py
+Measures the loudness of archived tracks for the playout import: EBU R128 integrated
+loudness (ITU-R BS.1770 K-weighting and gating), sample peak, an estimate of the
+true peak, and the gain that brings the track to TARGET_LUFS without pushing the
+true peak over PEAK_CEILING_DBTP.
+
+The 16-bit stereo PCM of each WAV (176400 bytes/sec, the format the rip handlers
+assume) is memory-mapped, never read into memory as a whole. The K-weighting filter
+runs over each channel as the IIR filter BS.1770 describes, its state carried from
+one block of samples to the next, but a minute of audio per NumPy call (see
+BlockIIR); four consecutive 100 ms blocks make one 400 ms gating block with 75%
+overlap. True peak is estimated by 4x oversampling with a windowed-sinc
+interpolator, only around the samples loud enough to matter. Files are analysed
+side by side in a process pool, so a full CD takes a few seconds.
+
+Results go to ripped.db (table track_loudness, next to written_tracks) with --db,
+or to the registry next to the ripped tracks with --registry, the way cdrip.py
+keeps its records. Otherwise they are only printed.
+
+Requirements: Python 3, numpy (pip install numpy).
+Run: python cdrip-loudness.py [--db PATH --title ALBUM] [--registry KEY] [--track ID FILE]... [FILE...]
+cdrip.py and cdrip-sqlite.py (through cdrip-sqlite-outbox.py) run it on the kept tracks.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import struct
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+DB_PATH = r"c:\temp\cdrip\ripped.db"
+
+RATE = 44100
+BLOCK = RATE // 10          # 100 ms
+FILTER_BLOCK = BLOCK // 21  # samples the K-weighting filter takes in one step, see BlockIIR
+BLOCKS_PER_CHUNK = 600      # 60 s of audio per NumPy pass, bounds the memory used
+GATING_BLOCKS = 4           # 400 ms gating blocks, 100 ms apart
+OVERSAMPLE = 4              # for the true peak estimate
+INTERPOLATOR_TAPS = 16
+TRUE_PEAK_SEARCH_DB = 6.0   # only samples this close to the sample peak can make the true peak
+ABSOLUTE_GATE = -70.0       # LUFS
+RELATIVE_GATE = -10.0       # LU below the absolutely gated loudness
+TARGET_LUFS = -23.0         # EBU R128
+PEAK_CEILING_DBTP = -1.0
+
+# ----------------------------------------------------------
+# K-weighting (ITU-R BS.1770-4): a high shelf and a high pass, designed for any rate
+# ----------------------------------------------------------
+def k_weighting(rate=RATE):
+    """The two biquads of the K-weighting filter, [(b, a)] with a[0] = 1."""
+    # stage 1: +4 dB high shelf around 1.7 kHz, models the acoustic effect of the head
+    gain, q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    K = np.tan(np.pi * fc / rate)
+    Vh = 10 ** (gain / 20)
+    Vb = Vh ** 0.4996667741545416
+    a0 = 1 + K / q + K * K
+    shelf = (((Vh + Vb * K / q + K * K) / a0, 2 * (K * K - Vh) / a0, (Vh - Vb * K / q + K * K) / a0),
+             (1.0, 2 * (K * K - 1) / a0, (1 - K / q + K * K) / a0))
+
+    # stage 2: RLB high pass at 38 Hz
+    q, fc = 0.5003270373238773, 38.13547087602444
+    K = np.tan(np.pi * fc / rate)
+    a0 = 1 + K / q + K * K
+    highpass = ((1.0, -2.0, 1.0), (1.0, 2 * (K * K - 1) / a0, (1 - K / q + K * K) / a0))
+    return [shelf, highpass]
+
+class BlockIIR:
+    """
+    An IIR filter run over blocks of n samples: exactly the recursive filter, with its
+    state carried from block to block and from call to call, but without a Python loop
+    over the samples.
+
+    Written as a state-space system (transposed direct form II), s' = A s + B x and
+    y = C s + D x, a block's output is its input times a lower triangular matrix of the
+    first n taps of the impulse response, plus the response to the state the block
+    started in. Only that state goes from block to block, one small matrix step per
+    block.
+    """
+    def __init__(self, b, a, n=FILTER_BLOCK):
+        b = np.asarray(b, dtype=float) / a[0]
+        a = np.asarray(a, dtype=float) / a[0]
+        order = len(a) - 1
+        A = np.zeros((order, order))
+        A[:, 0] = -a[1:]
+        A[:-1, 1:] = np.eye(order - 1)
+        B = b[1:] - a[1:] * b[0]
+        powers = np.empty((n + 1, order, order))
+        powers[0] = np.eye(order)
+        for k in range(n):
+            powers[k + 1] = A @ powers[k]
+        # impulse response h[0] = D, h[k] = C A^(k-1) B, with C = (1, 0, ...)
+        h = np.concatenate(([b[0]], powers[:n - 1, 0] @ B))
+        self.taps = np.zeros((n, n))
+        for k in range(n):
+            self.taps[k:, k] = h[:n - k]
+        self.from_state = powers[:n, 0]             # (n, order): C A^k, output k of a block from its start state
+        self.to_state = (powers[n - 1::-1] @ B).T   # (order, n): A^(n-1-k) B, input k's share of the end state
+        self.step = powers[n]
+        self.order = order
+
+    def __call__(self, x, state):
+        """x: (blocks, n, channels), state: (order, channels). Returns the output and the state after it."""
+        y = self.taps @ x
+        gained = self.to_state @ x
+        starts = np.empty_like(gained)
+        for i in range(len(x)):
+            starts[i] = state
+            state = self.step @ state + gained[i]
+        y += self.from_state @ starts
+        return y, state
+
+def interpolator(taps=INTERPOLATOR_TAPS, factor=OVERSAMPLE):
+    """
+    (taps, factor - 1) Kaiser-windowed sinc coefficients: column j gives the value
+    (j + 1) / factor of the way from sample n to n + 1, from samples n - taps/2 + 1
+    to n + taps/2.
+    """
+    half = taps // 2
+    k = np.arange(-half + 1, half + 1)[:, None]
+    t = k - np.arange(1, factor)[None, :] / factor
+    h = np.sinc(t) * np.i0(8.0 * np.sqrt(np.clip(1 - (t / half) ** 2, 0, None))) / np.i0(8.0)
+    return (h / h.sum(axis=0)).astype(np.float32)
+
+# ----------------------------------------------------------
+# WAV files
+# ----------------------------------------------------------
+def wav_data(path):
+    """(offset, bytes, fmt) of the data chunk. fmt is (format, channels, rate, byte rate, block align, bits)."""
+    fmt = None
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if len(head) < 12 or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+            raise ValueError("not a RIFF WAVE file")
+        file_size = os.fstat(f.fileno()).st_size
+        pos = 12
+        while pos + 8 <= file_size:
+            f.seek(pos)
+            cid, size = struct.unpack("<4sI", f.read(8))
+            if cid == b"fmt " and size >= 16:
+                fmt = struct.unpack("<HHIIHH", f.read(16))
+            elif cid == b"data":
+                if fmt is None:
+                    raise ValueError("data chunk before fmt chunk")
+                return pos + 8, min(size, file_size - pos - 8), fmt
+            pos += 8 + size + (size & 1)
+    raise ValueError("no data chunk")
+
+def _db(value):
+    return 10 * math.log10(value) if value > 0 else None
+
+# ----------------------------------------------------------
+# Analysis
+# ----------------------------------------------------------
+def analyse(path, target=TARGET_LUFS, ceiling=PEAK_CEILING_DBTP):
+    """Loudness figures of one WAV file, as a dict."""
+    offset, nbytes, fmt = wav_data(path)
+    if fmt[0] != 1 or fmt[1] != 2 or fmt[2] != RATE or fmt[5] != 16:
+        raise ValueError(f"not 16-bit 44.1 kHz stereo PCM: {fmt}")
+    frames = nbytes // 4
+    result = {"seconds": frames / RATE, "integrated_lufs": None, "sample_peak_dbfs": None,
+              "true_peak_dbtp": None, "gain_db": None}
+    if frames == 0:
+        return result
+    pcm = np.memmap(path, dtype="<i2", mode="r", offset=offset, shape=(frames, 2))
+
+    # the sample peak first: it decides which stretches the true peak search has to look at
+    peak = 0
+    chunk = BLOCK * BLOCKS_PER_CHUNK
+    for start in range(0, frames, chunk):
+        raw = pcm[start:start + chunk]
+        peak = max(peak, int(raw.max()), -int(raw.min()))
+    search = peak * 10 ** (-TRUE_PEAK_SEARCH_DB / 20)
+
+    # the two stages as one fourth-order filter, half the work
+    (b1, a1), (b2, a2) = k_weighting()
+    kw = BlockIIR(np.convolve(b1, b2), np.convolve(a1, a2))
+    state = np.zeros((kw.order, 2))
+    fir = interpolator()
+    half = INTERPOLATOR_TAPS // 2
+    energies = []       # mean square per 100 ms block and channel
+    true_peak = 0
+    for start in range(0, frames, chunk):
+        end = min(frames, start + chunk)
+        raw = pcm[start:end]
+
+        # K-weighted mean square of every whole 100 ms block; only the last chunk can end
+        # in a partial block, so the filter state always carries on where it left off
+        blocks = (end - start) // BLOCK
+        if blocks:
+            x = raw[:blocks * BLOCK].reshape(-1, FILTER_BLOCK, 2) / 32768.0
+            y, state = kw(x, state)
+            energies.append((y.reshape(blocks, BLOCK, 2) ** 2).mean(axis=1))
+
+        # true peak: interpolate between neighbouring samples, but only where one of them is loud.
+        # Samples more than TRUE_PEAK_SEARCH_DB down can't add up to more than the sample peak.
+        lo, hi = max(0, start - half), min(frames, end + half)
+        for ch in range(2):
+            # zero padded so every window is complete, sample i of the chunk is at i + half
+            x = np.zeros(hi - lo + 2 * half, dtype=np.float32)
+            x[half:half + hi - lo] = pcm[lo:hi, ch]
+            loud = np.abs(x) >= search
+            n = np.flatnonzero(loud[:-1] | loud[1:])
+            n = n[(n >= half + start - lo) & (n < half + end - lo)]
+            if len(n):
+                windows = np.lib.stride_tricks.sliding_window_view(x, INTERPOLATOR_TAPS)[n - half + 1]
+                true_peak = max(true_peak, float(np.abs(windows @ fir).max()))
+    del pcm
+
+    true_peak /= 32768.0
+    sample_peak = peak / 32768.0
+    result["sample_peak_dbfs"] = _db(sample_peak ** 2)
+    result["true_peak_dbtp"] = _db(max(true_peak, sample_peak) ** 2)
+
+    if energies:
+        z = np.concatenate(energies)
+        if len(z) >= GATING_BLOCKS:
+            # 400 ms gating blocks with 75% overlap = running mean of four 100 ms blocks
+            csum = np.cumsum(np.vstack([np.zeros((1, 2)), z]), axis=0)
+            gating = (csum[GATING_BLOCKS:] - csum[:-GATING_BLOCKS]) / GATING_BLOCKS
+            total = gating.sum(axis=1)
+            with np.errstate(divide="ignore"):
+                loudness = -0.691 + 10 * np.log10(total)
+            gated = loudness > ABSOLUTE_GATE
+            if gated.any():
+                relative = -0.691 + 10 * np.log10(total[gated].mean()) + RELATIVE_GATE
+                gated &= loudness > relative
+                integrated = -0.691 + 10 * np.log10(total[gated].mean())
+                result["integrated_lufs"] = round(float(integrated), 2)
+                gain = target - integrated
+                if result["true_peak_dbtp"] is not None:
+                    gain = min(gain, ceiling - result["true_peak_dbtp"])
+                result["gain_db"] = round(float(gain), 2)
+    for key in ("sample_peak_dbfs", "true_peak_dbtp"):
+        if result[key] is not None:
+            result[key] = round(result[key], 2)
+    return result
+
+def _analyse_one(path):
+    try:
+        return path, analyse(path), None
+    except (OSError, ValueError) as e:
+        return path, None, str(e)
+
+def analyse_files(paths, workers=None):
+    """({path: result}, {path: error}) for a list of WAV files, analysed side by side."""
+    results, errors = {}, {}
+    paths = list(dict.fromkeys(paths))
+    if len(paths) == 1:
+        outcomes = [_analyse_one(paths[0])]
+    else:
+        # worker processes look _analyse_one up by module name, which only works when this
+        # file is the script being run; loaded by another script (load_tool) it's threads
+        executor = ProcessPoolExecutor if __name__ == "__main__" else ThreadPoolExecutor
+        with executor(max_workers=workers) as pool:
+            outcomes = list(pool.map(_analyse_one, paths))
+    for path, result, error in outcomes:
+        if error is None:
+            results[path] = result
+        else:
+            errors[path] = error
+    return results, errors
+
+# ----------------------------------------------------------
+# Storage
+# ----------------------------------------------------------
+def store_db(db_path, title, tracks, results):
+    """tracks: [(track id, path)]. One track_loudness row per analysed track."""
+    conn = sqlite3.connect(db_path, timeout=10)
+    try:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS track_loudness (
+            title TEXT,
+            track_id TEXT,
+            filepath TEXT,
+            seconds REAL,
+            integrated_lufs REAL,
+            sample_peak_dbfs REAL,
+            true_peak_dbtp REAL,
+            gain_db REAL,
+            analysed REAL,
+            PRIMARY KEY (title, track_id)
+        )
+        """)
+        now = time.time()
+        rows = []
+        for track_id, path in tracks:
+            r = results.get(path)
+            if r:
+                rows.append((title, track_id, path, r["seconds"], r["integrated_lufs"], r["sample_peak_dbfs"],
+                             r["true_peak_dbtp"], r["gain_db"], now))
+        with conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO track_loudness
+                    (title, track_id, filepath, seconds, integrated_lufs, sample_peak_dbfs, true_peak_dbtp, gain_db, analysed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+    finally:
+        conn.close()
+
+def store_registry(reg_key, tracks, results):
+    """One JSON string value per track id, in a Loudness subkey of the ripped tracks key."""
+    import winreg
+    registry = winreg.ConnectRegistry(None, winreg.HKEY_CURRENT_USER)
+    key = winreg.CreateKey(registry, reg_key + "\\Loudness")
+    try:
+        for track_id, path in tracks:
+            if path in results:
+                winreg.SetValueEx(key, track_id, 0, winreg.REG_SZ, json.dumps(results[path]))
+    finally:
+        winreg.CloseKey(key)
+
+def run(tracks, db_path=None, title=None, reg_key=None, workers=None):
+    """Analyses [(track id, path)] and stores the results. Returns ({path: result}, {path: error})."""
+    results, errors = analyse_files([path for _, path in tracks], workers)
+    if db_path:
+        store_db(db_path, title, tracks, results)
+    if reg_key:
+        store_registry(reg_key, tracks, results)
+    return results, errors
+
+def main():
+    parser = argparse.ArgumentParser("Loudness analysis of archived tracks")
+    parser.add_argument("files", nargs="*", help="WAV files, stored under their file name")
+    parser.add_argument("--track", nargs=2, action="append", default=[], metavar=("ID", "FILE"),
+                        help="WAV file stored under a track id such as 'T01 a1b2c3d4'")
+    parser.add_argument("--db", default=None, help=f"Store the results in this ripped.db (such as {DB_PATH})")
+    parser.add_argument("--title", default="", help="Album title the tracks are filed under in ripped.db")
+    parser.add_argument("--registry", default=None, help="Store the results under this HKEY_CURRENT_USER key")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    tracks = [tuple(t) for t in args.track] + [(os.path.basename(f), f) for f in args.files]
+    if not tracks:
+        parser.error("no files to analyse")
+    t0 = time.perf_counter()
+    results, errors = run(tracks, args.db, args.title, args.registry, args.workers)
+    for track_id, path in tracks:
+        r = results.get(path)
+        if r:
+            print(f'{track_id}: {r["integrated_lufs"]} LUFS, sample peak {r["sample_peak_dbfs"]} dBFS, '
+                  f'true peak {r["true_peak_dbtp"]} dBTP, gain {r["gain_db"]} dB')
+        else:
+            print(f"{track_id}: {errors.get(path)}")
+    print(f"{len(results)} tracks analysed in {time.perf_counter() - t0:.1f} s")
+    if errors and not results:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+"""
+cdrip-sqlite-api.py
+A small local HTTP service that answers "is this disc or track archived already?" for
+the playout and scheduling systems, so they don't have to open ripped.db themselves.
+All answers are JSON:
+
+  GET  /discs?cddb=a1b2c3d4,deadbeef    per CDDB id: the disc rows and the kept tracks
+  GET  /tracks?id=T01 a1b2c3d4,...      per track id: the album and track titles it's filed under
+  GET  /search?q=text&kind=tracks|discs&limit=50
+  POST /lookup  {"cddb": [...], "tracks": [...]}   both batch lookups in one request
+  GET  /health                          counters, cache figures and server-side latency
+
+Up to MAX_BATCH ids per request. Lookups run on a small pool of read-only connections,
+each in one short read transaction, so a rip handler waiting to commit is held up for
+microseconds at most. Responses are cached, and every response carries an ETag made of
+the database's file change counter (bytes 24-27 of the file header, bumped by every
+commit from any process) and the request; a client that sends it back in
+If-None-Match gets 304 Not Modified without the database being touched, and any
+commit makes every cached response and ETag out of date at once.
+
+On start-up the indexes the lookups need are added when missing (written_tracks by
+track id and by CDDB id, written_discs by CDDB id). That is the only write.
+
+"loadtest" starts the service on a scratch copy of ripped.db filled with --discs discs
+and hammers it with a mix of lookups from several client processes, while a writer
+commits the way the rip handler does. It prints requests per second, the latency
+percentiles, and the handler's commit latency with and without the load.
+
+Requirements: Python 3 (no external packages).
+Run: python cdrip-sqlite-api.py [--db PATH] [--port 8765] [-v]
+     python cdrip-sqlite-api.py loadtest [--seconds 10] [--clients 4] [--discs 20000] [--commit-interval 0.5]
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import queue
+import random
+import socket
+import sqlite3
+import pathlib
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+import http.client
+import urllib.parse
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cdrip_tools import load_tool
+
+DB_PATH = r"c:\temp\cdrip\ripped.db"
+HOST = "127.0.0.1"      # local only
+PORT = 8765
+POOL_SIZE = 8           # read-only connections
+BUSY_TIMEOUT = 2.0      # seconds a lookup waits for a handler's commit
+MAX_BATCH = 1000        # ids per request
+SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 1000
+CACHE_ENTRIES = 10000   # cached responses, least recently used go first
+LATENCY_SAMPLES = 10000 # recent request timings kept for /health
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS written_tracks_id ON written_tracks (track_id)",
+    # track ids are "T03 a1b2c3d4", the CDDB id starts at the 5th character
+    "CREATE INDEX IF NOT EXISTS written_tracks_cddb ON written_tracks (substr(track_id, 5))",
+    "CREATE INDEX IF NOT EXISTS written_discs_cddb ON written_discs (cddb_id)",
+]
+
+class BadRequest(Exception):
+    pass
+
+def ensure_indexes(path):
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        with conn:
+            for sql in INDEXES:
+                conn.execute(sql)
+    finally:
+        conn.close()
+
+# ----------------------------------------------------------
+# Connections and cache
+# ----------------------------------------------------------
+class ConnectionPool:
+    """Read-only connections handed out to one request thread at a time."""
+    def __init__(self, path, size=POOL_SIZE):
+        uri = pathlib.Path(os.path.abspath(path)).as_uri() + "?mode=ro"
+        self.free = queue.LifoQueue()
+        for _ in range(size):
+            # autocommit, the lookups open and close their read transactions themselves
+            conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                                   isolation_level=None)
+            conn.execute("PRAGMA query_only=ON")
+            self.free.put(conn)
+        self.size = size
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.free.get()
+        try:
+            yield conn
+        finally:
+            self.free.put(conn)
+
+    def close(self):
+        for _ in range(self.size):
+            self.free.get().close()
+
+class ResponseCache:
+    """LRU cache of response bodies, all belonging to one database change stamp."""
+    def __init__(self, size=CACHE_ENTRIES):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.stamp = None
+        self.hits = self.misses = 0
+
+    def get(self, key, stamp):
+        with self.lock:
+            if stamp != self.stamp:
+                self.entries.clear()
+                self.stamp = stamp
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, stamp, body):
+        with self.lock:
+            if stamp != self.stamp:
+                return
+            self.entries[key] = body
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+# ----------------------------------------------------------
+# Lookups
+# ----------------------------------------------------------
+def _ids(values):
+    ids = [v.strip() for v in values if v and v.strip()]
+    if len(ids) > MAX_BATCH:
+        raise BadRequest(f"at most {MAX_BATCH} ids per request")
+    return list(dict.fromkeys(ids))
+
+def _chunks(ids, size=500):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+class LookupService:
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.path = path
+        self.pool = ConnectionPool(path, pool_size)
+        self.cache = ResponseCache()
+        self.header = open(path, "rb", buffering=0)     # unbuffered, or seek() reuses stale bytes
+        self.header_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.requests = self.not_modified = self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.started = time.time()
+
+    def close(self):
+        self.pool.close()
+        self.header.close()
+
+    def stamp(self):
+        """The file change counter, plus the -wal file's size and time should the DB be in WAL mode."""
+        with self.header_lock:
+            self.header.seek(24)
+            counter = int.from_bytes(self.header.read(4), "big")
+        try:
+            st = os.stat(self.path + "-wal")
+            return f"{counter:x}.{st.st_size:x}.{st.st_mtime_ns:x}"
+        except OSError:
+            return f"{counter:x}"
+
+    def discs(self, conn, cddb_ids):
+        result = {c: {"archived": False, "discs": [], "tracks": []} for c in cddb_ids}
+        for chunk in _chunks(cddb_ids):
+            marks = ",".join("?" * len(chunk))
+            for cddb_id, title in conn.execute(
+                    f"SELECT cddb_id, title FROM written_discs WHERE cddb_id IN ({marks})", chunk):
+                result[cddb_id]["discs"].append(title)
+            for cddb_id, title, track_id, track_title in conn.execute(
+                    f"SELECT substr(track_id, 5), title, track_id, track_title FROM written_tracks "
+                    f"WHERE substr(track_id, 5) IN ({marks}) ORDER BY title, track_id", chunk):
+                result[cddb_id]["tracks"].append({"title": title, "track_id": track_id, "track_title": track_title})
+        for r in result.values():
+            r["archived"] = bool(r["discs"] or r["tracks"])
+        return result
+
+    def tracks(self, conn, track_ids):
+        result = {t: {"archived": False, "titles": []} for t in track_ids}
+        for chunk in _chunks(track_ids):
+            marks = ",".join("?" * len(chunk))
+            for track_id, title, track_title in conn.execute(
+                    f"SELECT track_id, title, track_title FROM written_tracks WHERE track_id IN ({marks})", chunk):
+                result[track_id]["archived"] = True
+                result[track_id]["titles"].append({"title": title, "track_title": track_title})
+        return result
+
+    def search(self, conn, text, kind, limit):
+        q = f"%{text}%"
+        if kind == "tracks":
+            rows = conn.execute("SELECT title, track_id, track_title FROM written_tracks "
+                                "WHERE title LIKE ? OR track_title LIKE ? ORDER BY title, track_id LIMIT ?", (q, q, limit))
+            return [{"title": t, "track_id": i, "track_title": tt} for t, i, tt in rows]
+        if kind == "discs":
+            rows = conn.execute("SELECT title, cddb_id FROM written_discs WHERE title LIKE ? "
+                                "ORDER BY title LIMIT ?", (q, limit))
+            return [{"title": t, "cddb_id": c} for t, c in rows]
+        raise BadRequest("kind is tracks or discs")
+
+    def answer(self, path, params):
+        """The JSON-able answer to a request, read in one transaction."""
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                if path == "/discs":
+                    return self.discs(conn, params["cddb"])
+                if path == "/tracks":
+                    return self.tracks(conn, params["id"])
+                if path == "/search":
+                    return {"results": self.search(conn, params["q"], params["kind"], params["limit"])}
+                return {"discs": self.discs(conn, params["cddb"]), "tracks": self.tracks(conn, params["tracks"])}
+            finally:
+                conn.execute("COMMIT")
+
+    def health(self):
+        with self.stats_lock:
+            latencies = sorted(self.latencies)
+        pct = lambda p: round(latencies[int(p * (len(latencies) - 1))], 3) if latencies else None
+        uptime = time.time() - self.started
+        return {"ok": True, "db": self.path, "stamp": self.stamp(), "uptime_s": round(uptime, 1),
+                "requests": self.requests, "per_second": round(self.requests / max(uptime, 1e-9), 1),
+                "not_modified": self.not_modified, "errors": self.errors,
+                "cache_hits": self.cache.hits, "cache_misses": self.cache.misses,
+                "latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99)}}
+
+    def record(self, ms, status):
+        with self.stats_lock:
+            self.requests += 1
+            self.latencies.append(ms)
+            if status == 304:
+                self.not_modified += 1
+            elif status >= 400:
+                self.errors += 1
+
+def parse_request(path, query, body):
+    """(path, params) with the ids split and checked, for answer() and the cache key."""
+    if path == "/lookup":
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise BadRequest("body is not JSON")
+        lists = [data.get(name) or [] for name in ("cddb", "tracks")] if isinstance(data, dict) else None
+        if not lists or not all(isinstance(ids, list) and all(isinstance(i, str) for i in ids) for ids in lists):
+            raise BadRequest('body is {"cddb": [...], "tracks": [...]}, lists of ids as strings')
+        cddb, tracks = _ids(lists[0]), _ids(lists[1])
+        if len(cddb) + len(tracks) > MAX_BATCH:
+            raise BadRequest(f"at most {MAX_BATCH} ids per request")
+        return path, {"cddb": cddb, "tracks": tracks}
+    args = urllib.parse.parse_qs(query)
+    joined = lambda name: _ids(",".join(args.get(name, [])).split(","))
+    if path == "/discs":
+        return path, {"cddb": joined("cddb")}
+    if path == "/tracks":
+        return path, {"id": joined("id")}
+    if path == "/search":
+        text = args.get("q", [""])[0].strip()
+        if not text:
+            raise BadRequest("q is empty")
+        try:
+            limit = min(int(args.get("limit", [SEARCH_LIMIT])[0]), MAX_SEARCH_LIMIT)
+        except ValueError:
+            raise BadRequest("limit is not a number")
+        return path, {"q": text, "kind": args.get("kind", ["tracks"])[0], "limit": max(1, limit)}
+    return None, None
+
+# ----------------------------------------------------------
+# HTTP
+# ----------------------------------------------------------
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"     # keep-alive, so clients don't reconnect per lookup
+    server_version = "cdrip-api/1"
+    disable_nagle_algorithm = True    # headers and body go out as two writes
+
+    def do_GET(self):
+        self._serve(post=False)
+
+    def do_POST(self):
+        self._serve(post=True)
+
+    def _read_body(self):
+        try:
+            length = int(self.headers["Content-Length"])
+        except (TypeError, ValueError):
+            length = -1
+        if length < 0:
+            # the body can't be skipped without its length, so the connection can't be reused
+            self.close_connection = True
+            raise BadRequest("Content-Length is missing or not a number")
+        return self.rfile.read(length)
+
+    def _send(self, status, body=b"", etag=None):
+        self.send_response(status)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        if status != 304:
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+    def _serve(self, post):
+        t0 = time.perf_counter()
+        service = self.server.service
+        status = 200
+        try:
+            body = self._read_body() if post else None
+            url = urllib.parse.urlsplit(self.path)
+            if url.path == "/health" and body is None:
+                self._send(200, json.dumps(service.health()).encode())
+                return
+            path, params = parse_request(url.path, url.query, body)
+            if path is None or (path == "/lookup") != (body is not None):
+                status = 404
+                self._send(404, b'{"error": "no such endpoint"}')
+                return
+            key = json.dumps([path, params], separators=(",", ":")).encode("utf-8")
+            # the stamp is read before the data, so a cached answer is never newer than its stamp says
+            stamp = service.stamp()
+            etag = f'"{stamp}-{zlib.crc32(key):08x}"'
+            if self.headers.get("If-None-Match") == etag:
+                status = 304
+                self._send(304, etag=etag)
+                return
+            answer = service.cache.get(key, stamp)
+            if answer is None:
+                answer = json.dumps(service.answer(path, params), separators=(",", ":")).encode("utf-8")
+                service.cache.put(key, stamp, answer)
+            self._send(200, answer, etag)
+        except BadRequest as e:
+            status = 400
+            self._send(400, json.dumps({"error": str(e)}).encode())
+        except sqlite3.OperationalError as e:
+            status = 503
+            self._send(503, json.dumps({"error": str(e)}).encode())
+        finally:
+            service.record((time.perf_counter() - t0) * 1000, status)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, service, verbose=False):
+        super().__init__(address, Handler)
+        self.service = service
+        self.verbose = verbose
+
+def serve(db_path=DB_PATH, host=HOST, port=PORT, pool_size=POOL_SIZE, verbose=False):
+    try:
+        ensure_indexes(db_path)
+    except sqlite3.Error as e:
+        print(f"Couldn't add the lookup indexes ({e}), lookups will be slower.")
+    service = LookupService(db_path, pool_size)
+    server = Server((host, port), service, verbose)
+    print(f"Serving {db_path} on http://{host}:{server.server_address[1]}/", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+# ----------------------------------------------------------
+# Load test
+# ----------------------------------------------------------
+def make_scratch(folder, discs):
+    db = os.path.join(folder, "ripped.db")
+    conn = load_tool("cdrip-sqlite.py").open_db(db)
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO written_tracks (title, track_id, track_title) VALUES (?, ?, ?)",
+                         ((f"Album {n}", f"T{t:02} {n:08x}", f"Track {t} of {n}")
+                          for n in range(0, discs, 2) for t in range(1, 13, 3)))
+        conn.executemany("INSERT OR IGNORE INTO written_discs (title, cddb_id) VALUES (?, ?)",
+                         ((f"Album {n}", f"{n:08x}") for n in range(1, discs, 2)))
+    conn.close()
+    return db
+
+def client(port, discs, seconds, seed):
+    """One keep-alive client sending a mix of lookups until the time is up. Returns the latencies in ms."""
+    rnd = random.Random(seed)
+    hot = [rnd.randrange(discs) for _ in range(200)]   # the discs everybody asks about
+    pick = lambda: hot[rnd.randrange(len(hot))] if rnd.random() < 0.7 else rnd.randrange(discs)
+    conn = http.client.HTTPConnection(HOST, port)
+    etags = {}
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        r = rnd.random()
+        body = None
+        if r < 0.5:
+            url = "/tracks?id=" + urllib.parse.quote(f"T{rnd.randrange(1, 13):02} {pick():08x}")
+        elif r < 0.8:
+            url = f"/discs?cddb={pick():08x}"
+        elif r < 0.95:
+            url = "/lookup"
+            body = json.dumps({"cddb": [f"{pick():08x}" for _ in range(20)],
+                               "tracks": [f"T{rnd.randrange(1, 13):02} {pick():08x}" for _ in range(30)]})
+        else:
+            url = f"/search?q=Album%20{rnd.randrange(1000)}&kind=discs"
+        headers = {"If-None-Match": etags[url]} if url in etags and body is None else {}
+        t0 = time.perf_counter()
+        conn.request("POST" if body else "GET", url, body, headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if response.getheader("ETag"):
+            etags[url] = response.getheader("ETag")
+    conn.close()
+    return latencies
+
+def writer_probe(db, stop, results, interval):
+    """Commits the way the rip handler does, timing each one."""
+    conn = sqlite3.connect(db, timeout=10)
+    n = 0
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        conn.execute("INSERT OR REPLACE INTO written_tracks (title, track_id, track_title) VALUES (?, ?, ?)",
+                     ("Probe", f"T{n % 99 + 1:02} probe{n // 99:03}", "probe"))
+        conn.commit()
+        results.append((time.perf_counter() - t0) * 1000)
+        n += 1
+        stop.wait(interval)
+    conn.close()
+
+def percentiles(values):
+    values = sorted(values)
+    pct = lambda p: values[int(p * (len(values) - 1))]
+    return f"p50 {pct(0.5):.2f}  p95 {pct(0.95):.2f}  p99 {pct(0.99):.2f}  max {values[-1]:.2f} ms"
+
+def loadtest(seconds=10, clients=4, discs=20000, commit_interval=0.5):
+    with tempfile.TemporaryDirectory() as folder:
+        db = make_scratch(folder, discs)
+        with socket.socket() as s:
+            s.bind((HOST, 0))
+            port = s.getsockname()[1]
+        server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--db", db, "--port", str(port)],
+                                  stdout=subprocess.DEVNULL)
+        try:
+            for _ in range(100):
+                try:
+                    probe = http.client.HTTPConnection(HOST, port, timeout=1)
+                    probe.request("GET", "/health")
+                    probe.getresponse().read()
+                    break
+                except OSError:
+                    time.sleep(0.1)
+
+            # the handler's commits on their own first, then with the lookups going on
+            stop, idle = threading.Event(), []
+            writer = threading.Thread(target=writer_probe, args=(db, stop, idle, 0.05))
+            writer.start()
+            time.sleep(min(3.0, seconds / 3))
+            stop.set()
+            writer.join()
+
+            stop, busy = threading.Event(), []
+            writer = threading.Thread(target=writer_probe, args=(db, stop, busy, commit_interval))
+            writer.start()
+            t0 = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=clients) as pool:
+                runs = list(pool.map(client, [port] * clients, [discs] * clients, [seconds] * clients,
+                                     range(clients)))
+            elapsed = time.perf_counter() - t0
+            stop.set()
+            writer.join()
+
+            probe.request("GET", "/health")
+            health = json.loads(probe.getresponse().read())
+        finally:
+            server.terminate()
+            server.wait()
+
+    latencies = [ms for run in runs for ms in run]
+    print(f"{len(latencies)} requests from {clients} clients in {elapsed:.1f} s: "
+          f"{len(latencies) / elapsed:.0f} requests/s, {discs} discs in the database")
+    print(f"Request latency (client side):  {percentiles(latencies)}")
+    print(f"Request latency (server side):  p50 {health['latency_ms']['p50']}  p95 {health['latency_ms']['p95']}  "
+          f"p99 {health['latency_ms']['p99']} ms")
+    print(f"Cache: {health['cache_hits']} hits, {health['cache_misses']} misses, {health['not_modified']} not modified")
+    print(f"Handler commits without load:   {percentiles(idle)}")
+    print(f"Handler commits under load:     {percentiles(busy)}")
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "loadtest":
+        parser = argparse.ArgumentParser("ripped.db lookup API load test")
+        parser.add_argument("loadtest")
+        parser.add_argument("--seconds", type=float, default=10, help="How long the clients send lookups")
+        parser.add_argument("--clients", type=int, default=4, help="Client processes, one keep-alive connection each")
+        parser.add_argument("--discs", type=int, default=20000, help="Discs in the scratch database")
+        parser.add_argument("--commit-interval", type=float, default=0.5,
+                            help="Seconds between the writer's commits during the load, each one empties the cache")
+        args = parser.parse_args()
+        loadtest(args.seconds, max(1, args.clients), max(2, args.discs), max(0.01, args.commit_interval))
+        return
+
+    parser = argparse.ArgumentParser("ripped.db lookup API")
+    parser.add_argument("--db", default=DB_PATH, help="Path to ripped.db")
+    parser.add_argument("--host", default=HOST, help="Address to listen on (default: this machine only)")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--pool", type=int, default=POOL_SIZE, help="Read-only connections")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        print(f"No database at {args.db}")
+        sys.exit(1)
+    serve(args.db, args.host, args.port, max(1, args.pool), args.verbose)
+
+if __name__ == "__main__":
+    main()
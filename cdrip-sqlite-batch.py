@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+cdrip-sqlite-batch.py
+Runs a whole folder of saved BreakawayCD JSON payloads through the rip handler
+(cdrip-sqlite.py) in one process, for re-processing after the handler has changed
+(the 80% threshold, say) or after an outage.
+
+The payloads are put in the order BreakawayCD would have sent them: by the rip date
+and time of the disc, then deck, then stage (asked after ripping, written, asked at
+eject, written). They go through the handler's own decision and record logic on one
+connection, committed every --batch payloads, and each gets a line in the decision
+report. By default only the database is updated. The keep flags are worked out again
+against the database and keepThreshold as they are now, so they can differ from what
+happened when the disc was played, and deleting the tracks that now look unplayed
+could throw away files that were kept. --effects also carries out the follow-up work
+(log file entries, deleting unplayed tracks, tags, audio analysis): queued in the
+outbox or done inline, as the handler's fastExit setting says. It also records the
+archive events (archiveEvents), which send the tracks on to cdrip-events.py's
+subscribers as newly archived. The report's effects column lists the follow-up work
+that was queued or done, so it stays empty without --effects.
+
+With --dry-run the database file is only read and nothing is committed, queued or
+deleted. The report shows what would have happened, with later payloads seeing what
+earlier ones would have recorded.
+
+Requirements: Python 3 (no external packages).
+Run: python cdrip-sqlite-batch.py FOLDER_OR_GLOB [--db PATH] [--report report.csv] [--dry-run] [--effects]
+"""
+
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import sqlite3
+import pathlib
+import argparse
+
+from cdrip_tools import load_tool
+
+DB_PATH = r"c:\temp\cdrip\ripped.db"
+BATCH = 500     # payloads per commit
+
+REPORT_COLUMNS = ["file", "deck", "stage", "title", "cddb_id", "exit_code", "decision", "kept", "effects"]
+STAGES = {0: "ripped", 1: "ripped, written", 2: "ejected", 3: "ejected, written"}
+
+def stage_of(data):
+    # numbered the way the handler numbers its echo files, minus one
+    return (1 if data.get("written") else 0) | (2 if data.get("ejected") else 0)
+
+def find_payloads(pattern):
+    """Payload files in a folder (*.json, and the handler's *.txt echo files) or matching a glob."""
+    if os.path.isdir(pattern):
+        paths = glob.glob(os.path.join(pattern, "*.json")) + glob.glob(os.path.join(pattern, "*.txt"))
+    else:
+        paths = glob.glob(pattern, recursive=True)
+    return sorted(p for p in paths if os.path.isfile(p))
+
+def read_payloads(paths):
+    """([(path, data)] in the order BreakawayCD would have sent them, [(path, error)])."""
+    payloads, broken = [], []
+    for path in paths:
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if not isinstance(data, dict) or "title" not in data:
+                raise ValueError("not a BreakawayCD payload")
+            payloads.append((path, data))
+        except (OSError, ValueError) as e:
+            broken.append((path, str(e)))
+    payloads.sort(key=lambda p: (p[1].get("ripped-date", ""), p[1].get("ripped-time", ""),
+                                 p[1].get("deck", 0), stage_of(p[1]), p[0]))
+    return payloads, broken
+
+def open_store(handler, path, dry_run):
+    if not dry_run:
+        return handler.open_db(path)
+    # a private in-memory copy, so a dry run sees the real rows but never writes the file
+    conn = sqlite3.connect(":memory:")
+    if os.path.exists(path):
+        src = sqlite3.connect(pathlib.Path(os.path.abspath(path)).as_uri() + "?mode=ro", uri=True)
+        try:
+            src.backup(conn)
+        finally:
+            src.close()
+    handler.create_tables(conn)
+    return conn
+
+def describe_effects(effects):
+    counts = {}
+    for kind, _ in effects:
+        counts[kind] = counts.get(kind, 0) + 1
+    return ", ".join(f"{n} {kind}" for kind, n in counts.items())
+
+def run(pattern, db_path=DB_PATH, report_path=None, dry_run=False, batch=BATCH, effects_on=False, verbose=True):
+    handler = load_tool("cdrip-sqlite.py")
+    payloads, broken = read_payloads(find_payloads(pattern))
+    conn = open_store(handler, db_path, dry_run)
+    cur = conn.cursor()
+    t0 = time.perf_counter()
+
+    report = [dict(file=path, exit_code="", decision=f"unreadable: {error}") for path, error in broken]
+    inline = []         # effects to carry out after the next commit (fastExit = False)
+    queued = recorded = writes = 0
+
+    def commit():
+        conn.commit()
+        if inline:
+            handler.run_effects(inline)
+            inline.clear()
+
+    try:
+        for n, (path, data) in enumerate(payloads, 1):
+            # a payload the handler chokes on leaves nothing behind, like a crashed handler run
+            if not conn.in_transaction:
+                cur.execute("BEGIN")
+            cur.execute("SAVEPOINT payload")
+            try:
+                code, message, effects = handler.handle(cur, data)
+            except (KeyError, TypeError, ValueError) as e:
+                cur.execute("ROLLBACK TO payload")
+                code, message, effects = "", f"bad payload: {e!r}", []
+            cur.execute("RELEASE payload")
+            applied = code == 0 and data.get("written") and effects_on and not dry_run
+            if code == 0 and data.get("written"):
+                recorded += 1
+                if applied:
+                    later, now = handler.split_effects(effects)
+                    queued += handler.queue_effects(cur, later)
+                    inline.extend(now)
+            elif code == 0:
+                writes += 1
+            report.append(dict(file=path, deck=data.get("deck", ""), stage=STAGES[stage_of(data)],
+                               title=data.get("title", ""), cddb_id=data.get("cddb-id", ""),
+                               exit_code=code, decision=message,
+                               kept=sum(1 for t in data.get("track-details", []) if "keep" in t),
+                               effects=describe_effects(effects) if applied else ""))
+            if not dry_run and n % batch == 0:
+                commit()
+                if verbose:
+                    print(f"\r{n}/{len(payloads)} payloads", end="", flush=True)
+        if dry_run:
+            conn.rollback()
+        else:
+            commit()
+    finally:
+        conn.close()
+    if verbose and payloads and not dry_run and len(payloads) >= batch:
+        print()
+
+    if queued and handler.outboxAutostart:
+        handler.start_outbox_worker(db_path)
+
+    if report_path:
+        with open(report_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS, restval="")
+            writer.writeheader()
+            writer.writerows(report)
+    elif verbose:
+        for row in report:
+            print(f'{os.path.basename(row["file"])}: {row.get("stage", "")} "{row.get("title", "")}" '
+                  f'-> {row["decision"]} {row.get("effects", "")}'.rstrip())
+    if verbose:
+        print(f"{len(payloads)} payloads ({len(broken)} unreadable): {writes} asked to write, "
+              f"{recorded} recorded, {queued} follow-up actions queued in {time.perf_counter() - t0:.1f} s"
+              + (" (dry run, nothing was changed)" if dry_run else ""))
+    return report
+
+def main():
+    parser = argparse.ArgumentParser("BreakawayCD payload batch processor")
+    parser.add_argument("payloads", help="Folder of saved JSON payloads, or a glob such as payloads\\**\\*.json")
+    parser.add_argument("--db", default=DB_PATH, help="Path to ripped.db")
+    parser.add_argument("--report", default=None, help="Write the decision report to this CSV file")
+    parser.add_argument("--batch", type=int, default=BATCH, help="Payloads per commit")
+    parser.add_argument("--dry-run", action="store_true", help="Report only, don't touch the DB or any files")
+    parser.add_argument("--effects", action="store_true",
+                        help="Also write log file entries, delete the unplayed tracks, tag and analyse the kept "
+                             "ones (default: record in the DB only)")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args()
+
+    if not find_payloads(args.payloads):
+        print(f"No payload files found: {args.payloads}")
+        sys.exit(1)
+    run(args.payloads, args.db, args.report, args.dry_run, max(1, args.batch),
+        effects_on=args.effects, verbose=not args.quiet)
+
+if __name__ == "__main__":
+    main()
@@ -9,11 +9,26 @@ Run: python cdrip_db_browser.py
 
 import os
 import sqlite3
+import json
+import zlib
 import csv
 import shutil
+import re
+import math
+import time
+import bisect
+import functools
+import heapq
+import itertools
+import pathlib
+import unicodedata
+from array import array
+from collections import Counter, OrderedDict, defaultdict, deque
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, filedialog
 
+from cdrip_tools import load_tool
+
 DB_PATH = r"c:\temp\cdrip\ripped.db"
 BACKUP_DIR = r"c:\temp\cdrip\backups"
 
@@ -24,6 +39,8 @@ def ensure_db(path=DB_PATH):
     created = not os.path.exists(path)
     conn = sqlite3.connect(path)
     cur = conn.cursor()
+    if created:
+        cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
     cur.execute("""
     CREATE TABLE IF NOT EXISTS written_tracks (
         title TEXT,
@@ -39,10 +56,186 @@ def ensure_db(path=DB_PATH):
         PRIMARY KEY (title, cddb_id)
     )
     """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS disc_payloads (
+        title TEXT,
+        cddb_id TEXT,
+        tracks INTEGER,
+        length_bytes INTEGER,
+        kept INTEGER,
+        ripped_date TEXT,
+        ripped_time TEXT,
+        payload BLOB,
+        PRIMARY KEY (title, cddb_id)
+    )
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS disc_payloads_list
+    ON disc_payloads (title, cddb_id, tracks, length_bytes, kept, ripped_date, ripped_time)
+    """)
+    # trigram sets of album and track titles for the duplicate finder
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS title_trigrams (
+        kind TEXT,
+        text TEXT,
+        grams BLOB,
+        PRIMARY KEY (kind, text)
+    )
+    """)
+    # titles merged away by the duplicate finder, the rip handler files them under `title`
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS title_aliases (
+        kind TEXT,
+        alias TEXT,
+        title TEXT,
+        PRIMARY KEY (kind, alias)
+    )
+    """)
     conn.commit()
     conn.close()
     return created
 
+def format_length(nbytes):
+    # same 16-bit stereo 44.1 kHz assumption as the rip handlers
+    nsec = int(nbytes / 176400)
+    return f"{nsec // 60}:{nsec % 60:02}"
+
+# ----------------- Duplicate finder -----------------
+TRACK_KEY_SEP = "\x1f"
+MAX_POSTINGS = 1000     # a trigram shared by more titles than this stops being indexed
+SMALL_GROUP = 64        # up to this many titles, just compare every pair
+
+def normalize_title(text):
+    # "Greatest Hits (Remastered)" and "GREATEST HITS [Remastered]" should look alike,
+    # so bracketed qualifiers, case, accents and punctuation are dropped
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    stripped = re.sub(r"[\(\[\{][^\)\]\}]*[\)\]\}]", " ", text)
+    if stripped.strip():
+        text = stripped
+    return " ".join(re.sub(r"[\W_]+", " ", text).split())
+
+def title_trigrams(text):
+    """Sorted, de-duplicated CRC32 hashes of the trigrams of the normalized text."""
+    padded = f"  {text} "
+    return array("I", sorted({zlib.crc32(padded[i:i+3].encode("utf-8")) for i in range(len(padded) - 2)}))
+
+def _similar_pairs(sets, threshold):
+    """
+    (i, j, similarity) for every pair of trigram sets with a Jaccard similarity of at
+    least `threshold`. Small inputs are compared pair by pair. Otherwise candidates come
+    from prefix filtering: two titles that are similar enough must share at least two of
+    their rarest few grams, so only those grams are indexed and probed and most pairs
+    are never compared at all. Grams so common that even they are shared by more than
+    MAX_POSTINGS titles stop being indexed, which only affects very short, generic
+    titles ("Intro", "Love") that would otherwise be compared with everything.
+    """
+    if len(sets) <= SMALL_GROUP:
+        for i in range(1, len(sets)):
+            s = sets[i]
+            for j in range(i):
+                common = len(s & sets[j])
+                sim = common / (len(s) + len(sets[j]) - common)
+                if sim >= threshold:
+                    yield i, j, sim
+        return
+
+    df = Counter()
+    for s in sets:
+        df.update(s)
+    rank = {g: r for r, g in enumerate(sorted(df, key=lambda g: (df[g], g)))}
+    index = defaultdict(list)
+    for i in sorted(range(len(sets)), key=lambda i: len(sets[i])):
+        s = sets[i]
+        n = len(s)
+        # any match shares at least `needed` grams with us, so the rarest n - needed + 2
+        # grams of both sides have at least two in common
+        needed = math.ceil(threshold * n)
+        shared = 2 if needed >= 2 else 1
+        found = []
+        for g in sorted(s, key=rank.__getitem__)[:n - needed + shared]:
+            postings = index[g]
+            found += postings
+            if len(postings) < MAX_POSTINGS:
+                postings.append(i)
+        if not found:
+            continue
+        min_size = threshold * n
+        for j, c in Counter(found).items():
+            if c < shared or len(sets[j]) < min_size:
+                continue
+            common = len(s & sets[j])
+            sim = common / (n + len(sets[j]) - common)
+            if sim >= threshold:
+                yield i, j, sim
+
+def find_duplicate_clusters(items, threshold=0.7):
+    """
+    items: list of (key, rows, grams). Returns clusters of keys whose trigram sets have
+    a Jaccard similarity of at least `threshold`, best clusters first:
+    [(score, [(key, rows, similarity to the first key), ...]), ...]
+    Keys with identical trigram sets are compared once.
+    """
+    by_grams = defaultdict(list)
+    for i, (_, _, grams) in enumerate(items):
+        if len(grams):
+            by_grams[grams.tobytes()].append(i)
+    groups = list(by_grams.values())
+    sets = [set(items[g[0]][2]) for g in groups]
+    parent = list(range(len(groups)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    scores = defaultdict(list)
+    edges = list(_similar_pairs(sets, threshold))
+    for i, j, sim in edges:
+        parent[find(i)] = find(j)
+    for i, j, sim in edges:
+        scores[find(i)].append(sim)
+    members = defaultdict(list)
+    for i, group in enumerate(groups):
+        if len(group) > 1:
+            scores[find(i)].append(1.0)
+        members[find(i)].extend(group)
+
+    clusters = []
+    for root, sims in scores.items():
+        # the title with the most rows is the suggested one to keep
+        keys = sorted(members[root], key=lambda k: (-items[k][1], items[k][0]))
+        canon = set(items[keys[0]][2])
+        listed = []
+        for k in keys:
+            other = items[k][2]
+            common = len(canon.intersection(other))
+            listed.append((items[k][0], items[k][1], common / (len(canon) + len(other) - common)))
+        clusters.append((sum(sims) / len(sims), listed))
+    clusters.sort(key=lambda c: -c[0])
+    return clusters
+
+def find_duplicate_track_clusters(album_items, track_items, threshold=0.7):
+    """
+    Like find_duplicate_clusters(), for (album, track title, rows, grams) items. Tracks are
+    only compared with the tracks of the same album, or of albums that look like duplicates
+    of it, so the work grows with the size of an album rather than with the library.
+    """
+    group_of = {}
+    for n, (_, members) in enumerate(find_duplicate_clusters(album_items, threshold)):
+        for title, _, _ in members:
+            group_of[title] = n
+    by_group = defaultdict(list)
+    for album, track_title, rows, grams in track_items:
+        by_group[group_of.get(album, album)].append((f"{album}{TRACK_KEY_SEP}{track_title}", rows, grams))
+    clusters = []
+    for items in by_group.values():
+        if len(items) > 1:
+            clusters.extend(find_duplicate_clusters(items, threshold))
+    clusters.sort(key=lambda c: -c[0])
+    return clusters
+
 def make_backup(db_path=DB_PATH):
     os.makedirs(BACKUP_DIR, exist_ok=True)
     basename = os.path.basename(db_path)
@@ -52,55 +245,538 @@ def make_backup(db_path=DB_PATH):
     shutil.copy2(db_path, dest)
     return dest
 
+# Query diagnostics
+SLOW_QUERY_MS = 50                       # statements slower than this go to the slow-query log
+SLOW_LOG_SIZE = 200                      # slow statements kept, the oldest are dropped first
+HISTOGRAM_MS = (1, 4, 16, 64, 256, 1024) # upper bounds of the timing histogram buckets
+
+class QueryLog:
+    """
+    Timings of every statement the browser runs. All statements are counted per query
+    shape (the SQL text, parameters are placeholders already) in a timing histogram;
+    the ones slower than threshold_ms are also kept with their parameters in a ring
+    buffer. A query's time covers executing it and reading its rows.
+    """
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, size=SLOW_LOG_SIZE):
+        self.threshold_ms = threshold_ms
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self.slow = deque(maxlen=self.size)
+        self.shapes = {}
+        self.methods = {}
+        self.plans = {}
+        self.method = None
+
+    def record(self, sql, params, ms, method=None):
+        shape = " ".join(sql.split())
+        stats = self.shapes.get(shape)
+        if stats is None:
+            stats = self.shapes[shape] = {"method": method, "count": 0, "total": 0.0, "max": 0.0,
+                                          "hist": [0] * (len(HISTOGRAM_MS) + 1)}
+        stats["count"] += 1
+        stats["total"] += ms
+        stats["max"] = max(stats["max"], ms)
+        stats["hist"][bisect.bisect_right(HISTOGRAM_MS, ms)] += 1
+        stats["params"] = params
+        if ms >= self.threshold_ms:
+            self.slow.append((time.strftime("%H:%M:%S"), method, shape, params, ms))
+
+    def record_method(self, name, ms):
+        stats = self.methods.setdefault(name, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += ms
+        stats[2] = max(stats[2], ms)
+
+    def plan(self, conn, shape, params):
+        """EXPLAIN QUERY PLAN lines for a query shape, worked out once per shape."""
+        if shape not in self.plans:
+            try:
+                # a plain cursor, so explaining doesn't show up in the log itself
+                cur = sqlite3.Cursor(conn)
+                cur.execute("EXPLAIN QUERY PLAN " + shape, params)
+                self.plans[shape] = [row[3] for row in cur]
+            except sqlite3.Error as e:
+                self.plans[shape] = [f"(no plan: {e})"]
+        return self.plans[shape]
+
+    @staticmethod
+    def plan_flags(plan):
+        flags = []
+        for line in plan:
+            if line.startswith("SCAN ") and " INDEX " not in line:
+                flags.append("FULL TABLE SCAN")
+            elif line.startswith("SCAN "):
+                flags.append("full index scan")
+            elif line.startswith("USE TEMP B-TREE"):
+                flags.append("temp sort")
+        return ", ".join(dict.fromkeys(flags))
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Cursor that logs each statement to connection.query_log once its rows have been
+    read, so the time spent fetching counts too.
+    """
+    _pending = None  # [sql, params, ms, method] of a query still being read
+
+    def _finish(self):
+        if self._pending:
+            sql, params, ms, method = self._pending
+            self._pending = None
+            self.connection.query_log.record(sql, params, ms, method)
+
+    def _timed(self, fetch, *args):
+        t0 = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if self._pending:
+                self._pending[2] += (time.perf_counter() - t0) * 1000
+
+    def execute(self, sql, params=()):
+        self._finish()
+        self._pending = [sql, params, 0.0, self.connection.query_log.method]
+        result = self._timed(super().execute, sql, params)
+        if self.description is None:
+            self._finish()
+        return result
+
+    def executemany(self, sql, seq_of_params):
+        self._finish()
+        seq_of_params = list(seq_of_params)
+        self._pending = [sql, (f"{len(seq_of_params)} rows",), 0.0, self.connection.query_log.method]
+        try:
+            return self._timed(super().executemany, sql, seq_of_params)
+        finally:
+            self._finish()
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        super().close()
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors, conn.execute() included, log to self.query_log."""
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # sqlite3's own shortcuts make a plain cursor without calling cursor()
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+# Search result cache
+RESULT_CACHE_ROWS = 200000               # rows kept over all cached results, least recently used go first
+
+class ResultCache:
+    """
+    LRU cache of the Tracks and Discs tab results, keyed by (tab, filter, sort). All
+    entries belong to one change stamp of the database: PRAGMA data_version, which moves
+    when another connection (the rip handler, the outbox, maintenance) commits, plus the
+    connection's total_changes for our own edits. A lookup under a different stamp
+    empties the cache, so a result is never served after the data has changed.
+    """
+    def __init__(self, max_rows=RESULT_CACHE_ROWS):
+        self.max_rows = max_rows
+        self.hits = self.misses = 0
+        self.clear()
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.rows = 0
+        self.stamp = None
+
+    def get(self, key, stamp):
+        if stamp != self.stamp:
+            self.clear()
+            self.stamp = stamp
+        rows = self.entries.get(key)
+        if rows is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return rows
+
+    def put(self, key, stamp, rows):
+        if stamp != self.stamp or len(rows) > self.max_rows:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.rows -= len(old)
+        self.entries[key] = rows
+        self.rows += len(rows)
+        while self.rows > self.max_rows:
+            _, old = self.entries.popitem(last=False)
+            self.rows -= len(old)
+
+    def summary(self):
+        return f"Cache: {self.hits} hits, {self.misses} misses, {len(self.entries)} results / {self.rows} rows."
+
+def timed(method):
+    """Times a DB method; the statements it runs are logged under its name."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        outer, self.log.method = self.log.method, method.__name__
+        t0 = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.log.method = outer
+            self.log.record_method(method.__name__, (time.perf_counter() - t0) * 1000)
+    return wrapper
+
 class DB:
+    TRACK_COLUMNS = ("title", "track_id", "track_title")
+    DISC_COLUMNS = ("title", "cddb_id")
+
     def __init__(self, path=DB_PATH):
         self.path = path
-        self.conn = sqlite3.connect(self.path)
+        self.conn = sqlite3.connect(self.path, factory=TimedConnection)
+        self.log = self.conn.query_log = QueryLog()
+        self.cache = ResultCache()
         self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA cache_size=-8000")
 
     def close(self):
         self.conn.close()
 
+    def _stamp(self):
+        # a plain cursor, so the check doesn't show up in the query log
+        cur = sqlite3.Cursor(self.conn)
+        return cur.execute("PRAGMA data_version").fetchone()[0], self.conn.total_changes
+
+    def _cached(self, key, query):
+        """The rows of query() from the result cache, or run and cached."""
+        stamp = self._stamp()
+        rows = self.cache.get(key, stamp)
+        if rows is None:
+            rows = query()
+            self.cache.put(key, stamp, rows)
+        return rows
+
+    @staticmethod
+    def _order_by(sort, columns, default):
+        # sort is (column, descending) from a clicked heading, ties keep the default order
+        if not sort:
+            return default
+        column, descending = sort
+        if column not in columns:
+            raise ValueError(f"can't sort by {column}")
+        return f"{column} {'DESC' if descending else 'ASC'}, {default}"
+
     # Tracks
-    def get_tracks(self, filter_text=None):
+    @timed
+    def get_tracks(self, filter_text=None, sort=None):
+        return self._cached(("tracks", filter_text or "", sort), lambda: self._query_tracks(filter_text, sort))
+
+    def _query_tracks(self, filter_text, sort):
         cur = self.conn.cursor()
+        order = self._order_by(sort, self.TRACK_COLUMNS, "title, track_id")
         if filter_text:
             q = "%{}%".format(filter_text)
-            cur.execute("SELECT title, track_id, track_title FROM written_tracks WHERE title LIKE ? OR track_id LIKE ? OR track_title LIKE ? ORDER BY title, track_id", (q,q,q))
+            cur.execute(f"SELECT title, track_id, track_title FROM written_tracks WHERE title LIKE ? OR track_id LIKE ? OR track_title LIKE ? ORDER BY {order}", (q,q,q))
         else:
-            cur.execute("SELECT title, track_id, track_title FROM written_tracks ORDER BY title, track_id")
+            cur.execute(f"SELECT title, track_id, track_title FROM written_tracks ORDER BY {order}")
         return cur.fetchall()
 
+    @timed
     def insert_track(self, title, track_id, track_title):
         cur = self.conn.cursor()
         cur.execute("INSERT OR REPLACE INTO written_tracks (title, track_id, track_title) VALUES (?, ?, ?)", (title, track_id, track_title))
         self.conn.commit()
 
+    @timed
     def delete_track(self, title, track_id):
         cur = self.conn.cursor()
         cur.execute("DELETE FROM written_tracks WHERE title=? AND track_id=?", (title, track_id))
         self.conn.commit()
 
     # Discs
-    def get_discs(self, filter_text=None):
+    @timed
+    def get_discs(self, filter_text=None, sort=None):
+        return self._cached(("discs", filter_text or "", sort), lambda: self._query_discs(filter_text, sort))
+
+    def _query_discs(self, filter_text, sort):
         cur = self.conn.cursor()
+        order = self._order_by(sort, self.DISC_COLUMNS, "title")
         if filter_text:
             q = "%{}%".format(filter_text)
-            cur.execute("SELECT title, cddb_id FROM written_discs WHERE title LIKE ? OR cddb_id LIKE ? ORDER BY title", (q,q))
+            cur.execute(f"SELECT title, cddb_id FROM written_discs WHERE title LIKE ? OR cddb_id LIKE ? ORDER BY {order}", (q,q))
         else:
-            cur.execute("SELECT title, cddb_id FROM written_discs ORDER BY title")
+            cur.execute(f"SELECT title, cddb_id FROM written_discs ORDER BY {order}")
         return cur.fetchall()
 
+    @timed
     def insert_disc(self, title, cddb_id):
         cur = self.conn.cursor()
         cur.execute("INSERT OR REPLACE INTO written_discs (title, cddb_id) VALUES (?, ?)", (title, cddb_id))
         self.conn.commit()
 
+    @timed
     def delete_disc(self, title, cddb_id):
         cur = self.conn.cursor()
         cur.execute("DELETE FROM written_discs WHERE title=? AND cddb_id=?", (title, cddb_id))
         self.conn.commit()
 
+    # Stored payloads (library tree)
+    @timed
+    def get_library_discs(self, filter_text=None, after=None, limit=1000):
+        """
+        One page of discs in (title, cddb_id) order, the ones after the key `after`.
+        Every page is a query of its own that reads to the end, so no read lock is held
+        between pages and the rip handler can commit while the tree fills.
+        """
+        # served from the disc_payloads_list index alone, the payload blobs stay on disk
+        cur = self.conn.cursor()
+        cols = "rowid, title, cddb_id, tracks, length_bytes, kept, ripped_date, ripped_time"
+        where, params = [], []
+        if after is not None:
+            where.append("(title, cddb_id) > (?, ?)")
+            params += after
+        if filter_text:
+            q = "%{}%".format(filter_text)
+            where.append("(title LIKE ? OR cddb_id LIKE ?)")
+            params += [q, q]
+        sql = f"SELECT {cols} FROM disc_payloads INDEXED BY disc_payloads_list"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        cur.execute(sql + " ORDER BY title, cddb_id LIMIT ?", params + [limit])
+        return cur.fetchall()
+
+    @timed
+    def get_disc_payload(self, rowid):
+        cur = self.conn.cursor()
+        cur.execute("SELECT payload FROM disc_payloads WHERE rowid=?", (rowid,))
+        row = cur.fetchone()
+        if row is None or row["payload"] is None:
+            return None
+        return json.loads(zlib.decompress(row["payload"]))
+
+    # Duplicate finder
+    @timed
+    def _trigram_index(self, kind, texts):
+        """
+        Trigram arrays for `texts`, from title_trigrams. Only titles that are new since
+        the last run get computed, titles that are gone are dropped.
+        """
+        cur = self.conn.cursor()
+        cur.execute("SELECT text, grams FROM title_trigrams WHERE kind=?", (kind,))
+        stored = {row[0]: row[1] for row in cur}
+        added = []
+        for text in texts:
+            if text not in stored:
+                grams = title_trigrams(normalize_title(text)).tobytes()
+                stored[text] = grams
+                added.append((kind, text, grams))
+        stale = [(kind, text) for text in stored if text not in texts]
+        cur.executemany("INSERT OR REPLACE INTO title_trigrams (kind, text, grams) VALUES (?, ?, ?)", added)
+        cur.executemany("DELETE FROM title_trigrams WHERE kind=? AND text=?", stale)
+        self.conn.commit()
+        index = {}
+        for text in texts:
+            grams = array("I")
+            grams.frombytes(stored[text])
+            index[text] = grams
+        return index
+
+    @timed
+    def album_candidates(self):
+        """(album title, rows, grams) for every album title in the tracks and discs tables."""
+        cur = self.conn.cursor()
+        cur.execute("""SELECT title, sum(n) FROM (
+                           SELECT title, count(*) AS n FROM written_tracks GROUP BY title
+                           UNION ALL
+                           SELECT title, count(*) AS n FROM written_discs GROUP BY title)
+                       GROUP BY title""")
+        counts = {row[0]: row[1] for row in cur if row[0]}
+        grams = self._trigram_index("album", counts)
+        return [(title, rows, grams[title]) for title, rows in counts.items()]
+
+    @timed
+    def track_candidates(self):
+        """(album title, track title, rows, grams of the track title) for every track title."""
+        cur = self.conn.cursor()
+        cur.execute("SELECT title, track_title, count(*) FROM written_tracks GROUP BY title, track_title")
+        rows = [tuple(row) for row in cur if row[1]]
+        grams = self._trigram_index("track", {row[1] for row in rows})
+        return [(title, track_title, n, grams[track_title]) for title, track_title, n in rows]
+
+    @timed
+    def merge_albums(self, canonical, others):
+        """
+        Moves everything filed under the other album titles to `canonical`, and records
+        the other titles as aliases so the rip handler files them under `canonical` too.
+        """
+        cur = self.conn.cursor()
+        for title in others:
+            if title == canonical:
+                continue
+            # OR IGNORE: rows that already exist under the canonical title win, and the
+            # other title's copies of them are left behind and deleted
+            for table in ("written_tracks", "written_discs", "disc_payloads"):
+                cur.execute(f"UPDATE OR IGNORE {table} SET title=? WHERE title=?", (canonical, title))
+                cur.execute(f"DELETE FROM {table} WHERE title=?", (title,))
+            cur.execute("UPDATE title_aliases SET title=? WHERE kind='album' AND title=?", (canonical, title))
+            cur.execute("INSERT OR REPLACE INTO title_aliases (kind, alias, title) VALUES ('album', ?, ?)", (title, canonical))
+            # track aliases are keyed by album title as well
+            prefix = title + TRACK_KEY_SEP
+            cur.execute("""UPDATE OR IGNORE title_aliases SET alias=? || substr(alias, ?)
+                           WHERE kind='track' AND substr(alias, 1, ?)=?""",
+                        (canonical + TRACK_KEY_SEP, len(prefix) + 1, len(prefix), prefix))
+            cur.execute("DELETE FROM title_aliases WHERE kind='track' AND substr(alias, 1, ?)=?",
+                        (len(prefix), prefix))
+        self.conn.commit()
+
+    @timed
+    def track_mismatches(self, canonical, others):
+        """
+        The pairs among `others` filed under none of the track numbers (the "T03" of the
+        track ids) of `canonical`: most likely a different song with a similar title,
+        rather than the same track spelled differently on another pressing.
+        """
+        cur = self.conn.cursor()
+        def numbers(pair):
+            cur.execute("SELECT DISTINCT substr(track_id, 1, 3) FROM written_tracks WHERE title=? AND track_title=?",
+                        tuple(pair))
+            return {row[0] for row in cur}
+        keep = numbers(canonical)
+        mismatched = []
+        for pair in others:
+            if tuple(pair) == tuple(canonical):
+                continue
+            found = numbers(pair)
+            if found and not found & keep:
+                mismatched.append((tuple(pair), sorted(found)))
+        return mismatched
+
+    @timed
+    def merge_tracks(self, canonical, others, force=False):
+        """
+        canonical and others are (album title, track title) pairs. Renames the other
+        track titles to the canonical one within their album and records them as aliases.
+        Refuses titles filed under other track numbers (see track_mismatches) unless forced.
+        """
+        if not force:
+            mismatched = self.track_mismatches(canonical, others)
+            if mismatched:
+                raise ValueError("Different track numbers: " + ", ".join(
+                    f"{title} / {track_title} ({' '.join(found)})" for (title, track_title), found in mismatched))
+        cur = self.conn.cursor()
+        for title, track_title in others:
+            if track_title == canonical[1]:
+                continue
+            cur.execute("UPDATE OR REPLACE written_tracks SET track_title=? WHERE title=? AND track_title=?",
+                        (canonical[1], title, track_title))
+            cur.execute("INSERT OR REPLACE INTO title_aliases (kind, alias, title) VALUES ('track', ?, ?)",
+                        (f"{title}{TRACK_KEY_SEP}{track_title}", canonical[1]))
+        self.conn.commit()
+
+def sqlite_sort_key(values):
+    """Sort key that orders Python values the way SQLite's ORDER BY orders them."""
+    key = []
+    for v in values:
+        if v is None:
+            key.append((0, 0))
+        elif isinstance(v, (int, float)):
+            key.append((1, v))
+        elif isinstance(v, str):
+            key.append((2, v))
+        else:
+            key.append((3, bytes(v)))
+    return tuple(key)
+
+class MultiDB:
+    """
+    Several ripped.db files (one per station) attached read-only to one connection and
+    searched as one. Each file is queried on its own primary key order and the streams
+    are merged lazily, so rows are only read as far as they are shown.
+    """
+    # kind: (table, columns, filtered columns, order)
+    SEARCHES = {
+        "tracks": ("written_tracks", ("title", "track_id", "track_title"),
+                   ("title", "track_id", "track_title"), ("title", "track_id")),
+        "discs": ("written_discs", ("title", "cddb_id"),
+                  ("title", "cddb_id"), ("title", "cddb_id")),
+        "library": ("disc_payloads", ("title", "cddb_id", "tracks", "length_bytes", "kept", "ripped_date", "ripped_time"),
+                    ("title", "cddb_id"), ("title", "cddb_id")),
+    }
+
+    def __init__(self, paths):
+        # uri=True so ATTACH accepts file: URIs, which is how mode=ro is asked for
+        self.conn = sqlite3.connect("file::memory:", uri=True)
+        self.conn.row_factory = sqlite3.Row
+        self.sources = []  # (schema, label, path)
+        try:
+            for path in paths:
+                self.attach(path)
+        except Exception:
+            self.conn.close()
+            raise
+
+    def attach(self, path):
+        schema = f"s{len(self.sources)}"
+        uri = pathlib.Path(os.path.abspath(path)).as_uri() + "?mode=ro"
+        self.conn.execute(f"ATTACH DATABASE ? AS {schema}", (uri,))
+        self.conn.execute(f"PRAGMA {schema}.cache_size=-8000")
+        # stations all call it ripped.db, the folder tells them apart
+        label = os.path.join(os.path.basename(os.path.dirname(os.path.abspath(path))), os.path.basename(path))
+        self.sources.append((schema, label, path))
+
+    def close(self):
+        self.conn.close()
+
+    def _has_table(self, schema, table):
+        cur = self.conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type='table' AND name=?", (table,))
+        return cur.fetchone() is not None
+
+    def search(self, kind, filter_text=None):
+        """
+        Rows of `kind` from every source, with a leading source column, in the same
+        order a single DB would return them. Returns an iterator.
+        """
+        table, cols, filtered, order = self.SEARCHES[kind]
+        streams = []
+        for schema, label, _ in self.sources:
+            if not self._has_table(schema, table):
+                continue
+            sql = f"SELECT ? AS source, {', '.join(cols)} FROM {schema}.{table}"
+            params = [label]
+            if filter_text:
+                sql += " WHERE " + " OR ".join(f"{c} LIKE ?" for c in filtered)
+                params += ["%{}%".format(filter_text)] * len(filtered)
+            # ORDER BY the primary key walks the index, no sorting per source
+            sql += f" ORDER BY {', '.join(order)}"
+            streams.append(self.conn.execute(sql, params))
+        return heapq.merge(*streams, key=lambda row: sqlite_sort_key([row[c] for c in order]))
+
 class App(tk.Tk):
     def __init__(self, dbpath=DB_PATH):
         super().__init__()
@@ -109,6 +785,8 @@ class App(tk.Tk):
         self.dbpath = dbpath
         ensure_db(self.dbpath)
         self.db = DB(self.dbpath)
+        self.sort = {"tracks": None, "discs": None}     # (column, descending) of a clicked heading
+        self.shown = {"tracks": None, "discs": None}    # the cached result each tab shows
 
         self._build_ui()
 
@@ -123,6 +801,21 @@ class App(tk.Tk):
         open_btn = ttk.Button(toolbar, text="Open DB...", command=self._open_db_file)
         open_btn.pack(side="left", padx=4, pady=4)
 
+        multi_btn = ttk.Button(toolbar, text="Search Several DBs...", command=lambda: FederatedWindow(self))
+        multi_btn.pack(side="left", padx=4, pady=4)
+
+        self.maint_btn = ttk.Button(toolbar, text="Maintain DB", command=self._maintain_db)
+        self.maint_btn.pack(side="left", padx=4, pady=4)
+
+        self.convert_btn = ttk.Button(toolbar, text="Convert DB...", command=self._convert_db)
+        self.convert_btn.pack(side="left", padx=4, pady=4)
+
+        dupes_btn = ttk.Button(toolbar, text="Find Duplicates", command=lambda: DuplicatesWindow(self))
+        dupes_btn.pack(side="left", padx=4, pady=4)
+
+        diag_btn = ttk.Button(toolbar, text="Diagnostics", command=lambda: DiagnosticsWindow(self))
+        diag_btn.pack(side="left", padx=4, pady=4)
+
         help_btn = ttk.Button(toolbar, text="Help", command=self._show_help)
         help_btn.pack(side="right", padx=4, pady=4)
 
@@ -142,6 +835,12 @@ class App(tk.Tk):
 
         self._build_discs_tab(self.discs_tab)
 
+        # Library tab
+        self.library_tab = ttk.Frame(tab_control)
+        tab_control.add(self.library_tab, text="Library")
+
+        self._build_library_tab(self.library_tab)
+
         # status bar
         self.status = tk.StringVar(value=f"DB: {self.dbpath}")
         statusbar = ttk.Label(self, textvariable=self.status, relief="sunken", anchor="w")
@@ -150,6 +849,7 @@ class App(tk.Tk):
         # load initial data
         self.load_tracks()
         self.load_discs()
+        self.load_library()
 
     # ----------------- Tracks Tab -----------------
     def _build_tracks_tab(self, parent):
@@ -184,19 +884,31 @@ class App(tk.Tk):
         cols = ("title", "track_id", "track_title")
         self.tracks_tree = ttk.Treeview(parent, columns=cols, show="headings", selectmode="browse")
         for c in cols:
-            self.tracks_tree.heading(c, text=c.replace("_"," ").title())
+            self.tracks_tree.heading(c, text=c.replace("_"," ").title(), command=lambda c=c: self._sort_by("tracks", c))
             self.tracks_tree.column(c, width=250 if c=="title" else 200, anchor="w")
         self.tracks_tree.pack(fill="both", expand=True, padx=6, pady=(0,6))
         self.tracks_tree.bind("<Double-1>", lambda e: self.edit_selected_track())
 
     def load_tracks(self):
-        for r in self.tracks_tree.get_children():
-            self.tracks_tree.delete(r)
         q = self.tracks_search.get().strip()
-        rows = self.db.get_tracks(filter_text=q if q else None)
-        for row in rows:
-            self.tracks_tree.insert("", "end", values=(row["title"], row["track_id"], row["track_title"]))
-        self.status.set(f"Loaded {len(rows)} tracks. DB: {self.dbpath}")
+        rows = self.db.get_tracks(filter_text=q if q else None, sort=self.sort["tracks"])
+        # the very same cached result is already on screen, nothing to redraw
+        if rows is not self.shown["tracks"]:
+            self.shown["tracks"] = rows
+            self.tracks_tree.delete(*self.tracks_tree.get_children())
+            for row in rows:
+                self.tracks_tree.insert("", "end", values=(row["title"], row["track_id"], row["track_title"]))
+        self.status.set(f"Loaded {len(rows)} tracks. {self.db.cache.summary()} DB: {self.dbpath}")
+
+    def _sort_by(self, kind, column):
+        # first click sorts ascending, the next one descending
+        sort = self.sort[kind]
+        self.sort[kind] = (column, not sort[1]) if sort and sort[0] == column else (column, False)
+        tree = self.tracks_tree if kind == "tracks" else self.discs_tree
+        for c in tree["columns"]:
+            arrow = ("  \u25bc" if self.sort[kind][1] else "  \u25b2") if c == column else ""
+            tree.heading(c, text=c.replace("_"," ").title() + arrow)
+        (self.load_tracks if kind == "tracks" else self.load_discs)()
 
     def add_track(self):
         dlg = TrackDialog(self, title="Add Track")
@@ -274,19 +986,20 @@ class App(tk.Tk):
         cols = ("title", "cddb_id")
         self.discs_tree = ttk.Treeview(parent, columns=cols, show="headings", selectmode="browse")
         for c in cols:
-            self.discs_tree.heading(c, text=c.replace("_"," ").title())
+            self.discs_tree.heading(c, text=c.replace("_"," ").title(), command=lambda c=c: self._sort_by("discs", c))
             self.discs_tree.column(c, width=400 if c=="title" else 300, anchor="w")
         self.discs_tree.pack(fill="both", expand=True, padx=6, pady=(0,6))
         self.discs_tree.bind("<Double-1>", lambda e: self.edit_selected_disc())
 
     def load_discs(self):
-        for r in self.discs_tree.get_children():
-            self.discs_tree.delete(r)
         q = self.discs_search.get().strip()
-        rows = self.db.get_discs(filter_text=q if q else None)
-        for row in rows:
-            self.discs_tree.insert("", "end", values=(row["title"], row["cddb_id"]))
-        self.status.set(f"Loaded {len(rows)} discs. DB: {self.dbpath}")
+        rows = self.db.get_discs(filter_text=q if q else None, sort=self.sort["discs"])
+        if rows is not self.shown["discs"]:
+            self.shown["discs"] = rows
+            self.discs_tree.delete(*self.discs_tree.get_children())
+            for row in rows:
+                self.discs_tree.insert("", "end", values=(row["title"], row["cddb_id"]))
+        self.status.set(f"Loaded {len(rows)} discs. {self.db.cache.summary()} DB: {self.dbpath}")
 
     def add_disc(self):
         dlg = DiscDialog(self, title="Add Disc")
@@ -331,14 +1044,102 @@ class App(tk.Tk):
             except Exception as e:
                 messagebox.showerror("Error", f"Delete failed: {e}")
 
+    # ----------------- Library Tab -----------------
+    def _build_library_tab(self, parent):
+        top = ttk.Frame(parent)
+        top.pack(side="top", fill="x", padx=6, pady=6)
+
+        search_lbl = ttk.Label(top, text="Search:")
+        search_lbl.pack(side="left")
+        self.library_search = ttk.Entry(top)
+        self.library_search.pack(side="left", padx=4)
+        self.library_search.bind("<Return>", lambda e: self.load_library())
+
+        search_btn = ttk.Button(top, text="Filter", command=self.load_library)
+        search_btn.pack(side="left", padx=2)
+
+        clear_btn = ttk.Button(top, text="Clear", command=lambda: (self.library_search.delete(0, tk.END), self.load_library()))
+        clear_btn.pack(side="left", padx=2)
+
+        # Treeview: discs at the top level, their tracks are loaded when a disc is expanded
+        cols = ("id", "length", "played", "date", "filepath")
+        self.library_tree = ttk.Treeview(parent, columns=cols, show="tree headings", selectmode="browse")
+        self.library_tree.heading("#0", text="Title")
+        self.library_tree.column("#0", width=300, anchor="w")
+        headings = {"id": "CDDB / Track ID", "length": "Length", "played": "Played",
+                    "date": "Date", "filepath": "File"}
+        widths = {"id": 140, "length": 60, "played": 70, "date": 140, "filepath": 300}
+        for c in cols:
+            self.library_tree.heading(c, text=headings[c])
+            self.library_tree.column(c, width=widths[c], anchor="w")
+        self.library_tree.pack(fill="both", expand=True, padx=6, pady=(0,6))
+        self.library_tree.bind("<<TreeviewOpen>>", self._expand_library_disc)
+        self._library_load_id = None
+
+    def load_library(self):
+        # discs are streamed into the tree in chunks from the event loop,
+        # so even a very large library shows up immediately and stays responsive
+        if self._library_load_id:
+            self.after_cancel(self._library_load_id)
+            self._library_load_id = None
+        self.library_tree.delete(*self.library_tree.get_children())
+        q = self.library_search.get().strip()
+        count = 0
+        last = None
+
+        def load_chunk():
+            nonlocal count, last
+            chunk = self.db.get_library_discs(filter_text=q if q else None, after=last)
+            for row in chunk:
+                iid = f"d{row['rowid']}"
+                self.library_tree.insert("", "end", iid=iid, text=row["title"],
+                                         values=(row["cddb_id"], format_length(row["length_bytes"] or 0),
+                                                 f"{row['kept']}/{row['tracks']} kept",
+                                                 f"{row['ripped_date']} {row['ripped_time']}", ""))
+                # placeholder child, so the disc gets an expand marker
+                self.library_tree.insert(iid, "end", iid=f"{iid}-stub")
+            count += len(chunk)
+            if chunk:
+                last = (chunk[-1]["title"], chunk[-1]["cddb_id"])
+                self.status.set(f"Loading library... {count} discs. DB: {self.dbpath}")
+                self._library_load_id = self.after(1, load_chunk)
+            else:
+                self._library_load_id = None
+                self.status.set(f"Loaded {count} discs in library. DB: {self.dbpath}")
+
+        load_chunk()
+
+    def _expand_library_disc(self, event=None):
+        iid = self.library_tree.focus()
+        if not iid.startswith("d") or not self.library_tree.exists(f"{iid}-stub"):
+            return
+        self.library_tree.delete(f"{iid}-stub")
+        data = self.db.get_disc_payload(int(iid[1:]))
+        if not data:
+            return
+        for track in data.get("track-details", []):
+            length = track.get("length-bytes", 0)
+            played = track.get("played-bytes")
+            if played is not None and length > 0:
+                played = f"{100 * played / length:.0f}%"
+            else:
+                played = ""
+            if "keep" in track:
+                played += " kept"
+            self.library_tree.insert(iid, "end", text=f'{track["number"]:02} {track.get("title", "")}',
+                                     values=(track.get("id", f'T{track["number"]:02} {data["cddb-id"]}'),
+                                             format_length(length), played,
+                                             f'{track.get("played-date", "")} {track.get("played-time", "")}'.strip(),
+                                             track.get("filepath", "")))
+
     # ----------------- Utilities -----------------
     def export_csv(self, kind="tracks"):
         if kind == "tracks":
-            rows = self.db.get_tracks(filter_text=self.tracks_search.get().strip() or None)
+            rows = self.db.get_tracks(filter_text=self.tracks_search.get().strip() or None, sort=self.sort["tracks"])
             default_name = os.path.join(os.path.expanduser("~"), "cdrip_tracks_export.csv")
             columns = ["title", "track_id", "track_title"]
         else:
-            rows = self.db.get_discs(filter_text=self.discs_search.get().strip() or None)
+            rows = self.db.get_discs(filter_text=self.discs_search.get().strip() or None, sort=self.sort["discs"])
             default_name = os.path.join(os.path.expanduser("~"), "cdrip_discs_export.csv")
             columns = ["title", "cddb_id"]
 
@@ -363,6 +1164,74 @@ class App(tk.Tk):
         except Exception as e:
             messagebox.showerror("Backup Failed", str(e))
 
+    def _maintain_db(self):
+        # runs the maintenance one small step per event loop turn, so neither the UI
+        # nor a rip handler writing to the same file is held up for long
+        try:
+            maint = load_tool("cdrip-sqlite-maintenance.py")
+            conn = maint.open_db(self.dbpath)
+        except Exception as e:
+            messagebox.showerror("Maintenance Failed", str(e))
+            return
+        before = maint.db_stats(conn)
+        lat_before = maint.lookup_latency(conn)
+        steps = maint.maintenance_steps(conn)
+        self.maint_btn.state(["disabled"])
+
+        def step():
+            try:
+                msg = next(steps)
+            except StopIteration:
+                report = maint.format_report(before, maint.db_stats(conn), lat_before, maint.lookup_latency(conn))
+                if maint.needs_tuning(conn):
+                    report += "\n\n" + maint.CONVERT_NOTE + " (Convert DB...)"
+                conn.close()
+                self.maint_btn.state(["!disabled"])
+                self.status.set(f"Maintenance done. DB: {self.dbpath}")
+                messagebox.showinfo("Maintenance Done", report)
+                return
+            except Exception as e:
+                conn.close()
+                self.maint_btn.state(["!disabled"])
+                messagebox.showerror("Maintenance Failed", str(e))
+                return
+            self.status.set(f"Maintenance: {msg}")
+            self.after(50, step)
+
+        step()
+
+    def _convert_db(self):
+        # the one step that can't be cut up: a full VACUUM, so only on request
+        try:
+            maint = load_tool("cdrip-sqlite-maintenance.py")
+            conn = maint.open_db(self.dbpath)
+        except Exception as e:
+            messagebox.showerror("Conversion Failed", str(e))
+            return
+        try:
+            if not maint.needs_tuning(conn):
+                messagebox.showinfo("Convert DB", "This database already uses incremental auto-vacuum.")
+                return
+            size = maint.db_stats(conn)["bytes"] / 1048576
+            if not messagebox.askyesno("Convert DB",
+                    f"Converting rewrites the whole database ({size:.1f} MB) with a full VACUUM. "
+                    "Nothing else can use it meanwhile: a rip handler that has to wait more than "
+                    "5 seconds fails to record its disc, and this window doesn't respond.\n\n"
+                    "Only continue when no deck is busy. Convert now?"):
+                return
+            self.status.set("Converting the database...")
+            self.config(cursor="watch")
+            self.update_idletasks()
+            maint.convert(conn)
+            self.status.set(f"Conversion done. DB: {self.dbpath}")
+            messagebox.showinfo("Convert DB", "Converted to incremental auto-vacuum.")
+        except Exception as e:
+            self.status.set(f"DB: {self.dbpath}")
+            messagebox.showerror("Conversion Failed", str(e))
+        finally:
+            self.config(cursor="")
+            conn.close()
+
     def _open_db_file(self):
         path = filedialog.askopenfilename(title="Open SQLite DB", filetypes=[("SQLite DB","*.db;*.sqlite;*.sqlite3"),("All files","*.*")])
         if not path:
@@ -374,15 +1243,17 @@ class App(tk.Tk):
         try:
             self.db.close()
             self.dbpath = path
+            ensure_db(self.dbpath)
             self.db = DB(self.dbpath)
             self.status.set(f"DB: {self.dbpath}")
             self.load_tracks()
             self.load_discs()
+            self.load_library()
         except Exception as e:
             messagebox.showerror("Open Failed", str(e))
 
     def _show_help(self):
-        messagebox.showinfo("Help", "Use the tabs to view Tracks or Discs.\nSelect a row and use Edit or Delete.\nBackups are created automatically before destructive changes.")
+        messagebox.showinfo("Help", "Use the tabs to view Tracks or Discs.\nThe Library tab shows every written disc; expand a disc to see its tracks.\nSelect a row and use Edit or Delete. Click a column heading to sort by it.\nSearch Several DBs opens other stations' DBs read-only and searches them together.\nDiagnostics shows how long each query took and flags the ones that scan whole tables.\nMaintain DB returns free space in small steps while the decks keep running; Convert DB rewrites an older DB once and locks it meanwhile.\nBackups are created automatically before destructive changes.")
 
     def on_closing(self):
         try:
@@ -392,6 +1263,318 @@ class App(tk.Tk):
         self.destroy()
 
 # ---------------- Dialogs ----------------
+class DuplicatesWindow(tk.Toplevel):
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.title("Find Duplicates")
+        self.geometry("800x500")
+
+        top = ttk.Frame(self)
+        top.pack(side="top", fill="x", padx=6, pady=6)
+
+        self.kind = tk.StringVar(value="album")
+        ttk.Radiobutton(top, text="Albums", variable=self.kind, value="album").pack(side="left")
+        ttk.Radiobutton(top, text="Tracks", variable=self.kind, value="track").pack(side="left", padx=4)
+
+        ttk.Label(top, text="Similarity:").pack(side="left", padx=(8,0))
+        self.threshold = tk.DoubleVar(value=0.7)
+        ttk.Spinbox(top, from_=0.3, to=1.0, increment=0.05, width=5, textvariable=self.threshold).pack(side="left", padx=4)
+
+        ttk.Button(top, text="Search", command=self.search).pack(side="left", padx=4)
+        ttk.Button(top, text="Merge Selected Cluster", command=self.merge_selected).pack(side="right", padx=4)
+
+        cols = ("rows", "similarity")
+        self.tree = ttk.Treeview(self, columns=cols, show="tree headings", selectmode="browse")
+        self.tree.heading("#0", text="Title")
+        self.tree.column("#0", width=560, anchor="w")
+        self.tree.heading("rows", text="Rows")
+        self.tree.column("rows", width=80, anchor="e")
+        self.tree.heading("similarity", text="Similarity")
+        self.tree.column("similarity", width=100, anchor="e")
+        self.tree.pack(fill="both", expand=True, padx=6, pady=(0,6))
+
+        self.status = tk.StringVar(value="Pick albums or tracks and press Search.")
+        ttk.Label(self, textvariable=self.status, relief="sunken", anchor="w").pack(side="bottom", fill="x")
+        self.clusters = []
+
+    def search(self):
+        self.tree.delete(*self.tree.get_children())
+        self.status.set("Searching...")
+        self.update_idletasks()
+        t0 = time.perf_counter()
+        try:
+            threshold = float(self.threshold.get())
+            albums = items = self.app.db.album_candidates()
+            if self.kind.get() == "album":
+                self.clusters = find_duplicate_clusters(albums, threshold)
+            else:
+                items = self.app.db.track_candidates()
+                self.clusters = find_duplicate_track_clusters(albums, items, threshold)
+        except Exception as e:
+            messagebox.showerror("Find Duplicates", str(e), parent=self)
+            return
+        self.searched_kind = self.kind.get()
+        for n, (score, members) in enumerate(self.clusters):
+            cid = f"c{n}"
+            self.tree.insert("", "end", iid=cid, open=True,
+                             text=f"{len(members)} titles", values=("", f"{score:.2f}"))
+            for m, (key, rows, sim) in enumerate(members):
+                self.tree.insert(cid, "end", iid=f"{cid}-{m}", text=key.replace(TRACK_KEY_SEP, " / "),
+                                 values=(rows, f"{sim:.2f}"))
+        self.status.set(f"{len(self.clusters)} clusters among {len(items)} titles "
+                        f"in {time.perf_counter() - t0:.1f} s. Select a title to keep it, then Merge.")
+
+    def merge_selected(self):
+        sel = self.tree.selection()
+        if not sel:
+            messagebox.showinfo("Merge", "Select a cluster, or the title in it to keep.", parent=self)
+            return
+        cid, _, member = sel[0].partition("-")
+        members = self.clusters[int(cid[1:])][1]
+        keep = members[int(member)] if member else members[0]
+        keys = [m[0] for m in members]
+        shown = keep[0].replace(TRACK_KEY_SEP, " / ")
+        if not messagebox.askyesno("Confirm Merge", f"Merge {len(keys)} titles into '{shown}'?", parent=self):
+            return
+        if self.searched_kind != "album":
+            canonical, pairs = keep[0].split(TRACK_KEY_SEP, 1), [k.split(TRACK_KEY_SEP, 1) for k in keys]
+            try:
+                mismatched = self.app.db.track_mismatches(canonical, pairs)
+            except Exception as e:
+                messagebox.showerror("Merge Failed", str(e), parent=self)
+                return
+            if mismatched:
+                listed = "\n".join(f"{title} / {track_title}: {' '.join(found)}"
+                                   for (title, track_title), found in mismatched[:10])
+                if not messagebox.askyesno("Different Tracks?",
+                        f"These titles are filed under other track numbers than '{shown}', so they may be "
+                        f"different songs:\n\n{listed}\n\nMerge them anyway?", icon="warning", parent=self):
+                    return
+        try:
+            make_backup(self.app.dbpath)
+            if self.searched_kind == "album":
+                self.app.db.merge_albums(keep[0], keys)
+            else:
+                self.app.db.merge_tracks(canonical, pairs, force=True)
+        except Exception as e:
+            messagebox.showerror("Merge Failed", str(e), parent=self)
+            return
+        self.tree.delete(cid)
+        self.app.load_tracks()
+        self.app.load_discs()
+        self.app.load_library()
+
+class FederatedWindow(tk.Toplevel):
+    """Searches the ripped.db files of several stations at once, read-only."""
+    PAGE = 1000
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.title("Search Several DBs")
+        self.geometry("900x600")
+        self.mdb = None
+        self.rows = iter(())
+        self.shown = 0
+
+        sources = ttk.Frame(self)
+        sources.pack(side="top", fill="x", padx=6, pady=6)
+        self.paths = tk.Listbox(sources, height=4)
+        self.paths.pack(side="left", fill="x", expand=True)
+        self.paths.insert(tk.END, app.dbpath)
+        buttons = ttk.Frame(sources)
+        buttons.pack(side="left", padx=4)
+        ttk.Button(buttons, text="Add DB...", command=self.add_db).pack(fill="x")
+        ttk.Button(buttons, text="Remove", command=self.remove_db).pack(fill="x", pady=2)
+
+        top = ttk.Frame(self)
+        top.pack(side="top", fill="x", padx=6, pady=(0,6))
+        self.kind = tk.StringVar(value="tracks")
+        for kind in ("tracks", "discs", "library"):
+            ttk.Radiobutton(top, text=kind.title(), variable=self.kind, value=kind).pack(side="left")
+        ttk.Label(top, text="Search:").pack(side="left", padx=(8,0))
+        self.search_entry = ttk.Entry(top)
+        self.search_entry.pack(side="left", padx=4)
+        self.search_entry.bind("<Return>", lambda e: self.search())
+        ttk.Button(top, text="Filter", command=self.search).pack(side="left", padx=2)
+        self.more_btn = ttk.Button(top, text="More", command=self.load_more)
+        self.more_btn.pack(side="right", padx=4)
+        self.more_btn.state(["disabled"])
+
+        self.tree = ttk.Treeview(self, show="headings", selectmode="browse")
+        self.tree.pack(fill="both", expand=True, padx=6, pady=(0,6))
+
+        self.status = tk.StringVar(value="Add the station DBs to search, then press Filter.")
+        ttk.Label(self, textvariable=self.status, relief="sunken", anchor="w").pack(side="bottom", fill="x")
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
+
+    def add_db(self):
+        paths = filedialog.askopenfilenames(title="Add SQLite DBs", parent=self,
+                                            filetypes=[("SQLite DB","*.db;*.sqlite;*.sqlite3"),("All files","*.*")])
+        for path in paths:
+            if path not in self.paths.get(0, tk.END):
+                self.paths.insert(tk.END, path)
+        self._close_mdb()
+
+    def remove_db(self):
+        for i in reversed(self.paths.curselection()):
+            self.paths.delete(i)
+        self._close_mdb()
+
+    def _close_mdb(self):
+        if self.mdb:
+            self.mdb.close()
+            self.mdb = None
+
+    def search(self):
+        kind = self.kind.get()
+        try:
+            if self.mdb is None:
+                self.mdb = MultiDB(self.paths.get(0, tk.END))
+            self.rows = self.mdb.search(kind, self.search_entry.get().strip() or None)
+        except Exception as e:
+            self._close_mdb()
+            messagebox.showerror("Search Failed", str(e), parent=self)
+            return
+        cols = ("source",) + MultiDB.SEARCHES[kind][1]
+        self.tree.delete(*self.tree.get_children())
+        self.tree.configure(columns=cols)
+        for c in cols:
+            self.tree.heading(c, text=c.replace("_"," ").title())
+            self.tree.column(c, width=250 if c == "title" else 140, anchor="w")
+        self.shown = 0
+        self.load_more()
+
+    def load_more(self):
+        # only as many rows as are shown are read from the files
+        chunk = list(itertools.islice(self.rows, self.PAGE))
+        for row in chunk:
+            self.tree.insert("", "end", values=tuple(row))
+        self.shown += len(chunk)
+        more = len(chunk) == self.PAGE
+        self.more_btn.state(["!disabled"] if more else ["disabled"])
+        sources = len(self.mdb.sources) if self.mdb else 0
+        self.status.set(f"{self.shown} rows from {sources} DBs" + (", more available." if more else "."))
+
+    def on_closing(self):
+        self._close_mdb()
+        self.destroy()
+
+class DiagnosticsWindow(tk.Toplevel):
+    """Timings of the browser's queries: per query shape, per DB method and the slow-query log."""
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.title("Query Diagnostics")
+        self.geometry("1000x600")
+
+        top = ttk.Frame(self)
+        top.pack(side="top", fill="x", padx=6, pady=6)
+        ttk.Label(top, text="Slow query threshold (ms):").pack(side="left")
+        self.threshold = tk.DoubleVar(value=app.db.log.threshold_ms)
+        ttk.Spinbox(top, from_=1, to=10000, increment=10, width=7, textvariable=self.threshold,
+                    command=self._set_threshold).pack(side="left", padx=4)
+        ttk.Button(top, text="Refresh", command=self.refresh).pack(side="left", padx=4)
+        ttk.Button(top, text="Clear", command=self.clear).pack(side="left", padx=4)
+
+        tabs = ttk.Notebook(self)
+        tabs.pack(fill="both", expand=True, padx=6)
+
+        buckets = [f"<{b}" for b in HISTOGRAM_MS] + [f">={HISTOGRAM_MS[-1]}"]
+        self.hist_cols = tuple(f"h{i}" for i in range(len(buckets)))
+        cols = ("method", "count", "avg", "max") + self.hist_cols + ("plan",)
+        self.shapes_tree = ttk.Treeview(tabs, columns=cols, show="tree headings", selectmode="browse")
+        self.shapes_tree.heading("#0", text="Query")
+        self.shapes_tree.column("#0", width=300, anchor="w")
+        for c, text, width in (("method", "Method", 120), ("count", "Count", 55),
+                               ("avg", "Avg ms", 60), ("max", "Max ms", 60), ("plan", "Plan", 150)):
+            self.shapes_tree.heading(c, text=text)
+            self.shapes_tree.column(c, width=width, anchor="w" if c in ("method", "plan") else "e")
+        for c, text in zip(self.hist_cols, buckets):
+            self.shapes_tree.heading(c, text=text)
+            self.shapes_tree.column(c, width=45, anchor="e")
+        self.shapes_tree.tag_configure("scan", foreground="red")
+        self.shapes_tree.bind("<<TreeviewSelect>>", self._show_shape)
+        tabs.add(self.shapes_tree, text="Query Shapes (ms histogram)")
+
+        cols = ("time", "method", "ms", "plan")
+        self.slow_tree = ttk.Treeview(tabs, columns=cols, show="tree headings", selectmode="browse")
+        self.slow_tree.heading("#0", text="Query")
+        self.slow_tree.column("#0", width=450, anchor="w")
+        for c, text, width in (("time", "Time", 70), ("method", "Method", 120), ("ms", "ms", 70), ("plan", "Plan", 200)):
+            self.slow_tree.heading(c, text=text)
+            self.slow_tree.column(c, width=width, anchor="e" if c == "ms" else "w")
+        self.slow_tree.tag_configure("scan", foreground="red")
+        self.slow_tree.bind("<<TreeviewSelect>>", self._show_slow)
+        tabs.add(self.slow_tree, text="Slow Queries")
+
+        cols = ("count", "total", "avg", "max")
+        self.methods_tree = ttk.Treeview(tabs, columns=cols, show="tree headings", selectmode="browse")
+        self.methods_tree.heading("#0", text="DB Method")
+        self.methods_tree.column("#0", width=250, anchor="w")
+        for c, text in zip(cols, ("Calls", "Total ms", "Avg ms", "Max ms")):
+            self.methods_tree.heading(c, text=text)
+            self.methods_tree.column(c, width=90, anchor="e")
+        tabs.add(self.methods_tree, text="DB Methods")
+
+        # SQL, parameters and query plan of the selected query
+        self.detail = tk.Text(self, height=9, wrap="word")
+        self.detail.pack(fill="x", padx=6, pady=6)
+        self.refresh()
+
+    def _set_threshold(self):
+        try:
+            self.app.db.log.threshold_ms = float(self.threshold.get())
+        except (tk.TclError, ValueError):
+            pass
+
+    def clear(self):
+        self.app.db.log.clear()
+        self.refresh()
+
+    def refresh(self):
+        self._set_threshold()
+        log = self.app.db.log
+        self.shapes_tree.delete(*self.shapes_tree.get_children())
+        self.slow_tree.delete(*self.slow_tree.get_children())
+        self.methods_tree.delete(*self.methods_tree.get_children())
+        self.shape_iids = {}
+        for n, (shape, st) in enumerate(sorted(log.shapes.items(), key=lambda kv: -kv[1]["total"])):
+            flags = log.plan_flags(log.plan(self.app.db.conn, shape, st["params"]))
+            iid = f"q{n}"
+            self.shape_iids[iid] = shape
+            self.shapes_tree.insert("", "end", iid=iid, text=shape,
+                                    values=(st["method"] or "", st["count"], f"{st['total'] / st['count']:.1f}",
+                                            f"{st['max']:.1f}", *st["hist"], flags),
+                                    tags=("scan",) if "FULL" in flags else ())
+        self.slow_entries = list(log.slow)
+        for n, (when, method, shape, params, ms) in enumerate(reversed(self.slow_entries)):
+            flags = log.plan_flags(log.plan(self.app.db.conn, shape, params))
+            self.slow_tree.insert("", "end", iid=f"s{len(self.slow_entries) - 1 - n}", text=shape,
+                                  values=(when, method or "", f"{ms:.1f}", flags),
+                                  tags=("scan",) if "FULL" in flags else ())
+        for name, (count, total, worst) in sorted(log.methods.items(), key=lambda kv: -kv[1][1]):
+            self.methods_tree.insert("", "end", text=name,
+                                     values=(count, f"{total:.1f}", f"{total / count:.1f}", f"{worst:.1f}"))
+
+    def _show_detail(self, shape, params, extra=""):
+        plan = self.app.db.log.plan(self.app.db.conn, shape, params)
+        self.detail.delete("1.0", tk.END)
+        self.detail.insert(tk.END, f"{shape}\n\nParameters: {params!r}{extra}\n\nQuery plan:\n  " + "\n  ".join(plan))
+
+    def _show_shape(self, event=None):
+        sel = self.shapes_tree.selection()
+        if sel:
+            shape = self.shape_iids[sel[0]]
+            self._show_detail(shape, self.app.db.log.shapes[shape]["params"], " (last call)")
+
+    def _show_slow(self, event=None):
+        sel = self.slow_tree.selection()
+        if sel:
+            when, method, shape, params, ms = self.slow_entries[int(sel[0][1:])]
+            self._show_detail(shape, params, f"\nTook {ms:.1f} ms at {when} in {method}")
+
 class TrackDialog(simpledialog.Dialog):
     def __init__(self, parent, title=None, initial=None):
         self.initial = initial
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+cdrip-sqlite-maintenance.py
+Keeps c:\temp\cdrip\ripped.db compact and its query plans fresh.
+
+Every step is small and commits on its own, so a rip handler that arrives while
+maintenance is running waits a few milliseconds at most.
+
+Databases created before incremental auto-vacuum was switched on need a one-time
+conversion (--convert), a full VACUUM that rewrites the file and locks it out for the
+whole time. A rip handler gives up after 5 seconds, so only convert when no deck is
+busy. Until then the regular maintenance still runs, but has no free pages to return.
+
+Requirements: Python 3 (no external packages).
+Run: python cdrip-sqlite-maintenance.py [--db PATH] [--step-ms 5] [--pause-ms 50] [--convert]
+Schedule it with the Windows Task Scheduler, or use "Maintain DB" in the DB browser.
+"""
+
+import os
+import sqlite3
+import random
+import time
+import argparse
+
+DB_PATH = r"c:\temp\cdrip\ripped.db"
+
+PAGE_SIZE = 4096        # matches the NTFS cluster size
+CACHE_SIZE = -8000      # negative = KiB, so 8 MB of page cache per connection
+ANALYSIS_LIMIT = 400    # rows sampled per index by ANALYZE, keeps it short on big tables
+LATENCY_SAMPLES = 200
+
+def open_db(path=DB_PATH):
+    # autocommit, so every PRAGMA below commits (and releases its lock) immediately
+    conn = sqlite3.connect(path, isolation_level=None, timeout=5)
+    conn.execute(f"PRAGMA cache_size={CACHE_SIZE}")
+    return conn
+
+def db_stats(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return {
+        "page_size": page_size,
+        "pages": page_count,
+        "free_pages": freelist,
+        "bytes": page_size * page_count,
+        "auto_vacuum": conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+    }
+
+def lookup_latency(conn, samples=LATENCY_SAMPLES):
+    """Median time in microseconds of the handler's own primary-key lookup."""
+    top = conn.execute("SELECT max(rowid) FROM written_tracks").fetchone()[0]
+    if not top:
+        return None
+    keys = []
+    for _ in range(samples):
+        row = conn.execute("SELECT title, track_id FROM written_tracks WHERE rowid >= ? LIMIT 1",
+                           (random.randint(1, top),)).fetchone()
+        if row:
+            keys.append(row)
+    timings = []
+    for key in keys:
+        t0 = time.perf_counter()
+        conn.execute("SELECT track_title FROM written_tracks WHERE title=? AND track_id=?", key).fetchone()
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    return timings[len(timings) // 2] * 1e6
+
+def needs_tuning(conn):
+    stats = db_stats(conn)
+    return stats["auto_vacuum"] != 2 or stats["page_size"] != PAGE_SIZE
+
+def convert(conn):
+    """
+    The one-time switch to PAGE_SIZE pages and incremental auto-vacuum. Both only take
+    effect through a VACUUM, which holds an exclusive lock until the file is rewritten.
+    """
+    conn.execute(f"PRAGMA page_size={PAGE_SIZE}")
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+
+def maintenance_steps(conn, step_ms=5):
+    """
+    Generator doing the maintenance in small pieces. Each iteration does one bounded
+    step and yields a short description, so the caller decides how long to pause
+    between steps (the CLI sleeps, the browser reschedules itself with after()).
+    Never converts the database, see convert().
+    """
+    # hand free pages back to the filesystem, sizing each batch to fit the step budget;
+    # without incremental auto-vacuum incremental_vacuum does nothing
+    batch = 64
+    while db_stats(conn)["auto_vacuum"] == 2:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if free == 0:
+            break
+        n = min(batch, free)
+        t0 = time.perf_counter()
+        conn.execute(f"PRAGMA incremental_vacuum({n})").fetchall()
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        if elapsed_ms < step_ms / 2:
+            batch *= 2
+        elif elapsed_ms > step_ms and batch > 1:
+            batch //= 2
+        yield f"Freed {n} of {free} pages"
+
+    conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+    for table in ("written_tracks", "written_discs"):
+        conn.execute(f"ANALYZE {table}")
+        yield f"Analyzed {table}"
+
+    conn.execute("PRAGMA optimize")
+    yield "Optimized"
+
+def format_report(before, after, lat_before, lat_after):
+    def mb(n):
+        return f"{n / 1048576:.2f} MB"
+    def us(v):
+        return "n/a" if v is None else f"{v:.1f} us"
+    return (f"Size: {mb(before['bytes'])} -> {mb(after['bytes'])} "
+            f"({before['free_pages']} -> {after['free_pages']} free pages)\n"
+            f"Track lookup (median): {us(lat_before)} -> {us(lat_after)}")
+
+CONVERT_NOTE = ("This database doesn't use incremental auto-vacuum yet, so no space was returned. "
+                "Convert it once, when no deck is busy.")
+
+def run(db_path=DB_PATH, step_ms=5, pause_ms=50, verbose=True, convert_db=False):
+    conn = open_db(db_path)
+    try:
+        before = db_stats(conn)
+        lat_before = lookup_latency(conn)
+        if convert_db and needs_tuning(conn):
+            convert(conn)
+            if verbose:
+                print("Converted to incremental auto-vacuum")
+        for msg in maintenance_steps(conn, step_ms):
+            if verbose:
+                print(msg)
+            time.sleep(pause_ms / 1000)
+        after = db_stats(conn)
+        lat_after = lookup_latency(conn)
+        unconverted = needs_tuning(conn)
+    finally:
+        conn.close()
+    report = format_report(before, after, lat_before, lat_after)
+    if unconverted:
+        report += "\n" + CONVERT_NOTE + " (--convert)"
+    if verbose:
+        print(report)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser("ripped.db maintenance")
+    parser.add_argument("--db", default=DB_PATH, help="Path to ripped.db")
+    parser.add_argument("--step-ms", type=float, default=5, help="Target duration of a single step")
+    parser.add_argument("--pause-ms", type=float, default=50, help="Pause between steps, lets handlers in")
+    parser.add_argument("--convert", action="store_true",
+                        help="Convert an older database to incremental auto-vacuum first (full VACUUM, locks the DB)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only print the final report")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Database not found: {args.db}")
+        exit(1)
+    report = run(args.db, args.step_ms, args.pause_ms, verbose=not args.quiet, convert_db=args.convert)
+    if args.quiet:
+        print(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+cdrip-sqlite-outbox.py
+Carries out the follow-up work that cdrip-sqlite.py queues in the outbox table of
+c:\temp\cdrip\ripped.db when fastExit is on: log file entries, deleting the
+tracks that weren't played, tagging the kept ones, and measuring their loudness and
+finding their cue points (queued with fastExit off too).
+
+Every action can safely run more than once, so a worker that crashes or is killed
+halfway just leaves its actions to be picked up again:
+- deleted files are moved to the quarantine folder under a name derived from the
+  outbox id, and an action whose file is already gone counts as done
+- a log entry that is already at the end of the log file is not written twice
+- tags that are already in the file are left alone
+- loudness and cue results replace the earlier results for the same tracks
+Failed actions are retried with exponential backoff.
+
+Quarantined files take as much disk space as the tracks did (a few hundred MB per disc
+with many unplayed tracks), so every run deletes the ones older than --purge-days (30
+by default, once a day with --watch), and forgets the finished actions as old as that.
+--purge-days 0 keeps everything, and the quarantine folder then grows without limit.
+
+Requirements: Python 3 (no external packages).
+Run: python cdrip-sqlite-outbox.py [--db PATH] [--watch] [--purge-days 30]
+cdrip-sqlite.py starts it in the background by itself when outboxAutostart is on.
+"""
+
+import os
+import sys
+import sqlite3
+import json
+import time
+import random
+import shutil
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from cdrip_tools import load_tool
+
+DB_PATH = r"c:\temp\cdrip\ripped.db"
+
+WORKERS = 4
+BATCH = 64
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 2.0      # seconds, doubled on every failed attempt
+BACKOFF_MAX = 600.0
+LEASE = 300.0           # a claimed action not finished after this long is retried
+LOG_TAIL = 65536        # how much of the end of the log file is checked for duplicates
+PURGE_DAYS = 30.0       # quarantined files and finished actions are kept this long
+PURGE_INTERVAL = 86400  # seconds between purges with --watch
+
+_log_lock = threading.Lock()
+_db_path = DB_PATH       # the DB being worked on, where the loudness results go too
+
+def open_db(path=DB_PATH):
+    global _db_path
+    _db_path = path
+    conn = sqlite3.connect(path, isolation_level=None, timeout=10, check_same_thread=False)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT,
+        args TEXT,
+        state TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        next_attempt REAL DEFAULT 0,
+        claimed_at REAL,
+        last_error TEXT,
+        created REAL
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (state, next_attempt)")
+    return conn
+
+# ----------------- Actions -----------------
+def do_log(action_id, args):
+    line = args["line"]
+    with _log_lock:
+        try:
+            with open(args["file"], "rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - LOG_TAIL))
+                if line.encode("utf-8") in f.read():
+                    return
+        except FileNotFoundError:
+            pass
+        with open(args["file"], "at") as f:
+            f.write(line)
+
+def do_delete(action_id, args):
+    src = args["path"]
+    folder = args.get("quarantine")
+    if not folder:
+        if os.path.exists(src):
+            os.unlink(src)
+        return
+    os.makedirs(folder, exist_ok=True)
+    dest = os.path.join(folder, f"{action_id:08}-{os.path.basename(src)}")
+    part = dest + ".part"
+    if not os.path.exists(src):
+        if os.path.exists(part):
+            os.replace(part, dest)  # crashed right after the move
+        return                      # already quarantined (or removed by hand)
+    # a cross-volume move is a copy + delete; a crash halfway leaves a partial
+    # .part file which is thrown away and redone
+    if os.path.exists(part):
+        os.unlink(part)
+    shutil.move(src, part)
+    os.utime(part)                  # the quarantine period starts now, see purge()
+    os.replace(part, dest)
+
+def run_tool(filename, args):
+    """
+    Runs one of the analysis tools on the tracks of an action, as a process of its own:
+    its worker pool can only spread the tracks over the CPU cores when it is the script
+    being run. It exits with 1 when none of the tracks could be analysed.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    cmd = [sys.executable, path, "--db", _db_path, "--title", args["title"]]
+    for track_id, track_path in args["tracks"]:
+        cmd += ["--track", track_id, track_path]
+    result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, text=True, timeout=LEASE)
+    if result.returncode != 0:
+        output = (result.stderr.strip() or result.stdout.strip()).splitlines()
+        raise RuntimeError(f"{filename} exited with {result.returncode}: " + " / ".join(output[-3:]))
+
+def do_loudness(action_id, args):
+    run_tool("cdrip-loudness.py", args)
+
+def do_tags(action_id, args):
+    results, errors = load_tool("cdrip-tags.py").tag_tracks(args["tracks"], args.get("id3", False))
+    if errors:
+        raise ValueError("; ".join(f"{path}: {error}" for path, error in errors.items()))
+
+def do_cues(action_id, args):
+    run_tool("cdrip-cues.py", args)
+
+ACTIONS = {
+    "log": do_log,
+    "delete": do_delete,
+    "tags": do_tags,
+    "loudness": do_loudness,
+    "cues": do_cues,
+}
+
+def run_action(action_id, kind, args):
+    handler = ACTIONS.get(kind)
+    if handler is None:
+        raise ValueError(f"unknown outbox action '{kind}'")
+    handler(action_id, json.loads(args))
+
+# ----------------- Queue handling -----------------
+def claim(conn, limit=BATCH):
+    """Take up to `limit` due actions, including ones whose worker seems to have died."""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute("""
+            SELECT id, kind, args FROM outbox
+            WHERE (state='pending' AND next_attempt<=?) OR (state='running' AND claimed_at<?)
+            ORDER BY id LIMIT ?
+        """, (now, now - LEASE, limit)).fetchall()
+        conn.executemany("UPDATE outbox SET state='running', claimed_at=?, attempts=attempts+1 WHERE id=?",
+                         [(now, r[0]) for r in rows])
+        conn.execute("COMMIT")
+    except:
+        conn.execute("ROLLBACK")
+        raise
+    return rows
+
+def finish(conn, action_id, error=None, max_attempts=MAX_ATTEMPTS):
+    if error is None:
+        conn.execute("UPDATE outbox SET state='done', last_error=NULL WHERE id=?", (action_id,))
+        return
+    attempts = conn.execute("SELECT attempts FROM outbox WHERE id=?", (action_id,)).fetchone()[0]
+    if attempts >= max_attempts:
+        conn.execute("UPDATE outbox SET state='failed', last_error=? WHERE id=?", (error, action_id))
+    else:
+        delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX) * random.uniform(0.8, 1.2)
+        conn.execute("UPDATE outbox SET state='pending', next_attempt=?, last_error=? WHERE id=?",
+                     (time.time() + delay, error, action_id))
+
+def drain(conn, workers=WORKERS, max_attempts=MAX_ATTEMPTS, verbose=True):
+    """Run everything that is due right now. Returns the number of actions attempted."""
+    total = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            rows = claim(conn)
+            if not rows:
+                return total
+            # log entries go through one task in queue order so lines don't get shuffled,
+            # deletions run side by side
+            logs = [r for r in rows if r[1] == "log"]
+            others = [r for r in rows if r[1] != "log"]
+
+            def run_logs():
+                results = []
+                for action_id, kind, args in logs:
+                    results.append((action_id, _attempt(action_id, kind, args)))
+                return results
+
+            futures = [pool.submit(run_logs)]
+            futures += [pool.submit(lambda r=r: [(r[0], _attempt(*r))]) for r in others]
+            for fut in futures:
+                for action_id, error in fut.result():
+                    finish(conn, action_id, error, max_attempts)
+                    if verbose:
+                        print(f"#{action_id}: {'ok' if error is None else error}")
+            total += len(rows)
+
+def _attempt(action_id, kind, args):
+    try:
+        run_action(action_id, kind, args)
+        return None
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+def next_due(conn):
+    row = conn.execute("SELECT min(next_attempt) FROM outbox WHERE state='pending'").fetchone()
+    return row[0]
+
+def purge(conn, quarantine_days):
+    """Forget finished actions and empty the quarantine folders of old files."""
+    cutoff = time.time() - quarantine_days * 86400
+    folders = set()
+    for (args,) in conn.execute("SELECT args FROM outbox WHERE kind='delete' AND state='done' AND created<?", (cutoff,)):
+        folder = json.loads(args).get("quarantine")
+        if folder:
+            folders.add(folder)
+    for folder in folders:
+        try:
+            entries = list(os.scandir(folder))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+    conn.execute("DELETE FROM outbox WHERE state='done' AND created<?", (cutoff,))
+
+def main():
+    parser = argparse.ArgumentParser("ripped.db outbox worker")
+    parser.add_argument("--db", default=DB_PATH, help="Path to ripped.db")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Actions carried out side by side")
+    parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS, help="Give up on an action after this many tries")
+    parser.add_argument("--watch", action="store_true", help="Keep running and poll for new actions")
+    parser.add_argument("--poll", type=float, default=5.0, help="Poll interval in seconds with --watch")
+    parser.add_argument("--purge-days", type=float, default=PURGE_DAYS,
+                        help="Delete quarantined files and finished actions older than this many days (0 = never)")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args()
+
+    conn = open_db(args.db)
+    try:
+        purged = 0.0
+        while True:
+            if args.purge_days > 0 and time.time() - purged >= PURGE_INTERVAL:
+                purge(conn, args.purge_days)
+                purged = time.time()
+            drain(conn, args.workers, args.max_attempts, verbose=not args.quiet)
+            due = next_due(conn)
+            if args.watch:
+                time.sleep(args.poll if due is None else max(0.0, min(args.poll, due - time.time())))
+            elif due is None:
+                break
+            else:
+                # retries still waiting for their backoff, wait for them rather than leave them behind
+                time.sleep(max(0.0, due - time.time()))
+        failed = conn.execute("SELECT count(*) FROM outbox WHERE state='failed'").fetchone()[0]
+        if failed and not args.quiet:
+            print(f"{failed} actions failed permanently, see the last_error column of the outbox table.")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
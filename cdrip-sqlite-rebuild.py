@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+cdrip-sqlite-rebuild.py
+Rebuilds c:\temp\cdrip\ripped.db from the archived WAV files, for when the database
+(or the registry it replaced) has been lost and every disc would otherwise be archived
+all over again.
+
+Only the RIFF chunk headers of each file are read, never the audio. What a track is
+comes from, in order of preference:
+  - its LIST/INFO tags (as cdrip-tags.py writes them): INAM track title, IPRD album
+    title, ITRK (or IPRT) track number, ICMT "CDDB:a1b2c3d4", ICRD date
+  - the BreakawayCD track id in the file name, "T03 a1b2c3d4"
+  - a leading track number in the file name, "03 Title.wav" or "Track 03.wav"
+  - a CDDB id in the file or folder name, "Album Title [a1b2c3d4]"
+  - the folder name as the album title
+Files that leave the album, CDDB id or track number unknown are reported and skipped.
+
+The archive is walked once and its files are handed to a pool of worker processes in
+batches, however the folders are nested, and the rows are bulk-loaded in large
+transactions. Existing rows are kept, so it is safe to run on a
+database that only lost some of its rows. Every disc found also gets a disc_payloads
+row with the track lengths, for the Library tab of the DB browser.
+
+Requirements: Python 3 (no external packages).
+Run: python cdrip-sqlite-rebuild.py ARCHIVE_FOLDER [--db PATH] [--workers N] [--mode both] [--dry-run]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import struct
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+DB_PATH = r"c:\temp\cdrip\ripped.db"
+
+BATCH_ROWS = 50000      # rows per transaction
+MAX_LIST_BYTES = 65536  # LIST chunks larger than this are not tags, skip them
+FILES_PER_TASK = 64     # files are handed to the workers in batches of this size
+
+TRACK_ID_RE = re.compile(r"\bT(\d{2}) ([0-9a-fA-F]{8})\b")
+CDDB_RE = re.compile(r"(?<![0-9A-Za-z])([0-9a-fA-F]{8})(?![0-9A-Za-z])")
+CDDB_TAG_RE = re.compile(r"CDDB\s*[:=]?\s*([0-9a-fA-F]{8})", re.IGNORECASE)
+NUMBER_RE = re.compile(r"^(?:track\s*)?(\d{1,3})(?:\s*[-._]\s*|\s+|$)", re.IGNORECASE)
+FOLDER_CDDB_RE = re.compile(r"\s*[\[(]?\b[0-9a-fA-F]{8}\b[\])]?\s*$")
+
+# ----------------------------------------------------------
+# WAV headers
+# ----------------------------------------------------------
+def _text(raw):
+    raw = raw.split(b"\0", 1)[0]
+    try:
+        return raw.decode("utf-8").strip()
+    except UnicodeDecodeError:
+        # most Windows tag editors write the ANSI code page
+        return raw.decode("cp1252", "replace").strip()
+
+def parse_info(body):
+    """{tag id: text} from the body of a LIST chunk of type INFO."""
+    tags = {}
+    pos = 0
+    while pos + 8 <= len(body):
+        cid = body[pos:pos + 4].decode("ascii", "replace")
+        size = struct.unpack_from("<I", body, pos + 4)[0]
+        tags[cid] = _text(body[pos + 8:pos + 8 + size])
+        pos += 8 + size + (size & 1)
+    return tags
+
+def read_wav_header(path):
+    """
+    (fmt, data_bytes, tags) of a WAV file. fmt is (format, channels, rate, byte rate,
+    block align, bits). Seeks from chunk header to chunk header, so only a few KB of
+    the file are read however long the track is.
+    """
+    fmt = None
+    data_bytes = None
+    tags = {}
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if len(head) < 12 or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+            raise ValueError("not a RIFF WAVE file")
+        file_size = os.fstat(f.fileno()).st_size
+        pos = 12
+        while pos + 8 <= file_size:
+            f.seek(pos)
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            cid = header[:4]
+            size = struct.unpack("<I", header[4:])[0]
+            if cid == b"fmt " and size >= 16:
+                fmt = struct.unpack("<HHIIHH", f.read(16))
+            elif cid == b"data":
+                # writers that never finished (or streamed) leave the size too large
+                data_bytes = min(size, file_size - pos - 8)
+            elif cid == b"LIST" and size <= MAX_LIST_BYTES:
+                body = f.read(size)
+                if body[:4] == b"INFO":
+                    tags.update(parse_info(body[4:]))
+            pos += 8 + size + (size & 1)
+    if fmt is None or data_bytes is None:
+        raise ValueError("no fmt or data chunk")
+    return fmt, data_bytes, tags
+
+# ----------------------------------------------------------
+# Names
+# ----------------------------------------------------------
+def parse_track(path):
+    """
+    What one archived file is: dict with album, cddb_id, number, title, length_bytes,
+    seconds, date and path. Raises ValueError for files that can't be used.
+    """
+    fmt, data_bytes, tags = read_wav_header(path)
+    folder = os.path.basename(os.path.dirname(path))
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    cddb_id = number = None
+    title = name
+    m = TRACK_ID_RE.search(name)
+    if m:
+        number, cddb_id = int(m.group(1)), m.group(2)
+        title = (name[:m.start()] + name[m.end():]).strip(" -_.")
+    # a leading number is only the track number when the track id didn't give one,
+    # otherwise it belongs to the title ("99 Luftballons", "1999")
+    m = NUMBER_RE.match(title) if number is None else None
+    if m:
+        number = int(m.group(1))
+        title = title[m.end():].strip(" -_.")
+    if cddb_id is None:
+        m = CDDB_RE.search(title)
+        if m:
+            cddb_id = m.group(1)
+            title = (title[:m.start()] + title[m.end():]).strip(" -_.[]()")
+        else:
+            m = CDDB_RE.search(folder)
+            if m:
+                cddb_id = m.group(1)
+
+    # tags win over anything guessed from names
+    m = CDDB_TAG_RE.search(tags.get("ICMT", ""))
+    if m:
+        cddb_id = m.group(1)
+    track_tag = tags.get("ITRK") or tags.get("IPRT") or ""
+    if track_tag.split("/")[0].strip().isdigit():
+        number = int(track_tag.split("/")[0])
+    title = tags.get("INAM") or title
+    album = tags.get("IPRD") or FOLDER_CDDB_RE.sub("", folder)
+
+    missing = [what for what, value in (("album", album), ("CDDB id", cddb_id), ("track number", number))
+               if not value]
+    if missing:
+        raise ValueError("unknown " + ", ".join(missing))
+    byte_rate = fmt[3] or 1
+    return {
+        "album": album,
+        "cddb_id": cddb_id,         # as written, the handler's track ids are case sensitive
+        "number": number,
+        "title": title,
+        "length_bytes": data_bytes,
+        "seconds": data_bytes / byte_rate,
+        "date": tags.get("ICRD", ""),
+        "mtime": os.path.getmtime(path),
+        "path": path,
+    }
+
+# ----------------------------------------------------------
+# Workers
+# ----------------------------------------------------------
+def is_wav(name):
+    return name.lower().endswith(".wav")
+
+def scan_files(paths):
+    """Worker task: ([track dicts], [(path, reason)]) for a list of files."""
+    tracks, skipped = [], []
+    for path in paths:
+        try:
+            tracks.append(parse_track(path))
+        except (OSError, ValueError, struct.error) as e:
+            skipped.append((path, str(e)))
+    return tracks, skipped
+
+def tasks(archive):
+    """
+    The WAV files below the archive folder in batches of FILES_PER_TASK, yielded while
+    the walk goes on so the workers start on the first folders straight away.
+    """
+    batch = []
+    for root, dirs, files in os.walk(archive):
+        batch.extend(os.path.join(root, name) for name in files if is_wav(name))
+        while len(batch) >= FILES_PER_TASK:
+            yield batch[:FILES_PER_TASK]
+            batch = batch[FILES_PER_TASK:]
+    if batch:
+        yield batch
+
+# ----------------------------------------------------------
+# Loading
+# ----------------------------------------------------------
+def open_db(path=DB_PATH):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS written_tracks (
+        title TEXT,
+        track_id TEXT,
+        track_title TEXT,
+        PRIMARY KEY (title, track_id)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS written_discs (
+        title TEXT,
+        cddb_id TEXT,
+        PRIMARY KEY (title, cddb_id)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS disc_payloads (
+        title TEXT,
+        cddb_id TEXT,
+        tracks INTEGER,
+        length_bytes INTEGER,
+        kept INTEGER,
+        ripped_date TEXT,
+        ripped_time TEXT,
+        payload BLOB,
+        PRIMARY KEY (title, cddb_id)
+    )
+    """)
+    conn.execute("""
+    CREATE INDEX IF NOT EXISTS disc_payloads_list
+    ON disc_payloads (title, cddb_id, tracks, length_bytes, kept, ripped_date, ripped_time)
+    """)
+    conn.commit()
+    return conn
+
+def insert_rows(conn, sql, rows):
+    """INSERT OR IGNORE in transactions of BATCH_ROWS rows. Returns the rows added."""
+    added = 0
+    for i in range(0, len(rows), BATCH_ROWS):
+        before = conn.total_changes
+        with conn:
+            conn.executemany(sql, rows[i:i + BATCH_ROWS])
+        added += conn.total_changes - before
+    return added
+
+def disc_payload(album, cddb_id, tracks):
+    """A disc_payloads row for a rebuilt disc, in the shape the rip handler stores."""
+    tracks = sorted(tracks, key=lambda t: t["number"])
+    ripped = time.localtime(min(t["mtime"] for t in tracks))
+    data = {
+        "title": album,
+        "cddb-id": cddb_id,
+        "tracks": len(tracks),
+        "ripped-date": time.strftime("%Y-%m-%d", ripped),
+        "ripped-time": time.strftime("%H:%M:%S", ripped),
+        "rebuilt": True,
+        "track-details": [{
+            "number": t["number"],
+            "id": f'T{t["number"]:02} {cddb_id}',
+            "title": t["title"],
+            "length-bytes": t["length_bytes"],
+            "filepath": t["path"],
+            "keep": True,
+        } for t in tracks],
+    }
+    return (album, cddb_id, len(tracks), sum(t["length_bytes"] for t in tracks), len(tracks),
+            data["ripped-date"], data["ripped-time"],
+            zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"), 9))
+
+def rebuild(archive, db_path=DB_PATH, workers=None, mode="both", dry_run=False, verbose=True):
+    t0 = time.perf_counter()
+    conn = None if dry_run else open_db(db_path)
+    track_rows = []
+    discs = {}
+    skipped = []
+    files = added = 0
+    seconds = 0.0
+    shown = 0.0
+    try:
+        # worker processes look scan_files up by module name, which only works when this
+        # file is the script being run; loaded by another script (load_tool) it's threads
+        executor = ProcessPoolExecutor if __name__ == "__main__" else ThreadPoolExecutor
+        with executor(max_workers=workers) as pool:
+            futures = [pool.submit(scan_files, paths) for paths in tasks(archive)]
+            for future in as_completed(futures):
+                tracks, skips = future.result()
+                skipped.extend(skips)
+                files += len(tracks) + len(skips)
+                for t in tracks:
+                    seconds += t["seconds"]
+                    track_rows.append((t["album"], f'T{t["number"]:02} {t["cddb_id"]}', t["title"]))
+                    discs.setdefault((t["album"], t["cddb_id"]), []).append(t)
+                # load while the workers carry on, in big transactions
+                if conn and mode != "discs" and len(track_rows) >= BATCH_ROWS:
+                    added += insert_rows(conn, "INSERT OR IGNORE INTO written_tracks (title, track_id, track_title) VALUES (?, ?, ?)", track_rows)
+                    track_rows = []
+                if verbose and time.perf_counter() - shown > 0.5:
+                    shown = time.perf_counter()
+                    print(f"\r{files} files, {len(discs)} discs", end="", flush=True)
+        if verbose:
+            print()
+        if conn:
+            if mode != "discs":
+                added += insert_rows(conn, "INSERT OR IGNORE INTO written_tracks (title, track_id, track_title) VALUES (?, ?, ?)", track_rows)
+            if mode != "tracks":
+                added += insert_rows(conn, "INSERT OR IGNORE INTO written_discs (title, cddb_id) VALUES (?, ?)", list(discs))
+            added += insert_rows(conn, """INSERT OR IGNORE INTO disc_payloads
+                                          (title, cddb_id, tracks, length_bytes, kept, ripped_date, ripped_time, payload)
+                                          VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                                 [disc_payload(album, cddb_id, tracks) for (album, cddb_id), tracks in discs.items()])
+    finally:
+        if conn:
+            conn.close()
+
+    if verbose:
+        for path, reason in skipped:
+            print(f"Skipped {path}: {reason}")
+        hours = seconds / 3600
+        print(f"{files} files, {len(discs)} discs, {hours:.1f} hours of audio, {len(skipped)} skipped, "
+              f"{added} rows added in {time.perf_counter() - t0:.1f} s" + (" (dry run)" if dry_run else ""))
+    return files, len(discs), len(skipped), added
+
+def main():
+    parser = argparse.ArgumentParser("ripped.db rebuild from the archive")
+    parser.add_argument("archive", help="Folder the rip handler archives the WAV files to")
+    parser.add_argument("--db", default=DB_PATH, help="Path to ripped.db")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core)")
+    parser.add_argument("--mode", choices=("both", "tracks", "discs"), default="both",
+                        help="Rebuild written_tracks (trackMode = True), written_discs (trackMode = False) or both")
+    parser.add_argument("--dry-run", action="store_true", help="Scan and report, don't write to the DB")
+    parser.add_argument("-q", "--quiet", action="store_true")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.archive):
+        print(f"Archive folder not found: {args.archive}")
+        sys.exit(1)
+    rebuild(args.archive, args.db, args.workers, args.mode, args.dry_run, verbose=not args.quiet)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+cdrip-sqlite-sync.py
+Keeps the ripped.db of several stations in step through a shared folder or USB drive,
+so a disc archived in one studio isn't archived again in the next one.
+
+Once a station has been set up with "init", triggers record every change to
+written_tracks and written_discs in a numbered change log. "export" writes the changes
+made since the last export to a small changeset file in <folder>/<station>/, and
+"import" applies the changeset files of all other stations that it hasn't seen yet.
+Both only touch the changes, never the whole library.
+
+Conflicts are settled the same way on every station: the change with the newest
+timestamp wins, and on equal timestamps the station name that sorts last wins.
+A deletion is a change like any other, so an older insert can't bring a row back.
+
+Requirements: Python 3 (no external packages).
+Run: python cdrip-sqlite-sync.py init --station STUDIO-A
+     python cdrip-sqlite-sync.py sync --folder \\\\server\\share\\cdrip-sync
+     python cdrip-sqlite-sync.py status
+"""
+
+import os
+import sqlite3
+import json
+import gzip
+import argparse
+
+DB_PATH = r"c:\temp\cdrip\ripped.db"
+
+# (table, short name used in changesets, key columns, value column)
+SYNCED_TABLES = [
+    ("written_tracks", "tracks", ("title", "track_id"), "track_title"),
+    ("written_discs", "discs", ("title", "cddb_id"), None),
+]
+
+NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+NOT_APPLYING = "NOT EXISTS (SELECT 1 FROM sync_meta WHERE key='applying')"
+STATION = "(SELECT value FROM sync_meta WHERE key='station')"
+
+def open_db(path=DB_PATH):
+    conn = sqlite3.connect(path, isolation_level=None, timeout=10)
+    return conn
+
+def get_meta(conn, key, default=None):
+    row = conn.execute("SELECT value FROM sync_meta WHERE key=?", (key,)).fetchone()
+    return default if row is None else row[0]
+
+def set_meta(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO sync_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+def is_initialized(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name='sync_meta'").fetchone() is not None
+
+# ----------------- Setup -----------------
+def init(conn, station):
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("CREATE TABLE IF NOT EXISTS sync_meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sync_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT, k1 TEXT, k2 TEXT, value TEXT, op TEXT, ts REAL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sync_versions (
+        tbl TEXT, k1 TEXT, k2 TEXT, ts REAL, station TEXT,
+        PRIMARY KEY (tbl, k1, k2)
+    )
+    """)
+    conn.execute("CREATE TABLE IF NOT EXISTS sync_peers (station TEXT PRIMARY KEY, imported_seq INTEGER)")
+    first_time = get_meta(conn, "station") is None
+    set_meta(conn, "station", station)
+
+    for table, short, (k1, k2), value in SYNCED_TABLES:
+        new_value = f"NEW.{value}" if value else "NULL"
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS sync_{short}_ins AFTER INSERT ON {table} WHEN {NOT_APPLYING}
+        BEGIN
+            INSERT INTO sync_changes (tbl, k1, k2, value, op, ts) VALUES ('{short}', NEW.{k1}, NEW.{k2}, {new_value}, 'U', {NOW});
+            INSERT OR REPLACE INTO sync_versions VALUES ('{short}', NEW.{k1}, NEW.{k2}, {NOW}, {STATION});
+        END
+        """)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS sync_{short}_upd AFTER UPDATE ON {table} WHEN {NOT_APPLYING}
+        BEGIN
+            INSERT INTO sync_changes (tbl, k1, k2, value, op, ts)
+                SELECT '{short}', OLD.{k1}, OLD.{k2}, NULL, 'D', {NOW}
+                WHERE OLD.{k1} IS NOT NEW.{k1} OR OLD.{k2} IS NOT NEW.{k2};
+            INSERT OR REPLACE INTO sync_versions
+                SELECT '{short}', OLD.{k1}, OLD.{k2}, {NOW}, {STATION}
+                WHERE OLD.{k1} IS NOT NEW.{k1} OR OLD.{k2} IS NOT NEW.{k2};
+            INSERT INTO sync_changes (tbl, k1, k2, value, op, ts) VALUES ('{short}', NEW.{k1}, NEW.{k2}, {new_value}, 'U', {NOW});
+            INSERT OR REPLACE INTO sync_versions VALUES ('{short}', NEW.{k1}, NEW.{k2}, {NOW}, {STATION});
+        END
+        """)
+        conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS sync_{short}_del AFTER DELETE ON {table} WHEN {NOT_APPLYING}
+        BEGIN
+            INSERT INTO sync_changes (tbl, k1, k2, value, op, ts) VALUES ('{short}', OLD.{k1}, OLD.{k2}, NULL, 'D', {NOW});
+            INSERT OR REPLACE INTO sync_versions VALUES ('{short}', OLD.{k1}, OLD.{k2}, {NOW}, {STATION});
+        END
+        """)
+        if first_time:
+            # everything that is already in the library goes out with the first export
+            value_col = value or "NULL"
+            conn.execute(f"""
+                INSERT INTO sync_changes (tbl, k1, k2, value, op, ts)
+                SELECT '{short}', {k1}, {k2}, {value_col}, 'U', {NOW} FROM {table}
+            """)
+            conn.execute(f"""
+                INSERT OR REPLACE INTO sync_versions
+                SELECT '{short}', {k1}, {k2}, {NOW}, ? FROM {table}
+            """, (station,))
+    conn.execute("COMMIT")
+
+# ----------------- Export -----------------
+def export(conn, folder):
+    """Write the changes since the last export to a changeset file. Returns its path or None."""
+    station = get_meta(conn, "station")
+    exported = int(get_meta(conn, "exported_seq", 0))
+    rows = conn.execute("SELECT seq, tbl, k1, k2, value, op, ts FROM sync_changes WHERE seq>? ORDER BY seq",
+                        (exported,)).fetchall()
+    if not rows:
+        return None
+    last_seq = rows[-1][0]
+
+    # only the newest change per row matters
+    latest = {}
+    for seq, tbl, k1, k2, value, op, ts in rows:
+        latest[(tbl, k1, k2)] = (tbl, k1, k2, value, op, ts)
+
+    out_dir = os.path.join(folder, station)
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"{exported + 1:012}-{last_seq:012}.cdsync")
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        f.write(json.dumps({"station": station, "from": exported + 1, "to": last_seq}) + "\n")
+        for change in latest.values():
+            f.write(json.dumps(change, separators=(",", ":")) + "\n")
+    os.replace(tmp, path)
+
+    conn.execute("BEGIN IMMEDIATE")
+    set_meta(conn, "exported_seq", last_seq)
+    conn.execute("DELETE FROM sync_changes WHERE seq<=?", (last_seq,))
+    conn.execute("COMMIT")
+    return path
+
+# ----------------- Import -----------------
+def _changeset_files(folder, station, after_seq):
+    """Changeset files of one station that start after `after_seq`, in order."""
+    files = []
+    for entry in os.scandir(os.path.join(folder, station)):
+        name = entry.name
+        if not name.endswith(".cdsync"):
+            continue
+        try:
+            first, last = (int(n) for n in name[:-len(".cdsync")].split("-"))
+        except ValueError:
+            continue
+        if last > after_seq:
+            files.append((first, last, entry.path))
+    files.sort()
+    return files
+
+def _wins(incoming_ts, incoming_station, local):
+    if local is None:
+        return True
+    return (incoming_ts, incoming_station) > (local[0], local[1] or "")
+
+def apply_changeset(conn, path):
+    """Apply one changeset file in a single transaction. Returns (applied, skipped)."""
+    tables = {short: (table, keys, value) for table, short, keys, value in SYNCED_TABLES}
+    applied = skipped = 0
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        origin = header["station"]
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            set_meta(conn, "applying", origin)
+            for line in f:
+                tbl, k1, k2, value, op, ts = json.loads(line)
+                table, (c1, c2), value_col = tables[tbl]
+                local = conn.execute("SELECT ts, station FROM sync_versions WHERE tbl=? AND k1=? AND k2=?",
+                                     (tbl, k1, k2)).fetchone()
+                if not _wins(ts, origin, local):
+                    skipped += 1
+                    continue
+                if op == "D":
+                    conn.execute(f"DELETE FROM {table} WHERE {c1}=? AND {c2}=?", (k1, k2))
+                elif value_col:
+                    conn.execute(f"INSERT OR REPLACE INTO {table} ({c1}, {c2}, {value_col}) VALUES (?, ?, ?)",
+                                 (k1, k2, value))
+                else:
+                    conn.execute(f"INSERT OR REPLACE INTO {table} ({c1}, {c2}) VALUES (?, ?)", (k1, k2))
+                conn.execute("INSERT OR REPLACE INTO sync_versions VALUES (?, ?, ?, ?, ?)",
+                             (tbl, k1, k2, ts, origin))
+                applied += 1
+            conn.execute("DELETE FROM sync_meta WHERE key='applying'")
+            conn.execute("INSERT OR REPLACE INTO sync_peers (station, imported_seq) VALUES (?, ?)",
+                         (origin, header["to"]))
+            conn.execute("COMMIT")
+        except:
+            conn.execute("ROLLBACK")
+            raise
+    return applied, skipped
+
+def import_all(conn, folder, verbose=True):
+    station = get_meta(conn, "station")
+    peers = dict(conn.execute("SELECT station, imported_seq FROM sync_peers").fetchall())
+    total_applied = total_skipped = 0
+    os.makedirs(folder, exist_ok=True)
+    for entry in os.scandir(folder):
+        if not entry.is_dir() or entry.name == station:
+            continue
+        seen = peers.get(entry.name, 0)
+        for first, last, path in _changeset_files(folder, entry.name, seen):
+            if first > seen + 1:
+                print(f"{entry.name}: changes {seen + 1}-{first - 1} are missing, "
+                      f"stopping at {seen} until they show up.")
+                break
+            applied, skipped = apply_changeset(conn, path)
+            seen = last
+            total_applied += applied
+            total_skipped += skipped
+            if verbose:
+                print(f"{entry.name}: {os.path.basename(path)} applied {applied}, older than ours {skipped}")
+    return total_applied, total_skipped
+
+def status(conn):
+    print(f"Station: {get_meta(conn, 'station')}")
+    pending = conn.execute("SELECT count(*) FROM sync_changes").fetchone()[0]
+    print(f"Local changes waiting for export: {pending}")
+    for peer, seq in conn.execute("SELECT station, imported_seq FROM sync_peers ORDER BY station"):
+        print(f"Imported from {peer} up to change {seq}")
+
+def main():
+    parser = argparse.ArgumentParser("ripped.db multi-station sync")
+    parser.add_argument("--db", default=DB_PATH, help="Path to ripped.db")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("init", help="Set this station up for syncing")
+    p.add_argument("--station", required=True, help="Unique name of this station, e.g. STUDIO-A")
+    for name, help_text in (("export", "Write local changes to the sync folder"),
+                            ("import", "Apply other stations' changes from the sync folder"),
+                            ("sync", "Import, then export")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("--folder", required=True, help="Shared sync folder or USB drive path")
+    sub.add_parser("status", help="Show the sync state of this station")
+    args = parser.parse_args()
+
+    conn = open_db(args.db)
+    try:
+        if args.command == "init":
+            init(conn, args.station)
+            print(f"Station {args.station} is set up for syncing.")
+            return
+        if not is_initialized(conn):
+            print("This database isn't set up for syncing yet, run 'init --station NAME' first.")
+            exit(1)
+        if args.command == "status":
+            status(conn)
+            return
+        if args.command in ("import", "sync"):
+            applied, skipped = import_all(conn, args.folder)
+            print(f"Imported {applied} changes, kept our newer version of {skipped}.")
+        if args.command in ("export", "sync"):
+            path = export(conn, args.folder)
+            print(f"Exported to {path}" if path else "Nothing to export.")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
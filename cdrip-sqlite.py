@@ -1,166 +1,313 @@
 import json
-import time
-import argparse
 import os
+import sys
 import sqlite3
+# everything else is imported where it's needed, BreakawayCD waits for every call
 
 # BreakawayCD example rip handler script v3.32.49 - modified for SQL storage
 
 ###############################################
 # trackMode switches the way BreakawayCD writes out its files in ripping mode.
-# trackMode = True - writes out JUST the files that played more than 80% (Editable below, search 0.8) and the metadata includes track information
+# trackMode = True - writes out JUST the files that played more than 80% (keepThreshold below) and the metadata includes track information
 # trackMode = False - writes out the entire CD and changes the metadata output to the disc information only
 ###############################################
 
 trackMode = True
 
+###############################################
+# keepThreshold - in trackMode, keep a track once more than this fraction of it has played
+# keepMinSeconds - also keep a track once this many seconds of it have played, however
+#   long it is (0 = off). cdrip-keep-whatif.py shows what other values would have kept.
+###############################################
+
+keepThreshold = 0.8
+keepMinSeconds = 0
+
 echo_folder = "c:\\temp\\cdrip\\"
 log_file    = "c:\\temp\\cdrip\\logfile.csv"
 
-# ----------------------------------------------------------
-# SQL DATABASE INIT (replaces Windows Registry)
-# ----------------------------------------------------------
-db_path = "c:\\temp\\cdrip\\ripped.db"
-conn = sqlite3.connect(db_path)
-cur = conn.cursor()
-
-cur.execute("""
-CREATE TABLE IF NOT EXISTS written_tracks (
-    title TEXT,
-    track_id TEXT,
-    track_title TEXT,
-    PRIMARY KEY (title, track_id)
-)
-""")
-
-cur.execute("""
-CREATE TABLE IF NOT EXISTS written_discs (
-    title TEXT,
-    cddb_id TEXT,
-    PRIMARY KEY (title, cddb_id)
-)
-""")
-conn.commit()
-# ----------------------------------------------------------
+###############################################
+# fastExit = True - once a disc has been written, only record it in SQL and queue the slow
+#   follow-up work (log file entries, deleting the unplayed tracks) in the outbox table,
+#   then return to BreakawayCD straight away. cdrip-sqlite-outbox.py carries out the queue.
+# fastExit = False - do all of that inline before returning, like the original script
+# outboxAutostart - start cdrip-sqlite-outbox.py in the background after queueing work
+# Files deleted through the outbox are moved to quarantine_folder first, and the worker
+#   deletes them for good after 30 days (its --purge-days). Until then they take up as
+#   much space as the tracks did.
+###############################################
 
-parser = argparse.ArgumentParser("CD rip handler script")
-parser.add_argument("jsonfile", help="Filename of JSON data from BreakawayCD")
-args = parser.parse_args()
+fastExit = True
+outboxAutostart = True
+quarantine_folder = "c:\\temp\\cdrip\\quarantine\\"
 
-print(f'Reading JSON file: {args.jsonfile}\n')
+###############################################
+# loudnessAnalysis = True - measure the loudness of the kept tracks for the playout import
+#   with cdrip-loudness.py (needs numpy), results go to the track_loudness table
+# cueDetection = True - find the start of audio, fade-out and end of audio of the kept
+#   tracks with cdrip-cues.py (needs numpy), results go to the track_cues table
+# Both always run from the outbox, also with fastExit = False, so BreakawayCD never waits.
+###############################################
 
-filedata = ""
-with open(args.jsonfile) as f:
-    filedata = f.read()
+loudnessAnalysis = True
+cueDetection = True
 
-if filedata:
-    data = json.loads(filedata)
-    print(json.dumps(data, indent=2))
+###############################################
+# tagFiles = True - write album, track title, track number, CDDB id and date into the
+#   LIST/INFO chunk of each kept WAV with cdrip-tags.py, without touching the audio
+# tagId3 = True - also write an ID3v2.3 tag ("id3 " chunk) for players that only read ID3
+###############################################
 
-print("")
+tagFiles = True
+tagId3 = False
 
-# echo JSON stage files
-try:
-    if len(echo_folder):
-        stage = 0
-        if data["written"]:
-            stage |= 1
-        if data["ejected"]:
-            stage |= 2
+###############################################
+# archiveEvents = True - record an event for every archived track (or disc) in the
+#   archive_events table, sequence-numbered and in the same transaction as the track itself
+#   (cdrip-sqlite-batch.py only records them with --effects)
+# eventPort - after committing, tell cdrip-events.py on this local UDP port that there are
+#   new events, so it pushes them to its subscribers straight away (0 = don't)
+###############################################
 
-        with open(f'{echo_folder}\\output_{data["deck"]}-{stage+1}.txt', "w") as g:
-            g.write(filedata)
-except:
-    pass
+archiveEvents = True
+eventPort = 8766
 
-if data["error"]:
-    print("Error! Don't write.")
-    exit(1)
+###############################################
+# verbose = True - print the whole JSON payload on every call (or run with -v)
+###############################################
 
+verbose = False
 
 # ----------------------------------------------------------
-# KEY NAME (not used in SQL, but kept for compatibility)
+# SQL DATABASE INIT (replaces Windows Registry)
 # ----------------------------------------------------------
-if trackMode:
-    reg_key = f'SOFTWARE\\BreakawayCD\\Ripped Tracks\\{data["title"]}'
-else:
-    reg_key = f'SOFTWARE\\BreakawayCD\\Ripped Discs\\{data["title"]}'
+db_path = os.environ.get("CDRIP_DB", "c:\\temp\\cdrip\\ripped.db")
+
+# bump this whenever create_tables() changes, so existing databases pick the change up
+SCHEMA_VERSION = 2
+
+def open_db(path=db_path):
+    conn = sqlite3.connect(path)
+    # the DDL only runs on a new or older file, not on every call
+    if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        create_tables(conn)
+    return conn
+
+def create_tables(conn):
+    cur = conn.cursor()
+
+    # only takes effect on a brand new file; older files are converted by cdrip-sqlite-maintenance.py
+    cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS written_tracks (
+        title TEXT,
+        track_id TEXT,
+        track_title TEXT,
+        PRIMARY KEY (title, track_id)
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS written_discs (
+        title TEXT,
+        cddb_id TEXT,
+        PRIMARY KEY (title, cddb_id)
+    )
+    """)
+
+    # final payload of every written disc, zlib-compressed JSON, plus a few typed
+    # columns so the DB browser can list discs without decompressing anything
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS disc_payloads (
+        title TEXT,
+        cddb_id TEXT,
+        tracks INTEGER,
+        length_bytes INTEGER,
+        kept INTEGER,
+        ripped_date TEXT,
+        ripped_time TEXT,
+        payload BLOB,
+        PRIMARY KEY (title, cddb_id)
+    )
+    """)
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS disc_payloads_list
+    ON disc_payloads (title, cddb_id, tracks, length_bytes, kept, ripped_date, ripped_time)
+    """)
+
+    # side effects waiting for cdrip-sqlite-outbox.py (see fastExit)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT,
+        args TEXT,
+        state TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        next_attempt REAL DEFAULT 0,
+        claimed_at REAL,
+        last_error TEXT,
+        created REAL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (state, next_attempt)")
+
+    # titles merged away in the DB browser's duplicate finder, filed under `title` instead
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS title_aliases (
+        kind TEXT,
+        alias TEXT,
+        title TEXT,
+        PRIMARY KEY (kind, alias)
+    )
+    """)
+
+    # one row per archived file, read by cdrip-events.py; seq is what subscribers resume from
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS archive_events (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT,
+        cddb_id TEXT,
+        track_id TEXT,
+        title TEXT,
+        track_title TEXT,
+        filepath TEXT,
+        created REAL
+    )
+    """)
+    # the last event each named subscriber has acknowledged
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS event_offsets (
+        name TEXT PRIMARY KEY,
+        seq INTEGER,
+        updated REAL
+    )
+    """)
+    cur.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    conn.commit()
 # ----------------------------------------------------------
 
-
 # ----------------------------------------------------------
-# STATE CHECK (same logic as original)
+# TITLE ALIASES - album and track titles as they are filed in SQL
 # ----------------------------------------------------------
-if data["ejected"] != trackMode:
-    if(trackMode):
-        print("Don't write, disc not ejected yet.")
-    else:
-        print("Don't write, disc was already processed after ripping.")
-    exit(1)
+def resolve_alias(cur, kind, alias):
+    cur.execute("SELECT title FROM title_aliases WHERE kind=? AND alias=?", (kind, alias))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def db_titles(cur, data):
+    db_title = resolve_alias(cur, "album", data["title"]) or data["title"]
+    db_track_title = {}
+    if trackMode:
+        for track in data["track-details"]:
+            db_track_title[track["number"]] = (resolve_alias(cur, "track", f'{db_title}\x1f{track["title"]}')
+                                               or track["title"])
+    return db_title, db_track_title
 # ----------------------------------------------------------
 
 # ----------------------------------------------------------
 # Determine which tracks to keep (unchanged)
 # ----------------------------------------------------------
-if trackMode:
-    for track in data["track-details"]:
-        track["id"] = f'T{track["number"]:02} {data["cddb-id"]}'
-        if track["length-bytes"] > 0 and "played-bytes" in track:
-            fraction = track["played-bytes"] / track["length-bytes"]
-            if fraction > 0.8:
-                track["keep"] = True
+def mark_keep(data):
+    if trackMode:
+        for track in data["track-details"]:
+            track["id"] = f'T{track["number"]:02} {data["cddb-id"]}'
+            if track["length-bytes"] > 0 and "played-bytes" in track:
+                fraction = track["played-bytes"] / track["length-bytes"]
+                if fraction > keepThreshold or (keepMinSeconds and track["played-bytes"] >= keepMinSeconds * 176400):
+                    track["keep"] = True
 # ----------------------------------------------------------
 
-# ======================================================================
-# PART 1 — Being asked whether to write (data["written"] == False)
-# ======================================================================
-if data["written"] == False:
+def merge_payload(blob, data):
+    """
+    The payload to store when the disc was written before: this session's, with the
+    tracks kept in earlier sessions still marked as kept, and with each track's most
+    played session. `data` itself is left alone.
+    """
+    import zlib
+    try:
+        earlier = {t["number"]: t for t in json.loads(zlib.decompress(blob)).get("track-details", [])}
+    except (zlib.error, ValueError, KeyError, TypeError):
+        return data
+    merged = dict(data, **{"track-details": []})
+    for track in data["track-details"]:
+        old = earlier.get(track["number"])
+        if old and "keep" in old and "keep" not in track:
+            track = dict(track, keep=True)
+            if old.get("played-bytes", 0) > track.get("played-bytes", 0):
+                for key in ("played-bytes", "played-date", "played-time"):
+                    if key in old:
+                        track[key] = old[key]
+        merged["track-details"].append(track)
+    return merged
+
+def handle(cur, data):
+    """
+    Runs one BreakawayCD call against the database and returns (exit code, message,
+    effects). The SQL is not committed and the effects (log lines, files to delete)
+    are not carried out, that's up to the caller.
+    """
+    if data["error"]:
+        return 1, "Error! Don't write.", []
+
+    # ----------------------------------------------------------
+    # STATE CHECK (same logic as original)
+    # ----------------------------------------------------------
+    if data["ejected"] != trackMode:
+        if(trackMode):
+            return 1, "Don't write, disc not ejected yet.", []
+        else:
+            return 1, "Don't write, disc was already processed after ripping.", []
+    # ----------------------------------------------------------
 
-    if trackMode:
-        # check SQL instead of registry
-        doWrite = False
+    db_title, db_track_title = db_titles(cur, data)
+    mark_keep(data)
 
-        for track in data["track-details"]:
-            if "keep" in track:
-                cur.execute("""
-                    SELECT track_title FROM written_tracks
-                    WHERE title=? AND track_id=?
-                """, (data["title"], track["id"]))
-                row = cur.fetchone()
+    # ======================================================================
+    # PART 1 — Being asked whether to write (data["written"] == False)
+    # ======================================================================
+    if data["written"] == False:
 
-                alreadyWritten = (row is not None and row[0] == track["title"])
+        if trackMode:
+            # check SQL instead of registry
+            doWrite = False
 
-                if not alreadyWritten:
-                    doWrite = True
+            for track in data["track-details"]:
+                if "keep" in track:
+                    cur.execute("""
+                        SELECT track_title FROM written_tracks
+                        WHERE title=? AND track_id=?
+                    """, (db_title, track["id"]))
+                    row = cur.fetchone()
 
-        if doWrite:
-            print("Do write, we need at least one track.")
-            exit(0)
-        else:
-            print("Don't write, no new tracks needed.")
-            exit(1)
+                    alreadyWritten = (row is not None and row[0] == db_track_title[track["number"]])
 
-    else:
-        # entire disc mode
-        cur.execute("""
-            SELECT 1 FROM written_discs
-            WHERE title=? AND cddb_id=?
-        """, (data["title"], data["cddb-id"]))
-        row = cur.fetchone()
-
-        if row:
-            print("Don't write.")
-            exit(1)
-        else:
-            print("Go ahead and write!")
-            exit(0)
+                    if not alreadyWritten:
+                        doWrite = True
 
+            if doWrite:
+                return 0, "Do write, we need at least one track.", []
+            else:
+                return 1, "Don't write, no new tracks needed.", []
 
-# ======================================================================
-# PART 2 — Data has been written. Now mark in SQL + clean files
-# ======================================================================
-else:
-    print("Disc has been written.")
+        else:
+            # entire disc mode
+            cur.execute("""
+                SELECT 1 FROM written_discs
+                WHERE title=? AND cddb_id=?
+            """, (db_title, data["cddb-id"]))
+            row = cur.fetchone()
+
+            if row:
+                return 1, "Don't write.", []
+            else:
+                return 0, "Go ahead and write!", []
+
+    # ======================================================================
+    # PART 2 — Data has been written. Now mark in SQL + clean files
+    # ======================================================================
+    # slow follow-up work, either queued in the outbox or done inline (see fastExit)
+    effects = []
 
     if trackMode:
         # Write tracks to SQL
@@ -170,46 +317,245 @@ else:
                 cur.execute("""
                     INSERT OR REPLACE INTO written_tracks (title, track_id, track_title)
                     VALUES (?, ?, ?)
-                """, (data["title"], track["id"], track["title"]))
-                conn.commit()
-
-                # Write log file entry
-                try:
-                    with open(log_file, "at") as f:
-                        nb = track["length-bytes"]
-                        nsec = int(nb/176400)
-                        trklen = f'{int(nsec/60)}:{nsec%60}'
-                        f.write(f'"TRACK","{track["played-date"]}","{track["played-time"]}",'
+                """, (db_title, track["id"], db_track_title[track["number"]]))
+
+                # log file entry
+                nb = track["length-bytes"]
+                nsec = int(nb/176400)
+                trklen = f'{int(nsec/60)}:{nsec%60}'
+                effects.append(("log", {"file": log_file, "line":
+                                f'"TRACK","{track["played-date"]}","{track["played-time"]}",'
                                 f'"{data["title"]}","{track["title"]}",{track["number"]},'
-                                f'"{trklen}","{data["cddb-id"]}"\n')
-                except:
-                    pass
+                                f'"{trklen}","{data["cddb-id"]}"\n'}))
 
             if "keep" not in track and track["already-present"] == False:
-                print(f'Deleting {track["filepath"]}')
-                try:
-                    os.unlink(track["filepath"])
-                except:
-                    pass
+                effects.append(("delete", {"path": track["filepath"], "quarantine": quarantine_folder}))
+
+        analyse = [[track["id"], track["filepath"]] for track in data["track-details"] if "keep" in track]
+        tag = [{"path": track["filepath"], "album": db_title, "title": db_track_title[track["number"]],
+                "number": track["number"], "cddb_id": data["cddb-id"], "date": track.get("played-date", "")}
+               for track in data["track-details"] if "keep" in track]
 
     else:
         # disc write mode
         cur.execute("""
             INSERT OR REPLACE INTO written_discs (title, cddb_id)
             VALUES (?, ?)
-        """, (data["title"], data["cddb-id"]))
-        conn.commit()
-
-        try:
-            with open(log_file, "at") as f:
-                nb = sum(t["length-bytes"] for t in data["track-details"])
-                nsec=int(nb/176400)
-                disclen=f'{int(nsec/60)}:{nsec%60}'
-                f.write(f'"DISC","{data["ripped-date"]}","{data["ripped-time"]}",'
+        """, (db_title, data["cddb-id"]))
+
+        nb = sum(t["length-bytes"] for t in data["track-details"])
+        nsec=int(nb/176400)
+        disclen=f'{int(nsec/60)}:{nsec%60}'
+        effects.append(("log", {"file": log_file, "line":
+                        f'"DISC","{data["ripped-date"]}","{data["ripped-time"]}",'
                         f'"{data["title"]}","",{data["tracks"]},"{disclen}",'
-                        f'"{data["cddb-id"]}"\n')
-        except:
-            pass
+                        f'"{data["cddb-id"]}"\n'}))
+
+        analyse = [[f'T{t["number"]:02} {data["cddb-id"]}', t["filepath"]] for t in data["track-details"]]
+        tag = [{"path": t["filepath"], "album": db_title, "title": t.get("title", ""), "number": t["number"],
+                "cddb_id": data["cddb-id"], "date": data["ripped-date"]} for t in data["track-details"]]
+
+    if archiveEvents:
+        # an effect like the others, so a caller that leaves the follow-up work undone
+        # (a batch replay without --effects) announces nothing either
+        effects.append(("events", {"kind": "track" if trackMode else "disc", "cddb_id": data["cddb-id"],
+                                   "tracks": tag}))
+
+    if tagFiles and tag:
+        effects.append(("tags", {"tracks": tag, "id3": tagId3}))
+    if loudnessAnalysis and analyse:
+        effects.append(("loudness", {"title": db_title, "tracks": analyse}))
+    if cueDetection and analyse:
+        effects.append(("cues", {"title": db_title, "tracks": analyse}))
+
+    # keep the final payload (with our keep flags) for the DB browser
+    import zlib
+    cur.execute("SELECT payload FROM disc_payloads WHERE title=? AND cddb_id=?", (db_title, data["cddb-id"]))
+    row = cur.fetchone()
+    stored = merge_payload(row[0], data) if row and trackMode else data
+    cur.execute("""
+        INSERT OR REPLACE INTO disc_payloads
+            (title, cddb_id, tracks, length_bytes, kept, ripped_date, ripped_time, payload)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (db_title, data["cddb-id"], data["tracks"],
+          sum(t["length-bytes"] for t in data["track-details"]),
+          sum(1 for t in stored["track-details"] if "keep" in t) if trackMode else data["tracks"],
+          data["ripped-date"], data["ripped-time"],
+          zlib.compress(json.dumps(stored, separators=(",", ":")).encode("utf-8"), 9)))
+
+    return 0, "Disc has been written.", effects
+
+# ----------------------------------------------------------
+# ARCHIVE EVENTS (see archiveEvents)
+# ----------------------------------------------------------
+def record_events(cur, kind, cddb_id, tracks):
+    """One archive_events row per archived file, tracks as built for the "tags" effect."""
+    import time
+    now = time.time()
+    cur.executemany("""
+        INSERT INTO archive_events (kind, cddb_id, track_id, title, track_title, filepath, created)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(kind, cddb_id, f'T{t["number"]:02} {cddb_id}', t["album"], t["title"], t["path"], now) for t in tracks])
+
+def notify_events(port=eventPort):
+    # a single datagram, nothing waits for an answer; if cdrip-events.py isn't running it's lost
+    # and the events are still in the table for when it starts
+    import socket
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.sendto(b"archive_events", ("127.0.0.1", port))
+    except OSError:
+        pass
+
+# ----------------------------------------------------------
+# FOLLOW-UP WORK (log file entries, deleting unplayed tracks)
+# ----------------------------------------------------------
+# audio analysis, carried out by these tools and never on the handler's critical path:
+# split_effects() always leaves it to the outbox, fastExit or not
+ANALYSIS_TOOLS = {"loudness": "cdrip-loudness.py", "cues": "cdrip-cues.py"}
+
+def tool_path(filename):
+    """A companion script next to this one, or next to the .pyz when run as a zipapp."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    if os.path.isfile(here):
+        here = os.path.dirname(here)
+    return os.path.join(here, filename)
+
+def split_effects(effects):
+    """(effects for queue_effects, effects to do inline) according to fastExit."""
+    def later(kind):
+        return fastExit or kind in ANALYSIS_TOOLS or kind == "events"
+    return [e for e in effects if later(e[0])], [e for e in effects if not later(e[0])]
+
+def queue_effects(cur, effects):
+    """
+    Records the archive events and queues the rest in the outbox, in the same transaction
+    as the decision, so nothing is lost if we die after commit. Returns the number of
+    outbox actions.
+    """
+    import time
+    now = time.time()
+    actions = []
+    for kind, effect_args in effects:
+        if kind == "events":
+            record_events(cur, effect_args["kind"], effect_args["cddb_id"], effect_args["tracks"])
+        else:
+            actions.append((kind, json.dumps(effect_args), now))
+    cur.executemany("INSERT INTO outbox (kind, args, created) VALUES (?, ?, ?)", actions)
+    return len(actions)
+
+def start_outbox_worker(path=db_path):
+    try:
+        import subprocess
+        worker = tool_path("cdrip-sqlite-outbox.py")
+        if os.name == "nt":
+            detach = {"creationflags": 0x00000008 | 0x00000200}  # DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP
+        else:
+            detach = {"start_new_session": True}
+        subprocess.Popen([sys.executable, worker, "--db", path],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, close_fds=True, **detach)
+    except:
+        pass
+
+def run_effects(effects):
+    for kind, effect_args in effects:
+        if kind == "log":
+            try:
+                with open(effect_args["file"], "at") as f:
+                    f.write(effect_args["line"])
+            except:
+                pass
+        elif kind == "delete":
+            print(f'Deleting {effect_args["path"]}')
+            try:
+                os.unlink(effect_args["path"])
+            except:
+                pass
+        elif kind == "tags":
+            try:
+                import importlib.util
+                spec = importlib.util.spec_from_file_location("cdrip_tags", tool_path("cdrip-tags.py"))
+                tags = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(tags)
+                results, errors = tags.tag_tracks(effect_args["tracks"], effect_args["id3"])
+                # per file, as the outbox worker reports them (nothing retries them here)
+                for path, error in errors.items():
+                    print(f"Tagging {path} failed: {error}")
+            except Exception as e:
+                print(f"Tagging failed: {e}")
+# ----------------------------------------------------------
+
+def main():
+    global verbose
+    if len(sys.argv) == 2 and not sys.argv[1].startswith("-"):
+        jsonfile = sys.argv[1]      # the way BreakawayCD calls us, no need for argparse
+    else:
+        import argparse
+        parser = argparse.ArgumentParser("CD rip handler script")
+        parser.add_argument("jsonfile", help="Filename of JSON data from BreakawayCD")
+        parser.add_argument("-v", "--verbose", action="store_true", help="Print the whole JSON payload")
+        args = parser.parse_args()
+        jsonfile = args.jsonfile
+        verbose = verbose or args.verbose
+
+    print(f'Reading JSON file: {jsonfile}\n')
+
+    filedata = ""
+    with open(jsonfile) as f:
+        filedata = f.read()
+
+    if filedata:
+        data = json.loads(filedata)
+        if verbose:
+            print(json.dumps(data, indent=2))
+
+    print("")
+
+    # echo JSON stage files
+    try:
+        if len(echo_folder):
+            stage = 0
+            if data["written"]:
+                stage |= 1
+            if data["ejected"]:
+                stage |= 2
+
+            with open(f'{echo_folder}\\output_{data["deck"]}-{stage+1}.txt', "w") as g:
+                g.write(filedata)
+    except:
+        pass
+
+    # ----------------------------------------------------------
+    # KEY NAME (not used in SQL, but kept for compatibility)
+    # ----------------------------------------------------------
+    if trackMode:
+        reg_key = f'SOFTWARE\\BreakawayCD\\Ripped Tracks\\{data["title"]}'
+    else:
+        reg_key = f'SOFTWARE\\BreakawayCD\\Ripped Discs\\{data["title"]}'
+    # ----------------------------------------------------------
+
+    conn = open_db(db_path)
+    cur = conn.cursor()
+    code, message, effects = handle(cur, data)
+    print(message)
+    if code != 0 or data["written"] == False:
+        sys.exit(code)
+
+    later, inline = split_effects(effects)
+    queued = queue_effects(cur, later)
+    conn.commit()
+    if archiveEvents and eventPort:
+        notify_events(eventPort)
+
+    if queued:
+        if outboxAutostart:
+            start_outbox_worker(db_path)
+        print(f"Queued {queued} follow-up actions in the outbox.")
+    run_effects(inline)
 
     print("Exiting with code 0 (OK)")
-    exit(0)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+cdrip-startup.py
+Keeps the rip handler quick to start. BreakawayCD starts a new Python process for every
+call of the handler and waits for its answer before it writes anything, so at the
+permission stage the whole run, interpreter start-up included, is dead time.
+
+  build  packs a handler (cdrip-sqlite.py unless told otherwise) into a zipapp next to
+         it, cdrip-sqlite.pyz, holding nothing but its precompiled bytecode, so Python
+         doesn't read, parse and compile the source or look for a __pycache__ on each
+         call. Have BreakawayCD run it as
+             python -S c:\path\to\cdrip-sqlite.pyz
+         (-S skips the site-packages setup, the handler only uses the standard library).
+         The settings at the top of the handler are baked in, and the bytecode only fits
+         the Python version that built it: build again after changing either.
+
+  bench  times the permission stage end to end, the way BreakawayCD runs it, against a
+         scratch copy of ripped.db filled with --discs discs, and fails (exit code 1)
+         when the median run takes longer than --budget-ms. Plain "python -S -c pass"
+         and the handler source are timed next to it for comparison. The handler finds
+         the scratch database through the CDRIP_DB environment variable; its echo file
+         is written for deck 99 so no real deck's echo file is replaced.
+
+Requirements: Python 3 (no external packages).
+Run: python cdrip-startup.py build [HANDLER]
+     python cdrip-startup.py bench [ENTRY] [--runs 30] [--budget-ms 100] [--imports]
+"""
+
+import os
+import sys
+import json
+import time
+import marshal
+import sqlite3
+import zipfile
+import argparse
+import tempfile
+import statistics
+import subprocess
+import importlib.util
+
+from cdrip_tools import load_tool
+
+HANDLER = "cdrip-sqlite.py"
+BUDGET_MS = 100         # per permission-stage call, median
+RUNS = 30
+DISCS = 20000           # discs in the scratch database
+PYTHON_FLAGS = ["-S"]
+
+def zipapp_path(script):
+    return os.path.splitext(script)[0] + ".pyz"
+
+# ----------------------------------------------------------
+# BUILD
+# ----------------------------------------------------------
+def build(script, optimize=2):
+    """Writes the handler's bytecode as __main__.pyc into an uncompressed zipapp. Returns its path."""
+    with open(script, "rb") as f:
+        source = f.read()
+    # -OO level: the handler has no asserts and nothing reads its docstrings
+    code = compile(source, os.path.basename(script), "exec", dont_inherit=True, optimize=optimize)
+    # a pyc without a source timestamp, zipimport has no source to compare it with anyway
+    pyc = importlib.util.MAGIC_NUMBER + (0).to_bytes(12, "little") + marshal.dumps(code)
+
+    target = zipapp_path(script)
+    part = target + ".part"
+    with zipfile.ZipFile(part, "w", zipfile.ZIP_STORED) as z:
+        z.writestr("__main__.pyc", pyc)
+    os.replace(part, target)
+    return target
+
+# ----------------------------------------------------------
+# BENCHMARK
+# ----------------------------------------------------------
+def make_scratch(folder, discs, track_mode):
+    """A ripped.db with `discs` discs in it and a permission-stage payload for one more."""
+    db = os.path.join(folder, "ripped.db")
+    handler = load_tool(HANDLER)
+    conn = handler.open_db(db)
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO written_tracks (title, track_id, track_title) VALUES (?, ?, ?)",
+                         ((f"Album {n}", f"T{t:02} {n:08x}", f"Track {t}") for n in range(discs) for t in range(1, 13)))
+        conn.executemany("INSERT OR IGNORE INTO written_discs (title, cddb_id) VALUES (?, ?)",
+                         ((f"Album {n}", f"{n:08x}") for n in range(discs)))
+    conn.close()
+
+    # half of the tracks played through, one of those archived already
+    cddb = f"{discs // 2:08x}"
+    data = {
+        "deck": 99, "error": False, "written": False, "ejected": track_mode,
+        "title": f"Album {discs // 2}", "cddb-id": cddb, "tracks": 12,
+        "ripped-date": time.strftime("%Y-%m-%d"), "ripped-time": time.strftime("%H:%M:%S"),
+        "track-details": [{
+            "number": t, "title": f"Track {t}", "length-bytes": 176400 * 240,
+            "played-bytes": 176400 * (240 if t % 2 else 30),
+            "filepath": os.path.join(folder, f"T{t:02}.wav"), "already-present": t == 1,
+            "played-date": time.strftime("%Y-%m-%d"), "played-time": time.strftime("%H:%M:%S"),
+        } for t in range(1, 13)],
+    }
+    payload = os.path.join(folder, "payload.json")
+    with open(payload, "w") as f:
+        json.dump(data, f)
+    return db, payload
+
+def time_runs(cmd, runs, env, cwd):
+    """Wall-clock milliseconds of each run, after one warm-up run."""
+    times = []
+    for n in range(runs + 1):
+        t0 = time.perf_counter()
+        result = subprocess.run(cmd, env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        elapsed = (time.perf_counter() - t0) * 1000
+        if result.returncode not in (0, 1):
+            raise RuntimeError(f"{' '.join(cmd)} failed:\n{result.stderr.decode(errors='replace')}")
+        if n:
+            times.append(elapsed)
+    return times
+
+def top_imports(cmd, env, cwd, count=10):
+    """The slowest imports of one run, from python -X importtime, as [(ms, module)]."""
+    result = subprocess.run(cmd[:1] + ["-X", "importtime"] + cmd[1:], env=env, cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                imports.append((int(cumulative) / 1000, name.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+def bench(entry, runs=RUNS, budget_ms=BUDGET_MS, discs=DISCS, imports=False):
+    """Prints the timings and returns True when the entry point stays within the budget."""
+    handler = load_tool(HANDLER)
+    with tempfile.TemporaryDirectory() as folder:
+        db, payload = make_scratch(folder, discs, handler.trackMode)
+        env = dict(os.environ, CDRIP_DB=db)
+        variants = [("python -S -c pass", [sys.executable] + PYTHON_FLAGS + ["-c", "pass"])]
+        source = os.path.join(os.path.dirname(os.path.abspath(__file__)), HANDLER)
+        if os.path.abspath(entry) != source:
+            variants.append((HANDLER, [sys.executable] + PYTHON_FLAGS + [source, payload]))
+        variants.append((os.path.basename(entry), [sys.executable] + PYTHON_FLAGS + [entry, payload]))
+
+        print(f"Permission stage, {runs} runs each, {discs} discs in the database (ms per call)")
+        print(f'{"":<24}{"min":>8}{"median":>8}{"p90":>8}')
+        for name, cmd in variants:
+            times = sorted(time_runs(cmd, runs, env, folder))
+            median = statistics.median(times)
+            print(f"{name:<24}{times[0]:>8.1f}{median:>8.1f}{times[int(0.9 * (len(times) - 1))]:>8.1f}")
+
+        if imports:
+            print(f"\nSlowest imports of {os.path.basename(entry)} (ms, cumulative)")
+            for ms, module in top_imports(variants[-1][1], env, folder):
+                print(f"{ms:>8.1f}  {module}")
+
+    ok = median <= budget_ms
+    print(f"\n{os.path.basename(entry)}: median {median:.1f} ms, budget {budget_ms} ms, "
+          + ("within budget" if ok else "OVER BUDGET"))
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser("Rip handler start-up tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("build", help="Pack a handler into a precompiled zipapp")
+    p.add_argument("handler", nargs="?", default=None, help=f"Handler script (default: {HANDLER})")
+    p = commands.add_parser("bench", help="Time the permission stage against the budget")
+    p.add_argument("entry", nargs="?", default=None,
+                   help="What BreakawayCD runs (default: the zipapp if it has been built, otherwise the handler)")
+    p.add_argument("--runs", type=int, default=RUNS, help="Timed runs per variant")
+    p.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="Allowed median per call")
+    p.add_argument("--discs", type=int, default=DISCS, help="Discs in the scratch database")
+    p.add_argument("--imports", action="store_true", help="Also list the slowest imports of one run")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    if args.command == "build":
+        target = build(args.handler or os.path.join(here, HANDLER))
+        print(f"Built {target} ({os.path.getsize(target)} bytes)")
+        print(f"BreakawayCD command line: {os.path.basename(sys.executable)} {' '.join(PYTHON_FLAGS)} {target}")
+    else:
+        entry = args.entry or zipapp_path(os.path.join(here, HANDLER))
+        if not os.path.exists(entry):
+            entry = os.path.join(here, HANDLER)
+        if not bench(entry, max(1, args.runs), args.budget_ms, args.discs, args.imports):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
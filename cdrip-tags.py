@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+cdrip-tags.py
+Writes what the rip handler knows about a kept track into the WAV itself, so the
+playout system doesn't have to look it up: a RIFF LIST/INFO chunk with
+  INAM track title, IPRD album title, ITRK track number, ICMT "CDDB:a1b2c3d4",
+  ICRD date played (or ripped)
+the same tags cdrip-sqlite-rebuild.py reads back, and optionally an "id3 " chunk
+(ID3v2.3: TIT2, TALB, TRCK, TYER and a CDDB comment) for players that only read ID3.
+Other INFO tags and ID3 frames already in the file are kept.
+
+The audio is never read or moved. Only the chunk headers are read; the tag chunk is
+rewritten where it is when the new one fits (with the JUNK chunk after it), and
+otherwise appended at the end of the file with some JUNK room to grow into, the old
+one turned into JUNK. Each step leaves a valid file behind: new tag bytes are written
+under a JUNK chunk header first and only show up with one 8-byte header write at the
+end, and the RIFF size is updated only after appended bytes are on disk. Files are
+tagged side by side on a thread pool.
+
+Requirements: Python 3 (no external packages).
+Run: python cdrip-tags.py --album ALBUM --cddb ID [--date YYYY-MM-DD] [--id3] --track NUMBER TITLE FILE...
+     python cdrip-tags.py --show FILE...
+cdrip.py and cdrip-sqlite.py run it on the kept tracks when a disc has been written.
+"""
+
+import os
+import time
+import struct
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+WORKERS = 4
+RESERVE = 256           # JUNK bytes left after an appended tag chunk, so later edits fit in place
+MAX_TAG_BYTES = 65536   # tag chunks larger than this aren't ours to rewrite
+SYNC = True             # fsync between the steps, so a crash can't reorder them
+FILLER = (b"JUNK", b"junk", b"PAD ")
+
+# ----------------------------------------------------------
+# Tag chunks
+# ----------------------------------------------------------
+def info_tags(album, title, number, cddb_id, date=""):
+    """The INFO tags for one track, by tag id."""
+    tags = {"INAM": title, "IPRD": album, "ITRK": str(number), "ICMT": f"CDDB:{cddb_id}", "ICRD": date}
+    return {k: v for k, v in tags.items() if v}
+
+def _encode(text):
+    # the ANSI code page is what Windows tools expect; UTF-8 for anything it can't hold
+    try:
+        raw = text.encode("cp1252")
+    except UnicodeEncodeError:
+        raw = text.encode("utf-8")
+    # NUL-terminated, and NUL-padded to an even size so no pad byte is needed
+    return raw + b"\0" * (2 - len(raw) % 2)
+
+def parse_info(body):
+    """[(tag id bytes, raw value)] from the body of a LIST chunk, after the INFO type."""
+    items = []
+    pos = 0
+    while pos + 8 <= len(body):
+        cid = body[pos:pos + 4]
+        size = struct.unpack_from("<I", body, pos + 4)[0]
+        items.append((cid, body[pos + 8:pos + 8 + size]))
+        pos += 8 + size + (size & 1)
+    return items
+
+def info_chunk(tags, existing=b"", extra=0):
+    """
+    A complete LIST/INFO chunk: the tags already in `existing` (the old chunk's body)
+    that aren't being set, then `tags`. `extra` NULs (even) are added to the last value.
+    """
+    ours = {cid.encode("ascii"): _encode(text) for cid, text in tags.items()}
+    items = [(cid, raw) for cid, raw in parse_info(existing[4:] if existing[:4] == b"INFO" else b"")
+             if cid not in ours] + list(ours.items())
+    if extra:
+        cid, raw = items[-1]
+        items[-1] = (cid, raw + b"\0" * extra)
+    body = b"INFO" + b"".join(cid + struct.pack("<I", len(raw)) + raw + b"\0" * (len(raw) & 1)
+                              for cid, raw in items)
+    return b"LIST" + struct.pack("<I", len(body)) + body
+
+def _syncsafe(n):
+    return bytes([(n >> 21) & 0x7f, (n >> 14) & 0x7f, (n >> 7) & 0x7f, n & 0x7f])
+
+def _id3_frame(fid, body):
+    return fid + struct.pack(">I", len(body)) + b"\0\0" + body
+
+def id3_frames(tags):
+    """ID3v2.3 frames for the INFO tags, by frame id ("COMM" for the CDDB comment)."""
+    frames = {}
+    for cid, fid in (("INAM", b"TIT2"), ("IPRD", b"TALB"), ("ITRK", b"TRCK")):
+        if tags.get(cid):
+            frames[fid] = _id3_frame(fid, b"\x01" + tags[cid].encode("utf-16"))
+    if tags.get("ICRD", "")[:4].isdigit():
+        frames[b"TYER"] = _id3_frame(b"TYER", b"\x00" + tags["ICRD"][:4].encode("ascii"))
+    if tags.get("ICMT"):
+        frames[b"COMM"] = _id3_frame(b"COMM", b"\x01eng" + "CDDB".encode("utf-16") + b"\0\0"
+                                     + tags["ICMT"][5:].encode("utf-16"))
+    return frames
+
+def _kept_id3_frames(existing, ours):
+    # other frames of an existing plain ID3v2.3 tag; anything fancier is replaced as a whole
+    if len(existing) < 10 or existing[:3] != b"ID3" or existing[3] != 3 or existing[5] != 0:
+        return b""
+    end = 10 + ((existing[6] << 21) | (existing[7] << 14) | (existing[8] << 7) | existing[9])
+    kept = []
+    pos = 10
+    while pos + 10 <= min(end, len(existing)) and existing[pos] != 0:
+        fid = existing[pos:pos + 4]
+        size = struct.unpack_from(">I", existing, pos + 4)[0]
+        frame = existing[pos:pos + 10 + size]
+        # our CDDB comment is replaced, other comments are kept
+        ours_too = fid in ours and (fid != b"COMM" or frame[14:14 + 10] == "CDDB".encode("utf-16"))
+        if not ours_too:
+            kept.append(frame)
+        pos += 10 + size
+    return b"".join(kept)
+
+def id3_chunk(tags, existing=b"", extra=0):
+    """A complete "id3 " chunk holding an ID3v2.3 tag, with `extra` bytes of padding."""
+    ours = id3_frames(tags)
+    frames = _kept_id3_frames(existing, ours) + b"".join(ours.values())
+    frames += b"\0" * ((len(frames) & 1) + extra)
+    body = b"ID3\x03\x00\x00" + _syncsafe(len(frames)) + frames
+    return b"id3 " + struct.pack("<I", len(body)) + body
+
+# ----------------------------------------------------------
+# RIFF
+# ----------------------------------------------------------
+def read_chunks(f):
+    """[(id, offset, size)] of the top-level chunks and the file size. Only headers are read."""
+    f.seek(0)
+    head = f.read(12)
+    if len(head) < 12 or head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+        raise ValueError("not a RIFF WAVE file")
+    file_size = os.fstat(f.fileno()).st_size
+    chunks = []
+    pos = 12
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        header = f.read(8)
+        cid, size = header[:4], struct.unpack("<I", header[4:])[0]
+        chunks.append((cid, pos, size))
+        pos += 8 + size + (size & 1)
+    # a pad byte missing after the last chunk is fine, anything else means a size is wrong
+    if pos > file_size + 1:
+        raise ValueError(f"{chunks[-1][0].decode('ascii', 'replace')} chunk runs past the end of the file")
+    return chunks, file_size
+
+def _sync(f):
+    f.flush()
+    if SYNC:
+        os.fsync(f.fileno())
+
+def _find(f, chunks, match):
+    """(index, old chunk body) of the first chunk `match` accepts, or (None, b"")."""
+    for i, (cid, off, size) in enumerate(chunks):
+        if cid in match[0] and size <= MAX_TAG_BYTES:
+            f.seek(off + 8)
+            body = f.read(size)
+            if match[1](body):
+                return i, body
+    return None, b""
+
+def write_chunk(f, chunks, file_size, index, build):
+    """
+    Puts the chunk build(extra) makes in place of chunks[index] (None: a new chunk).
+    Returns "in place" or "appended".
+    """
+    if index is not None:
+        # the old chunk and the filler after it make the slot the new chunk can go in
+        off = chunks[index][1]
+        end = off + 8 + chunks[index][2] + (chunks[index][2] & 1)
+        for cid, o, size in chunks[index + 1:]:
+            if cid not in FILLER or o != end:
+                break
+            end = o + 8 + size + (size & 1)
+        room = min(end, file_size) - off
+        chunk = build(0)
+        left = room - len(chunk)
+        if 0 < left < 8:
+            chunk = build(left)
+            left = 0
+        if left == 0 or left >= 8:
+            # 1. cover the whole slot with one JUNK chunk, 2. fill it in underneath,
+            # 3. show the new chunk with a single header write
+            f.seek(off)
+            f.write(b"JUNK" + struct.pack("<I", room - 8))
+            _sync(f)
+            f.seek(off + 8)
+            f.write(chunk[8:])
+            if left:
+                f.write(b"JUNK" + struct.pack("<I", left - 8) + b"\0" * (left - 8))
+            _sync(f)
+            f.seek(off)
+            f.write(chunk[:8])
+            _sync(f)
+            return "in place"
+
+    # append: new chunk and its room to grow, then the RIFF size, then hide the old one
+    chunk = build(0)
+    tail = b"\0" * (file_size & 1) + chunk + b"JUNK" + struct.pack("<I", RESERVE) + b"\0" * RESERVE
+    f.seek(file_size)
+    f.write(tail)
+    _sync(f)
+    f.seek(4)
+    f.write(struct.pack("<I", file_size + len(tail) - 8))
+    _sync(f)
+    if index is not None:
+        f.seek(chunks[index][1])
+        f.write(b"JUNK")
+        _sync(f)
+    return "appended"
+
+INFO = ((b"LIST",), lambda body: body[:4] == b"INFO")
+ID3 = ((b"id3 ", b"ID3 "), lambda body: body[:3] == b"ID3")
+
+def _same(name, old, new):
+    # equal up to the NUL padding an earlier in-place write may have added
+    if name == "INFO":
+        return ({cid: raw.rstrip(b"\0") for cid, raw in parse_info(old[4:])}
+                == {cid: raw.rstrip(b"\0") for cid, raw in parse_info(new[4:])})
+    return old[:6] == new[:6] and old[10:].rstrip(b"\0") == new[10:].rstrip(b"\0")
+
+def tag_file(path, tags, id3=False):
+    """
+    Writes the INFO tags (and an ID3 tag with id3=True) into a WAV file. Returns what
+    was done per chunk, such as {"INFO": "in place"}; "unchanged" when the file
+    already has these tags.
+    """
+    done = {}
+    with open(path, "r+b") as f:
+        for name, match, build in (("INFO", INFO, info_chunk), ("ID3", ID3, id3_chunk)):
+            if name == "ID3" and not id3:
+                continue
+            chunks, file_size = read_chunks(f)
+            if not any(cid == b"data" for cid, _, _ in chunks):
+                raise ValueError("no data chunk")
+            index, existing = _find(f, chunks, match)
+            if index is not None and _same(name, existing, build(tags, existing)[8:]):
+                done[name] = "unchanged"
+                continue
+            done[name] = write_chunk(f, chunks, file_size, index,
+                                     lambda extra: build(tags, existing, extra))
+    return done
+
+def read_tags(path):
+    """{tag id: text} of the LIST/INFO chunk of a WAV file."""
+    with open(path, "rb") as f:
+        chunks, _ = read_chunks(f)
+        index, body = _find(f, chunks, INFO)
+    tags = {}
+    for cid, raw in parse_info(body[4:]):
+        raw = raw.split(b"\0", 1)[0]
+        try:
+            tags[cid.decode("ascii", "replace")] = raw.decode("utf-8")
+        except UnicodeDecodeError:
+            tags[cid.decode("ascii", "replace")] = raw.decode("cp1252", "replace")
+    return tags
+
+# ----------------------------------------------------------
+# Batches
+# ----------------------------------------------------------
+def _tag_one(track, id3):
+    try:
+        tags = info_tags(track["album"], track["title"], track["number"], track["cddb_id"], track.get("date", ""))
+        return track["path"], tag_file(track["path"], tags, id3), None
+    except (OSError, ValueError) as e:
+        return track["path"], None, str(e)
+
+def tag_tracks(tracks, id3=False, workers=WORKERS):
+    """
+    Tags [{"path", "album", "title", "number", "cddb_id", "date"}] side by side.
+    Returns ({path: what was done}, {path: error}).
+    """
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for path, done, error in pool.map(lambda t: _tag_one(t, id3), tracks):
+            if error is None:
+                results[path] = done
+            else:
+                errors[path] = error
+    return results, errors
+
+def main():
+    parser = argparse.ArgumentParser("Tag archived WAV files in place")
+    parser.add_argument("--album", help="Album title (IPRD)")
+    parser.add_argument("--cddb", help="CDDB id of the disc")
+    parser.add_argument("--date", default="", help="Date played or ripped, YYYY-MM-DD (ICRD)")
+    parser.add_argument("--track", nargs=3, action="append", default=[], metavar=("NUMBER", "TITLE", "FILE"),
+                        help="Track number, title and WAV file; repeat for every track")
+    parser.add_argument("--id3", action="store_true", help="Also write an ID3v2.3 tag in an \"id3 \" chunk")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Files tagged side by side")
+    parser.add_argument("--show", nargs="+", metavar="FILE", help="Print the INFO tags of these files and exit")
+    args = parser.parse_args()
+
+    if args.show:
+        for path in args.show:
+            try:
+                print(f"{path}: {read_tags(path)}")
+            except (OSError, ValueError) as e:
+                print(f"{path}: {e}")
+        return
+    if not args.track or not args.album or not args.cddb:
+        parser.error("--album, --cddb and at least one --track are needed")
+
+    tracks = [{"path": path, "album": args.album, "title": title, "number": int(number),
+               "cddb_id": args.cddb, "date": args.date} for number, title, path in args.track]
+    t0 = time.perf_counter()
+    results, errors = tag_tracks(tracks, args.id3, max(1, args.workers))
+    elapsed = (time.perf_counter() - t0) * 1000
+    for track in tracks:
+        done = results.get(track["path"])
+        print(f'{track["path"]}: ' + (", ".join(f"{k} {v}" for k, v in done.items()) if done
+                                     else errors.get(track["path"], "")))
+    print(f"{len(results)} files tagged, {len(errors)} failed, in {elapsed:.1f} ms "
+          f"({elapsed / max(1, len(tracks)):.1f} ms per file)")
+
+if __name__ == "__main__":
+    main()
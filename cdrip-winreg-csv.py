@@ -12,6 +12,13 @@ But, if we're archiving whole discs, we can write as soon as ripping is done. (w
 """
 writeOnEject = False
 
+"""
+A track is kept once more than keep_threshold of it has played, or once keep_min_seconds of it
+have played however long it is (0 = off). cdrip-keep-whatif.py shows what other values would have kept.
+"""
+keep_threshold = 0.8
+keep_min_seconds = 0
+
 """
 As a development aid, this script can echo the JSON objects received through the API to a folder.
 """
@@ -93,7 +100,7 @@ if writeOnEject:	#keep only the tracks that were played.
 		if track["length-bytes"]>0 and "played-bytes" in track:
 			fraction = track["played-bytes"] / track["length-bytes"]
 
-			if fraction > 0.8:	#if we've played 80% of the track, keep it
+			if fraction > keep_threshold or (keep_min_seconds and track["played-bytes"] >= keep_min_seconds*176400):	#if we've played enough of the track, keep it
 				track["keep"] = True
 
 
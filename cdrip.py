@@ -1,7 +1,7 @@
 import json
-import time
-import argparse
 import os
+import sys
+#everything else is imported where it's needed, BreakawayCD waits for every call
 
 # BreakawayCD example rip handler script v3.32.49 - Leif Claesson 2025
 
@@ -12,6 +12,13 @@ But, if we're archiving whole discs, we can write as soon as ripping is done. (t
 """
 trackMode = True
 
+"""
+A track is kept once more than keep_threshold of it has played, or once keep_min_seconds of it
+have played however long it is (0 = off). cdrip-keep-whatif.py shows what other values would have kept.
+"""
+keep_threshold = 0.8
+keep_min_seconds = 0
+
 """
 As a development aid, this script can echo the JSON objects received through the API to a folder.
 The folder must already exist, if it does not exist then the JSON echo no echo files will not be written.
@@ -25,25 +32,104 @@ log file
 log_file = "c:\\temp\\cdrip\\logfile.csv"
 
 
+"""
+Measure the loudness of the kept tracks before they go to the playout system, with cdrip-loudness.py
+(needs numpy). The results are stored in the registry next to the ripped tracks, in a Loudness subkey.
+The analysis runs in the background after the handler has returned, and takes a few seconds per disc.
+"""
+loudness_analysis = True
+
+
+"""
+Write album, track title, track number, CDDB id and date into the LIST/INFO chunk of each kept WAV
+with cdrip-tags.py, so the playout system finds them in the file. The audio itself isn't touched.
+tag_id3 adds an ID3v2.3 tag as well, for players that only read ID3.
+"""
+tag_files = True
+tag_id3 = False
+
+
+"""
+Print the whole JSON payload on every call. Also switched on for one call by running with -v.
+"""
+verbose = False
+
+
 
 #this example uses the windows registry to keep track of which CDs have already been ripped
 import winreg
 access_registry = winreg.ConnectRegistry(None,winreg.HKEY_CURRENT_USER)
 
 
-parser = argparse.ArgumentParser("CD rip handler script")
-parser.add_argument("jsonfile", help="Filename of JSON data from BreakawayCD")
-args = parser.parse_args()
+def tool_path(filename):
+	here = os.path.dirname(os.path.abspath(__file__))
+	if os.path.isfile(here):	#running as a zipapp, the tools sit next to the .pyz
+		here = os.path.dirname(here)
+	return os.path.join(here, filename)
+
+
+def tag_tracks(tracks):
+	#a few ms per file, only the tag chunks are written
+	if not tracks:
+		return
+	try:
+		import importlib.util
+		spec = importlib.util.spec_from_file_location("cdrip_tags", tool_path("cdrip-tags.py"))
+		tags = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(tags)
+		tagged = [{"path": track["filepath"], "album": data["title"], "title": track.get("title", ""),
+				   "number": track["number"], "cddb_id": data["cddb-id"],
+				   "date": track.get("played-date", "") if trackMode else data["ripped-date"]}
+				  for track in tracks]
+		results, errors = tags.tag_tracks(tagged, tag_id3)
+		for path, error in errors.items():
+			print(f"Tagging {path} failed: {error}")
+	except Exception as e:
+		print(f"Tagging failed: {e}")	#untagged, but the disc is still archived
+
+
+def analyse_loudness(reg_key, tracks):
+	#all tracks in one go, cdrip-loudness.py spreads them over the CPU cores
+	#started in the background, BreakawayCD shouldn't wait for it
+	if not tracks:
+		return
+	try:
+		import subprocess
+		tool = tool_path("cdrip-loudness.py")
+		cmd = [sys.executable, tool, "--registry", reg_key]
+		for track in tracks:
+			cmd += ["--track", track["id"], track["filepath"]]
+		if os.name == "nt":
+			detach = {"creationflags": 0x00000008 | 0x00000200}	#DETACHED_PROCESS | CREATE_NEW_PROCESS_GROUP
+		else:
+			detach = {"start_new_session": True}
+		subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+						 stderr=subprocess.DEVNULL, close_fds=True, **detach)
+	except:
+		pass	#no loudness figures, but the disc is still archived
+
+
+if len(sys.argv) == 2 and not sys.argv[1].startswith("-"):
+	jsonfile = sys.argv[1]	#the way BreakawayCD calls us, no need for argparse
+else:
+	import argparse
+	parser = argparse.ArgumentParser("CD rip handler script")
+	parser.add_argument("jsonfile", help="Filename of JSON data from BreakawayCD")
+	parser.add_argument("-v", "--verbose", action="store_true", help="Print the whole JSON payload")
+	args = parser.parse_args()
+	jsonfile = args.jsonfile
+	verbose = verbose or args.verbose
 
-print(f'Reading JSON file: {args.jsonfile}\n')
+print(f'Reading JSON file: {jsonfile}\n')
 
 filedata = ""
-with open(args.jsonfile) as f:
+with open(jsonfile) as f:
 	filedata = f.read()
 
 if filedata:
 	data = json.loads(filedata)
-	print(json.dumps(data, indent=2))
+	if verbose:
+		print(json.dumps(data, indent=2))
 
 print("")
 
@@ -77,7 +163,7 @@ except:
 
 if data["error"]:
 	print("Error! Don't write.")
-	exit(1)	#don't write!
+	sys.exit(1)	#don't write!
 
 if trackMode:
 	reg_key = f'SOFTWARE\\BreakawayCD\\Ripped Tracks\\{data["title"]}'
@@ -92,7 +178,7 @@ if data["ejected"] != trackMode:
 		print("We'll wait until the disc is ejected so we'll know what was actually played.")
 	else:
 		print("Don't write, the disc was ejected but we already did our work when the disc finished ripping.")
-	exit(1)	#don't write!
+	sys.exit(1)	#don't write!
 
 
 if trackMode:	#keep only the tracks that were played.
@@ -101,7 +187,7 @@ if trackMode:	#keep only the tracks that were played.
 		if track["length-bytes"]>0 and "played-bytes" in track:
 			fraction = track["played-bytes"] / track["length-bytes"]
 
-			if fraction > 0.8:	#if we've played 80% of the track, keep it
+			if fraction > keep_threshold or (keep_min_seconds and track["played-bytes"] >= keep_min_seconds*176400):	#if we've played enough of the track, keep it
 				track["keep"] = True
 
 
@@ -131,10 +217,10 @@ if data["written"] == False:	#we're being asked permission
 
 		if doWrite:
 			print("Do write, we need at least one track.")
-			exit(0) #go ahead and write
+			sys.exit(0) #go ahead and write
 		else:
 			print("Don't write, we don't need any tracks.")
-			exit(1)	#don't write!
+			sys.exit(1)	#don't write!
 
 		pass
 	else:
@@ -148,10 +234,10 @@ if data["written"] == False:	#we're being asked permission
 
 		if alreadyWritten:
 			print("Don't write.")
-			exit(1)	#don't write!
+			sys.exit(1)	#don't write!
 		else:
 			print("Go ahead and write!")
-			exit(0) #go ahead and write
+			sys.exit(0) #go ahead and write
 else:
 	print("Disc has been written.")
 	access_key = winreg.CreateKey(access_registry, reg_key)
@@ -160,12 +246,12 @@ else:
 		#delete the tracks that were written _in this session_ that we're not interested in
 		#but leave any track that was already there, because in order to
 		#be there it would have had to have been played in an earlier session!
+		kept = []
 		for track in data["track-details"]:
 			if "keep" in track:
 				#set a registry key so we don't write this track again
 				winreg.SetValueEx(access_key, track["id"], 0, winreg.REG_SZ, track["title"])
-				
-				# !!! here would be a good place to import the track to the playout system. !!!
+				kept.append(track)
 				
 				#here's an example of writing a text log entry
 
@@ -186,6 +272,14 @@ else:
 					os.unlink(track["filepath"])
 				except:
 					pass
+
+		if tag_files:
+			tag_tracks(kept)
+		if loudness_analysis:
+			analyse_loudness(reg_key, kept)
+
+		# !!! here would be a good place to import the kept tracks to the playout system. !!!
+		# their loudness follows a few seconds later, under reg_key + "\\Loudness"
 	else:
 		# disc has been written!
 		# set a registry key so we don't write this disc again
@@ -206,10 +300,17 @@ else:
 		except:
 			pass
 		
+		if tag_files:
+			tag_tracks(data["track-details"])
+		if loudness_analysis:
+			for track in data["track-details"]:
+				track["id"] = f'T{track["number"]:02} {data["cddb-id"]}'
+			analyse_loudness(reg_key, data["track-details"])
+
 		# !!! here would be a good place to import the disc to the playout system. !!!
 
 	print("Exiting with code 0 (OK)")
-	exit(0)	#return 0 = OK
+	sys.exit(0)	#return 0 = OK
 
 
 
@@ -0,0 +1,28 @@
+"""
+cdrip_tools.py
+Lets the cdrip-*.py scripts use each other. Their file names have hyphens in them, so
+a plain import can't reach them; load_tool() imports one by its path instead, once
+per process, and hands every later caller the same module.
+
+Requirements: Python 3 (no external packages).
+Not run on its own: the other scripts import it, so keep it in the same folder.
+The rip handler (cdrip-sqlite.py) doesn't use it, it has to stay a single file to
+run as a zipapp (see cdrip-startup.py).
+"""
+
+import os
+import importlib.util
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_loaded = {}
+
+def load_tool(filename):
+    """Import one of the companion cdrip-*.py scripts that sit next to this one."""
+    if filename not in _loaded:
+        name = os.path.splitext(filename)[0].replace("-", "_")
+        spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded[filename] = module
+    return _loaded[filename]
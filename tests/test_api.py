@@ -0,0 +1,68 @@
+"""
+cdrip-sqlite-api.py answering malformed requests with a JSON 400, on a scratch ripped.db
+made by the rip handler.
+
+Run: python -m pytest tests (or python -m unittest discover tests)
+"""
+
+import os
+import sys
+import json
+import socket
+import tempfile
+import threading
+import unittest
+import http.client
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cdrip_tools import load_tool
+
+class BadRequestTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        path = os.path.join(self.folder.name, "ripped.db")
+        conn = load_tool("cdrip-sqlite.py").open_db(path)
+        with conn:
+            conn.execute("INSERT INTO written_discs (title, cddb_id) VALUES ('Album', 'a1b2c3d4')")
+        conn.close()
+        api = load_tool("cdrip-sqlite-api.py")
+        self.service = api.LookupService(path, 2)
+        self.server = api.Server(("127.0.0.1", 0), self.service)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.close()
+        self.folder.cleanup()
+
+    def post(self, conn, body):
+        conn.request("POST", "/lookup", body, {"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_bad_bodies(self):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        for body in (b"not json", b"[1, 2]", b'{"cddb": 5}', b'{"cddb": [5]}', b'{"tracks": "T01 a1b2c3d4"}'):
+            status, answer = self.post(conn, body)
+            self.assertEqual(status, 400, body)
+            self.assertIn("error", answer)
+        # the same keep-alive connection still answers
+        status, answer = self.post(conn, b'{"cddb": ["a1b2c3d4"]}')
+        self.assertEqual((status, answer["discs"]["a1b2c3d4"]["archived"]), (200, True))
+        conn.close()
+
+    def test_bad_content_length(self):
+        for length in (None, "many", "-1"):
+            with socket.create_connection(("127.0.0.1", self.port), timeout=5) as s:
+                header = f"Content-Length: {length}\r\n" if length else ""
+                s.sendall(f"POST /lookup HTTP/1.1\r\nHost: x\r\n{header}\r\n{{}}".encode())
+                response = http.client.HTTPResponse(s)
+                response.begin()
+                self.assertEqual(response.status, 400, length)
+                self.assertIn("Content-Length", json.loads(response.read())["error"])
+        self.assertEqual(self.service.errors, 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Archive events recorded by the rip handler, and by cdrip-sqlite-batch.py only when
+it carries out the follow-up work (--effects).
+
+Run: python -m pytest tests (or python -m unittest discover tests)
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cdrip_tools import load_tool
+
+def written_payload(folder):
+    """Track mode, disc ejected and written: two tracks, the first played through."""
+    return {
+        "deck": 1, "error": False, "written": True, "ejected": True,
+        "title": "Album", "cddb-id": "a1b2c3d4", "tracks": 2,
+        "ripped-date": "2026-01-02", "ripped-time": "10:00:00",
+        "track-details": [{
+            "number": n, "title": f"Track {n}", "length-bytes": 176400 * 200,
+            "played-bytes": 176400 * (200 if n == 1 else 10),
+            "played-date": "2026-01-02", "played-time": "10:05:00",
+            "filepath": os.path.join(folder, f"T{n:02}.wav"), "already-present": True,
+        } for n in (1, 2)],
+    }
+
+class ArchiveEventsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.folder.name, "ripped.db")
+        self.payloads = os.path.join(self.folder.name, "payloads")
+        os.mkdir(self.payloads)
+        with open(os.path.join(self.payloads, "output_1-4.json"), "w") as f:
+            json.dump(written_payload(self.folder.name), f)
+        self.handler = load_tool("cdrip-sqlite.py")
+        # everything through the outbox, and no worker started for it
+        for name, value in [("trackMode", True), ("archiveEvents", True), ("fastExit", True),
+                            ("outboxAutostart", False)]:
+            patcher = mock.patch.object(self.handler, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def select(self, sql):
+        conn = sqlite3.connect(self.db)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def replay(self, effects_on):
+        return load_tool("cdrip-sqlite-batch.py").run(self.payloads, self.db, effects_on=effects_on, verbose=False)
+
+    def test_replay_records_no_events_without_effects(self):
+        report = self.replay(effects_on=False)
+        self.assertEqual([row["effects"] for row in report], [""])
+        self.assertEqual(self.select("SELECT track_id FROM written_tracks"), [("T01 a1b2c3d4",)])
+        self.assertEqual(self.select("SELECT count(*) FROM archive_events"), [(0,)])
+        self.assertEqual(self.select("SELECT count(*) FROM outbox"), [(0,)])
+
+    def test_replay_with_effects_records_events(self):
+        report = self.replay(effects_on=True)
+        self.assertIn("1 events", report[0]["effects"])
+        self.assertEqual(self.select("SELECT kind, cddb_id, track_id, title, track_title FROM archive_events"),
+                         [("track", "a1b2c3d4", "T01 a1b2c3d4", "Album", "Track 1")])
+        kinds = [kind for kind, in self.select("SELECT kind FROM outbox")]
+        self.assertNotIn("events", kinds)
+        self.assertIn("log", kinds)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+The DB browser's query log (TimedConnection / TimedCursor) and result cache, on a
+scratch ripped.db made by the rip handler.
+
+Run: python -m pytest tests (or python -m unittest discover tests)
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cdrip_tools import load_tool
+
+try:
+    import tkinter
+except ImportError:
+    tkinter = None
+
+@unittest.skipIf(tkinter is None, "the DB browser needs tkinter")
+class QueryLogTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "ripped.db")
+        load_tool("cdrip-sqlite.py").open_db(self.path).close()
+        self.db = load_tool("cdrip-sqlite-discbrowser.py").DB(self.path)
+
+    def tearDown(self):
+        self.db.close()
+        self.folder.cleanup()
+
+    def test_connection_shortcuts_are_logged(self):
+        conn = self.db.conn
+        with conn:
+            conn.executemany("INSERT INTO written_tracks (title, track_id, track_title) VALUES (?, ?, ?)",
+                             [("Album", f"T{n:02} a1b2c3d4", f"Track {n}") for n in (1, 2)])
+        self.assertEqual(len(conn.execute("SELECT * FROM written_tracks WHERE title = ?", ("Album",)).fetchall()), 2)
+        shapes = self.db.log.shapes
+        self.assertEqual(shapes["INSERT INTO written_tracks (title, track_id, track_title) VALUES (?, ?, ?)"]["params"],
+                         ("2 rows",))
+        self.assertEqual(shapes["SELECT * FROM written_tracks WHERE title = ?"]["count"], 1)
+
+    def test_change_check_is_not_logged(self):
+        self.db.get_tracks()
+        self.assertFalse(any("data_version" in shape for shape in self.db.log.shapes))
+
+@unittest.skipIf(tkinter is None, "the DB browser needs tkinter")
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "ripped.db")
+        conn = load_tool("cdrip-sqlite.py").open_db(self.path)
+        with conn:
+            conn.execute("INSERT INTO written_tracks (title, track_id, track_title) VALUES ('Album', 'T01 a1b2c3d4', 'One')")
+        conn.close()
+        self.browser = load_tool("cdrip-sqlite-discbrowser.py")
+        self.db = self.browser.DB(self.path)
+        # another process's connection, such as the rip handler's
+        self.other = sqlite3.connect(self.path)
+
+    def tearDown(self):
+        self.other.close()
+        self.db.close()
+        self.folder.cleanup()
+
+    def titles(self, filter_text=None):
+        return [row["track_title"] for row in self.db.get_tracks(filter_text)]
+
+    def test_served_from_cache_until_the_data_changes(self):
+        self.assertEqual(self.titles(), ["One"])
+        self.assertEqual(self.titles(), ["One"])
+        self.assertEqual((self.db.cache.hits, self.db.cache.misses), (1, 1))
+        # uncommitted changes elsewhere aren't visible, the cached result still stands
+        self.other.execute("INSERT INTO written_tracks (title, track_id, track_title) VALUES ('Album', 'T02 a1b2c3d4', 'Two')")
+        self.assertEqual(self.titles(), ["One"])
+        self.assertEqual(self.db.cache.hits, 2)
+        self.other.commit()
+        self.assertEqual(self.titles(), ["One", "Two"])
+        self.assertEqual(self.db.cache.misses, 2)
+
+    def test_own_edits(self):
+        self.assertEqual(self.titles("One"), ["One"])
+        self.db.insert_track("Album", "T03 a1b2c3d4", "Three")
+        self.assertEqual(self.titles(), ["One", "Three"])
+        self.db.delete_track("Album", "T01 a1b2c3d4")
+        self.assertEqual(self.titles("One"), [])
+        self.assertEqual(self.db.cache.hits, 0)
+
+    def test_least_recently_used_go_first(self):
+        cache = self.browser.ResultCache(max_rows=4)
+        cache.get("a", 1)
+        cache.put("a", 1, [1, 2])
+        cache.put("b", 1, [3])
+        cache.get("a", 1)
+        cache.put("c", 1, [4, 5])
+        self.assertEqual((list(cache.entries), cache.rows), (["a", "c"], 4))
+        cache.put("huge", 1, list(range(5)))
+        self.assertNotIn("huge", cache.entries)
+        # a put under an old stamp is dropped, a get under a new one empties the cache
+        cache.put("d", 0, [6])
+        self.assertNotIn("d", cache.entries)
+        self.assertIsNone(cache.get("a", 2))
+        self.assertEqual(cache.rows, 0)
+
+if __name__ == "__main__":
+    unittest.main()
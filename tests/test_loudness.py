@@ -0,0 +1,100 @@
+"""
+cdrip-loudness.py against known reference levels: the filter coefficients published in
+ITU-R BS.1770-4, the EBU Tech 3341 sine levels, and for bass-heavy material low tones
+and brown noise measured with a plain sample-by-sample K-weighting filter.
+
+Run: python -m pytest tests (or python -m unittest discover tests)
+"""
+
+import os
+import sys
+import math
+import wave
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cdrip_tools import load_tool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RATE = 44100
+
+def reference_lufs(x, stages):
+    """BS.1770 integrated loudness of int16 stereo frames, the filter run one sample at a time."""
+    x = x.astype(float) / 32768.0
+    for b, a in stages:
+        y = np.empty_like(x)
+        for ch in range(2):
+            x1 = x2 = y1 = y2 = 0.0
+            col = y[:, ch]
+            for i, v in enumerate(x[:, ch].tolist()):
+                out = b[0] * v + b[1] * x1 + b[2] * x2 - a[1] * y1 - a[2] * y2
+                x2, x1, y2, y1 = x1, v, y1, out
+                col[i] = out
+        x = y
+    block = RATE // 10
+    z = (x[:len(x) // block * block].reshape(-1, block, 2) ** 2).mean(axis=1)
+    power = np.array([z[i:i + 4].mean(axis=0).sum() for i in range(len(z) - 3)])
+    loudness = -0.691 + 10 * np.log10(power)
+    gated = loudness > -70
+    gated &= loudness > -0.691 + 10 * np.log10(power[gated].mean()) - 10
+    return -0.691 + 10 * math.log10(power[gated].mean())
+
+@unittest.skipIf(np is None, "the analysis tools need numpy")
+class LoudnessTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.loudness = load_tool("cdrip-loudness.py")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def measure(self, frames):
+        path = os.path.join(self.folder.name, "test.wav")
+        with wave.open(path, "wb") as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(RATE)
+            w.writeframes(frames.astype("<i2").tobytes())
+        return self.loudness.analyse(path)["integrated_lufs"]
+
+    def sine(self, frequency, dbfs, seconds):
+        t = np.arange(int(seconds * RATE)) / RATE
+        v = np.round(32767 * 10 ** (dbfs / 20) * np.sin(2 * np.pi * frequency * t))
+        return np.repeat(v[:, None], 2, axis=1)
+
+    def test_filter_matches_bs1770(self):
+        shelf, highpass = self.loudness.k_weighting(48000)
+        np.testing.assert_allclose(shelf[0], [1.53512485958697, -2.69169618940638, 1.19839281085285], atol=1e-12)
+        np.testing.assert_allclose(shelf[1], [1.0, -1.69065929318241, 0.73248077421585], atol=1e-12)
+        np.testing.assert_allclose(highpass[0], [1.0, -2.0, 1.0], atol=1e-12)
+        np.testing.assert_allclose(highpass[1], [1.0, -1.99004745483398, 0.99007225036621], atol=1e-12)
+
+    def test_ebu_3341_sine_levels(self):
+        # 1 kHz in both channels reads its level in dBFS as LUFS, to within 0.1 LU
+        self.assertAlmostEqual(self.measure(self.sine(1000, -23, 20)), -23.0, delta=0.1)
+        self.assertAlmostEqual(self.measure(self.sine(1000, -33, 20)), -33.0, delta=0.1)
+
+    def test_low_tones(self):
+        # a steady tone comes out at the filter's gain at its frequency
+        stages = self.loudness.k_weighting()
+        for frequency in (15, 30, 60):
+            z = np.exp(-2j * np.pi * frequency / RATE * np.arange(3))
+            gain = math.prod(abs(np.dot(b, z) / np.dot(a, z)) for b, a in stages)
+            expected = -0.691 - 20 + 20 * math.log10(gain)
+            self.assertAlmostEqual(self.measure(self.sine(frequency, -20, 70)), expected, delta=0.05,
+                                   msg=f"{frequency} Hz")
+
+    def test_brown_noise(self):
+        rng = np.random.default_rng(1770)
+        x = np.cumsum(rng.standard_normal((3 * RATE, 2)), axis=0)
+        x -= x.mean(axis=0)
+        frames = np.round(x * (16000 / np.abs(x).max()))
+        self.assertAlmostEqual(self.measure(frames), reference_lufs(frames, self.loudness.k_weighting()), delta=0.02)
+
+if __name__ == "__main__":
+    unittest.main()
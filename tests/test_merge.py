@@ -0,0 +1,92 @@
+"""
+The DB browser's one-step merges of duplicate album and track titles (DB.merge_albums,
+DB.merge_tracks), on a scratch ripped.db made by the rip handler.
+
+Run: python -m pytest tests (or python -m unittest discover tests)
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cdrip_tools import load_tool
+
+try:
+    import tkinter
+except ImportError:
+    tkinter = None
+
+SEP = "\x1f"
+
+@unittest.skipIf(tkinter is None, "the DB browser needs tkinter")
+class MergeTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        path = os.path.join(self.folder.name, "ripped.db")
+        conn = load_tool("cdrip-sqlite.py").open_db(path)
+        with conn:
+            # the same disc filed under two spellings, both holding its first track
+            conn.executemany("INSERT INTO written_tracks (title, track_id, track_title) VALUES (?, ?, ?)", [
+                ("Abbey Road", "T01 a1b2c3d4", "Come Together"),
+                ("Abbey Road", "T02 a1b2c3d4", "Something"),
+                ("Abbey Raod", "T01 a1b2c3d4", "Come Togther"),
+                ("Abbey Raod", "T03 a1b2c3d4", "Maxwell's Silver Hammer"),
+            ])
+            conn.executemany("INSERT INTO written_discs (title, cddb_id) VALUES (?, ?)",
+                             [("Abbey Road", "a1b2c3d4"), ("Abbey Raod", "a1b2c3d4"), ("Abbey Raod", "0f0f0f0f")])
+            conn.executemany("INSERT INTO disc_payloads (title, cddb_id, kept, payload) VALUES (?, ?, ?, ?)",
+                             [("Abbey Road", "a1b2c3d4", 2, b"canonical"), ("Abbey Raod", "a1b2c3d4", 1, b"other")])
+            conn.executemany("INSERT INTO title_aliases (kind, alias, title) VALUES (?, ?, ?)", [
+                ("track", f"Abbey Road{SEP}Come Togehter", "Come Together"),
+                ("track", f"Abbey Raod{SEP}Come Togehter", "Come Togther"),
+                ("track", f"Abbey Raod{SEP}Somthing", "Something"),
+            ])
+        conn.close()
+        self.db = load_tool("cdrip-sqlite-discbrowser.py").DB(path)
+
+    def tearDown(self):
+        self.db.close()
+        self.folder.cleanup()
+
+    def select(self, sql, *args):
+        return sorted(tuple(row) for row in self.db.conn.execute(sql, args))
+
+    def test_merge_albums_keeps_the_canonical_rows(self):
+        self.db.merge_albums("Abbey Road", ["Abbey Road", "Abbey Raod"])
+        self.assertEqual(self.select("SELECT title, track_id, track_title FROM written_tracks"), [
+            ("Abbey Road", "T01 a1b2c3d4", "Come Together"),
+            ("Abbey Road", "T02 a1b2c3d4", "Something"),
+            ("Abbey Road", "T03 a1b2c3d4", "Maxwell's Silver Hammer"),
+        ])
+        self.assertEqual(self.select("SELECT title, cddb_id FROM written_discs"),
+                         [("Abbey Road", "0f0f0f0f"), ("Abbey Road", "a1b2c3d4")])
+        self.assertEqual(self.select("SELECT title, kept, payload FROM disc_payloads"),
+                         [("Abbey Road", 2, b"canonical")])
+        self.assertEqual(self.select("SELECT kind, alias, title FROM title_aliases"), [
+            ("album", "Abbey Raod", "Abbey Road"),
+            ("track", f"Abbey Road{SEP}Come Togehter", "Come Together"),
+            ("track", f"Abbey Road{SEP}Somthing", "Something"),
+        ])
+
+    def test_merge_tracks_renames_within_the_album(self):
+        self.db.merge_tracks(("Abbey Road", "Come Together"), [("Abbey Raod", "Come Togther")])
+        self.assertEqual(self.select("SELECT track_id, track_title FROM written_tracks WHERE title='Abbey Raod'"),
+                         [("T01 a1b2c3d4", "Come Together"), ("T03 a1b2c3d4", "Maxwell's Silver Hammer")])
+        self.assertIn(("track", f"Abbey Raod{SEP}Come Togther", "Come Together"),
+                      self.select("SELECT kind, alias, title FROM title_aliases"))
+
+    def test_merge_tracks_refuses_other_track_numbers(self):
+        other = [("Abbey Raod", "Maxwell's Silver Hammer")]
+        with self.assertRaises(ValueError):
+            self.db.merge_tracks(("Abbey Road", "Come Together"), other)
+        self.assertEqual(self.select("SELECT track_title FROM written_tracks WHERE track_id='T03 a1b2c3d4'"),
+                         [("Maxwell's Silver Hammer",)])
+        self.db.merge_tracks(("Abbey Road", "Come Together"), other, force=True)
+        self.assertEqual(self.select("SELECT track_title FROM written_tracks WHERE track_id='T03 a1b2c3d4'"),
+                         [("Come Together",)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Audio analysis actions carried out through the outbox, the way cdrip-sqlite.py queues
+them: several kept tracks per action, drained by cdrip-sqlite-outbox.py.
+
+Run: python -m pytest tests (or python -m unittest discover tests)
+"""
+
+import os
+import sys
+import math
+import wave
+import array
+import sqlite3
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cdrip_tools import load_tool
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def write_wav(path, seconds, frequency, fade=0.0):
+    """16-bit 44.1 kHz stereo: a second of silence, the tone (faded out over its last `fade` seconds), a second of silence."""
+    rate = 44100
+    samples = array.array("h", bytes(4 * rate))
+    tone = int(seconds * rate)
+    for n in range(tone):
+        gain = min(1.0, (tone - n) / (fade * rate)) if fade else 1.0
+        v = int(16000 * gain * math.sin(2 * math.pi * frequency * n / rate))
+        samples.extend((v, v))
+    samples.extend(array.array("h", bytes(4 * rate)))
+    with wave.open(path, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+
+@unittest.skipIf(numpy is None, "the analysis tools need numpy")
+class OutboxAnalysisTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.folder.name, "ripped.db")
+        self.tracks = []
+        for n, (seconds, fade) in enumerate([(3, 0.0), (4, 2.0), (2, 0.0)], 1):
+            path = os.path.join(self.folder.name, f"T{n:02}.wav")
+            write_wav(path, seconds, 440 * n, fade)
+            self.tracks.append([f"T{n:02} a1b2c3d4", path])
+        self.handler = load_tool("cdrip-sqlite.py")
+        self.outbox = load_tool("cdrip-sqlite-outbox.py")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def drain(self, kind):
+        conn = self.handler.open_db(self.db)
+        self.handler.queue_effects(conn.cursor(), [(kind, {"title": "Album", "tracks": self.tracks})])
+        conn.commit()
+        conn.close()
+        conn = self.outbox.open_db(self.db)
+        try:
+            self.outbox.drain(conn, verbose=False)
+            return conn.execute("SELECT state, attempts, last_error FROM outbox").fetchall()
+        finally:
+            conn.close()
+
+    def rows(self, table, columns):
+        conn = sqlite3.connect(self.db)
+        try:
+            return {row[0]: row[1:] for row in conn.execute(f"SELECT track_id, {columns} FROM {table} WHERE title='Album'")}
+        finally:
+            conn.close()
+
+    def test_loudness_of_several_tracks(self):
+        self.assertEqual(self.drain("loudness"), [("done", 1, None)])
+        rows = self.rows("track_loudness", "integrated_lufs, gain_db")
+        self.assertEqual(sorted(rows), [t[0] for t in self.tracks])
+        for lufs, gain in rows.values():
+            self.assertLess(lufs, 0)
+            self.assertIsNotNone(gain)
+
+    def test_failed_loudness_action_is_retried(self):
+        self.tracks = [[t[0], t[1] + ".missing"] for t in self.tracks]
+        (state, attempts, error), = self.drain("loudness")
+        self.assertEqual((state, attempts), ("pending", 1))
+        self.assertIn("cdrip-loudness.py exited with 1", error)
+
+    def test_cues_of_several_tracks(self):
+        self.assertEqual(self.drain("cues"), [("done", 1, None)])
+        rows = self.rows("track_cues", "audio_start, fade_start, audio_end")
+        self.assertEqual(sorted(rows), [t[0] for t in self.tracks])
+        # every tone starts after a second of silence and is followed by another
+        for (track_id, _), seconds in zip(self.tracks, (3, 4, 2)):
+            start, fade, end = rows[track_id]
+            self.assertAlmostEqual(start, 1.0, delta=0.02)
+            self.assertAlmostEqual(end, 1.0 + seconds, delta=0.3)
+            self.assertLessEqual(fade, end)
+        # the one with a two second fade-out gets its segue point well before the end
+        self.assertLess(rows["T02 a1b2c3d4"][1], 5.0 - 0.5)
+
+    def test_failed_cues_action_is_retried(self):
+        self.tracks = [[t[0], t[1] + ".missing"] for t in self.tracks]
+        (state, attempts, error), = self.drain("cues")
+        self.assertEqual((state, attempts), ("pending", 1))
+        self.assertIn("cdrip-cues.py exited with 1", error)
+
+if __name__ == "__main__":
+    unittest.main()
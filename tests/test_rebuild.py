@@ -0,0 +1,112 @@
+"""
+What cdrip-sqlite-rebuild.py makes of the names and tags of archived WAV files.
+
+Run: python -m pytest tests (or python -m unittest discover tests)
+"""
+
+import os
+import sys
+import wave
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cdrip_tools import load_tool
+
+def write_wav(path, seconds=1):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with wave.open(path, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(44100)
+        w.writeframes(b"\0" * (176400 * seconds))
+    return path
+
+class ParseTrackTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.rebuild = load_tool("cdrip-sqlite-rebuild.py")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def parse(self, *parts, seconds=1):
+        return self.rebuild.parse_track(write_wav(os.path.join(self.folder.name, *parts), seconds))
+
+    def test_track_id(self):
+        t = self.parse("Album", "T03 A1B2C3D4 - 99 Luftballons.wav", seconds=2)
+        self.assertEqual((t["album"], t["cddb_id"], t["number"], t["title"]),
+                         ("Album", "A1B2C3D4", 3, "99 Luftballons"))
+        self.assertEqual(t["length_bytes"], 2 * 176400)
+        self.assertAlmostEqual(t["seconds"], 2.0)
+
+    def test_cddb_id_keeps_its_case(self):
+        # the handler's track ids are "T03 " + the id as BreakawayCD sent it
+        self.assertEqual(self.parse("Album", "T01 a1B2c3D4.wav")["cddb_id"], "a1B2c3D4")
+        self.assertEqual(self.parse("Album [DEADBEEF]", "01 Title.wav")["cddb_id"], "DEADBEEF")
+
+    def test_leading_number_and_folder_id(self):
+        t = self.parse("Album Title [a1b2c3d4]", "07 - Title.wav")
+        self.assertEqual((t["album"], t["cddb_id"], t["number"], t["title"]),
+                         ("Album Title", "a1b2c3d4", 7, "Title"))
+        t = self.parse("Album (0f0f0f0f)", "Track 12.wav")
+        self.assertEqual((t["album"], t["cddb_id"], t["number"]), ("Album", "0f0f0f0f", 12))
+
+    def test_id_in_file_name(self):
+        t = self.parse("Album", "05 Title [a1b2c3d4].wav")
+        self.assertEqual((t["cddb_id"], t["number"], t["title"]), ("a1b2c3d4", 5, "Title"))
+
+    def test_tags_win(self):
+        path = write_wav(os.path.join(self.folder.name, "Folder [a1b2c3d4]", "01 Name.wav"))
+        tags = load_tool("cdrip-tags.py")
+        tags.tag_file(path, tags.info_tags("Real Album", "Real Title", 4, "FFEEDDCC", "2026-01-02"))
+        t = self.rebuild.parse_track(path)
+        self.assertEqual((t["album"], t["cddb_id"], t["number"], t["title"], t["date"]),
+                         ("Real Album", "FFEEDDCC", 4, "Real Title", "2026-01-02"))
+
+    def test_unusable_files(self):
+        with self.assertRaisesRegex(ValueError, "CDDB id"):
+            self.parse("Album", "01 Title.wav")
+        with self.assertRaisesRegex(ValueError, "track number"):
+            self.parse("Album [a1b2c3d4]", "Title.wav")
+        path = os.path.join(self.folder.name, "Album", "T01 a1b2c3d4.wav")
+        with open(path, "wb") as f:
+            f.write(b"not a wav")
+        with self.assertRaises(ValueError):
+            self.rebuild.parse_track(path)
+
+class RebuildTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.rebuild = load_tool("cdrip-sqlite-rebuild.py")
+        # the whole archive in one top folder, the albums below it
+        self.archive = os.path.join(self.folder.name, "archive")
+        for album, cddb_id in (("One", "a1b2c3d4"), ("Two", "B1B2C3D4")):
+            for n in range(1, 6):
+                write_wav(os.path.join(self.archive, "CDs", f"{album} [{cddb_id}]", f"{n:02} Track {n}.wav"))
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_one_top_folder_is_split(self):
+        with mock.patch.object(self.rebuild, "FILES_PER_TASK", 3):
+            batches = list(self.rebuild.tasks(self.archive))
+        self.assertEqual([len(b) for b in batches], [3, 3, 3, 1])
+        self.assertEqual(len({path for b in batches for path in b}), 10)
+
+    def test_rows(self):
+        db = os.path.join(self.folder.name, "ripped.db")
+        with mock.patch.object(self.rebuild, "FILES_PER_TASK", 3):
+            self.assertEqual(self.rebuild.rebuild(self.archive, db, workers=2, verbose=False)[:3], (10, 2, 0))
+        conn = sqlite3.connect(db)
+        try:
+            self.assertEqual(conn.execute("SELECT title, cddb_id, tracks FROM disc_payloads ORDER BY title").fetchall(),
+                             [("One", "a1b2c3d4", 5), ("Two", "B1B2C3D4", 5)])
+            self.assertIn(("Two", "T05 B1B2C3D4", "Track 5"), conn.execute("SELECT * FROM written_tracks").fetchall())
+        finally:
+            conn.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+"""
+cdrip-sqlite-sync.py between two stations sharing a sync folder: changes travel both
+ways, conflicting changes settle the same way on both sides, and a deletion keeps an
+older insert from bringing its row back.
+
+Run: python -m pytest tests (or python -m unittest discover tests)
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cdrip_tools import load_tool
+
+class SyncTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.shared = os.path.join(self.folder.name, "shared")
+        self.sync = load_tool("cdrip-sqlite-sync.py")
+        handler = load_tool("cdrip-sqlite.py")
+        self.stations = {}
+        for name in ("STUDIO-A", "STUDIO-B"):
+            path = os.path.join(self.folder.name, f"{name}.db")
+            handler.open_db(path).close()
+            conn = self.sync.open_db(path)
+            self.sync.init(conn, name)
+            self.stations[name] = conn
+        self.a, self.b = self.stations["STUDIO-A"], self.stations["STUDIO-B"]
+
+    def tearDown(self):
+        for conn in self.stations.values():
+            conn.close()
+        self.folder.cleanup()
+
+    def later(self):
+        # the change log's timestamps have millisecond resolution
+        time.sleep(0.01)
+
+    def export(self, *conns):
+        for conn in conns:
+            self.sync.export(conn, self.shared)
+
+    def import_(self, *conns):
+        return [self.sync.import_all(conn, self.shared, verbose=False) for conn in conns]
+
+    def tracks(self, conn):
+        return conn.execute("SELECT title, track_id, track_title FROM written_tracks ORDER BY track_id").fetchall()
+
+    def test_changes_travel_and_are_not_echoed(self):
+        self.a.execute("INSERT INTO written_tracks VALUES ('Album', 'T01 a1b2c3d4', 'One')")
+        self.a.execute("INSERT INTO written_discs VALUES ('Album', 'a1b2c3d4')")
+        self.export(self.a)
+        self.assertEqual(self.import_(self.b), [(2, 0)])
+        self.assertEqual(self.tracks(self.b), [("Album", "T01 a1b2c3d4", "One")])
+        self.assertEqual(self.b.execute("SELECT * FROM written_discs").fetchall(), [("Album", "a1b2c3d4")])
+        # what B applied isn't B's change to send back
+        self.assertEqual(self.b.execute("SELECT count(*) FROM sync_changes").fetchone(), (0,))
+        self.assertEqual(self.import_(self.a, self.b), [(0, 0), (0, 0)])
+
+    def test_newest_change_wins(self):
+        self.a.execute("INSERT INTO written_tracks VALUES ('Album', 'T01 a1b2c3d4', 'Old')")
+        self.export(self.a)
+        self.import_(self.b)
+        # both stations retitle the track, B last
+        self.a.execute("UPDATE written_tracks SET track_title='From A'")
+        self.later()
+        self.b.execute("UPDATE written_tracks SET track_title='From B'")
+        self.export(self.a, self.b)
+        self.assertEqual(self.import_(self.a, self.b), [(1, 0), (0, 1)])
+        for conn in (self.a, self.b):
+            self.assertEqual(self.tracks(conn), [("Album", "T01 a1b2c3d4", "From B")])
+
+    def test_equal_timestamps_go_to_the_last_station_name(self):
+        self.a.execute("INSERT INTO written_tracks VALUES ('Album', 'T01 a1b2c3d4', 'From A')")
+        ts = self.a.execute("SELECT ts FROM sync_versions").fetchone()[0]
+        for station, title in (("STUDIO-0", "From 0"), ("STUDIO-Z", "From Z")):
+            os.makedirs(os.path.join(self.shared, station))
+            with gzip.open(os.path.join(self.shared, station, "000000000001-000000000001.cdsync"), "wt") as f:
+                f.write(json.dumps({"station": station, "from": 1, "to": 1}) + "\n")
+                f.write(json.dumps(["tracks", "Album", "T01 a1b2c3d4", title, "U", ts]) + "\n")
+        self.import_(self.a)
+        self.assertEqual(self.tracks(self.a), [("Album", "T01 a1b2c3d4", "From Z")])
+        self.assertEqual(self.a.execute("SELECT station FROM sync_versions").fetchone(), ("STUDIO-Z",))
+
+    def test_deletion_keeps_an_older_insert_out(self):
+        # A archives the track; B, not having heard of it yet, archives and then deletes it
+        self.a.execute("INSERT INTO written_tracks VALUES ('Album', 'T01 a1b2c3d4', 'One')")
+        self.export(self.a)
+        self.later()
+        self.b.execute("INSERT INTO written_tracks VALUES ('Album', 'T01 a1b2c3d4', 'One')")
+        self.b.execute("DELETE FROM written_tracks")
+        self.export(self.b)
+        self.assertEqual(self.import_(self.b, self.a), [(0, 1), (1, 0)])
+        for conn in (self.a, self.b):
+            self.assertEqual(self.tracks(conn), [])
+            self.assertEqual(conn.execute("SELECT station FROM sync_versions").fetchall(), [("STUDIO-B",)])
+
+    def test_renamed_key_is_a_deletion(self):
+        self.a.execute("INSERT INTO written_discs VALUES ('Abbey Raod', 'a1b2c3d4')")
+        self.export(self.a)
+        self.import_(self.b)
+        self.a.execute("UPDATE written_discs SET title='Abbey Road'")
+        self.export(self.a)
+        self.import_(self.b)
+        self.assertEqual(self.b.execute("SELECT * FROM written_discs").fetchall(), [("Abbey Road", "a1b2c3d4")])
+
+if __name__ == "__main__":
+    unittest.main()
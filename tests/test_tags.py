@@ -0,0 +1,100 @@
+"""
+cdrip-tags.py writing LIST/INFO and ID3 tags into WAV files: the tags read back, the
+other tags in the file are kept, and the audio bytes are never changed.
+
+Run: python -m pytest tests (or python -m unittest discover tests)
+"""
+
+import os
+import sys
+import wave
+import random
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cdrip_tools import load_tool
+
+class TagsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.tags = load_tool("cdrip-tags.py")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def write_wav(self, channels=2, width=2, frames=44100):
+        path = os.path.join(self.folder.name, f"test-{channels}-{width}-{frames}.wav")
+        audio = random.Random(frames).randbytes(channels * width * frames)
+        with wave.open(path, "wb") as w:
+            w.setnchannels(channels)
+            w.setsampwidth(width)
+            w.setframerate(44100)
+            w.writeframes(audio)
+        return path, audio
+
+    def chunk(self, path, cid):
+        with open(path, "rb") as f:
+            chunks, _ = self.tags.read_chunks(f)
+            found = [(off, size) for c, off, size in chunks if c == cid]
+            self.assertEqual(len(found), 1, cid)
+            f.seek(found[0][0] + 8)
+            return f.read(found[0][1])
+
+    def assert_audio(self, path, audio):
+        self.assertEqual(self.chunk(path, b"data"), audio)
+        with wave.open(path, "rb") as w:
+            self.assertEqual(w.readframes(w.getnframes()), audio)
+
+    def test_round_trip(self):
+        path, audio = self.write_wav()
+        tags = self.tags.info_tags("Album Ä", "Title €", 3, "A1B2C3D4", "2026-01-02")
+        self.assertEqual(self.tags.tag_file(path, tags, id3=True), {"INFO": "appended", "ID3": "appended"})
+        self.assertEqual(self.tags.read_tags(path), tags)
+        self.assert_audio(path, audio)
+        id3 = self.chunk(path, b"id3 ")
+        self.assertEqual(id3[:4], b"ID3\x03")
+        self.assertIn("Title €".encode("utf-16")[2:], id3)
+        self.assertIn("A1B2C3D4".encode("utf-16")[2:], id3)
+        # the rebuild reads the same tags back
+        _, data_bytes, info = load_tool("cdrip-sqlite-rebuild.py").read_wav_header(path)
+        self.assertEqual((data_bytes, info), (len(audio), tags))
+
+    def test_retag(self):
+        path, audio = self.write_wav()
+        tags = self.tags.info_tags("Album", "Title", 3, "a1b2c3d4")
+        self.tags.tag_file(path, tags, id3=True)
+        with open(path, "rb") as f:
+            before = f.read()
+        self.assertEqual(self.tags.tag_file(path, tags, id3=True), {"INFO": "unchanged", "ID3": "unchanged"})
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), before)
+
+        # a tag of someone else's is kept, and a longer title fits in the room left after the chunk
+        self.tags.tag_file(path, {"IART": "Artist"})
+        tags = self.tags.info_tags("Album", "A Longer Title", 3, "a1b2c3d4")
+        self.assertEqual(self.tags.tag_file(path, tags, id3=True), {"INFO": "in place", "ID3": "in place"})
+        self.assertEqual(self.tags.read_tags(path), dict(tags, IART="Artist"))
+        self.assertEqual(os.path.getsize(path), len(before))
+        self.assert_audio(path, audio)
+
+    def test_odd_sized_data(self):
+        # 8-bit mono with an odd number of frames: the appended chunk starts after a pad byte
+        path, audio = self.write_wav(channels=1, width=1, frames=1001)
+        tags = self.tags.info_tags("Album", "Title", 1, "a1b2c3d4")
+        self.tags.tag_file(path, tags)
+        self.assertEqual(self.tags.read_tags(path), tags)
+        self.assert_audio(path, audio)
+
+    def test_not_a_wav(self):
+        path = os.path.join(self.folder.name, "not.wav")
+        with open(path, "wb") as f:
+            f.write(b"ID3\x03" + bytes(100))
+        results, errors = self.tags.tag_tracks([{"path": path, "album": "Album", "title": "Title",
+                                                  "number": 1, "cddb_id": "a1b2c3d4"}])
+        self.assertEqual((results, list(errors)), ({}, [path]))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"ID3\x03" + bytes(100))
+
+if __name__ == "__main__":
+    unittest.main()